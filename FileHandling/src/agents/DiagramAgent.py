@@ -1,23 +1,24 @@
-import litellm
 import json
 from typing import List, Dict, Any
 from utils.Message import Message
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
 from utils.Context import Context
 from agents.IAgent import IAgent
-from agents.schema.ClassDiagramSchema import JSON_CLASS_DIAGRAM_SCHEMA_STRING, VALIDATE_SCHEMA_CLASS_DIAGRAM
-import re
+from utils.Compaction import CompactionPolicy
+from utils.ContextAssembler import assemble_project_context
+from utils.TokenCounter import count_text_tokens
+from utils import LLMClient
+from agents.schema.DiagramSchemaRegistry import DIAGRAM_TYPE, DiagramSchema, schema_for
 from utils.Project import Project
+from utils.StreamExtractor import StreamExtractor
 
-class DIAGRAM_TYPE:
-    CLASS_DIAGRAM = "UML Class Diagram"
-    SEQUENCE_DIAGRAM = "UML Sequence Diagram"
-    ACTIVITY_DIAGRAM = "UML Activity Diagram"
-    STATE_DIAGRAM = "UML State Diagram"
-    USE_CASE_DIAGRAM = "UML Use Case Diagram"
-
+# Approximate size of the fixed instructions in the init prompt
+INSTRUCTION_TOKENS = 1000
 
 class ClassDiagramAgent(IAgent):
+    # Diagram edits are small JSON patches, so a short history is enough
+    compaction_policy = CompactionPolicy(max_tokens=32000, keep_recent_messages=6)
+
     def __init__(self, name: str, model: str, project: Project = None):
         self.name = name
         self.model = model
@@ -26,63 +27,62 @@ class ClassDiagramAgent(IAgent):
         if project:
             self.update_context(project.context)
 
-    def _extract_json_content(self, content: str) -> Dict[str, Any]:
+    def _extract_json_content(self, content: str, schema: DiagramSchema | None = None) -> Dict[str, Any]:
+        """Return the first JSON object in the response that matches `schema` (any object if None), or {}."""
         # Look for JSON content that might be within ```json ... ``` blocks or standalone
-        json_pattern = r'```(?:json)?\s*([\s\S]*?)```|(\{[\s\S]*\})'
-        matches = re.findall(json_pattern, content)
-        
-        for match in matches:
-            # Each match is a tuple with groups from the regex
-            json_str = match[0] if match[0] else match[1]
-            if json_str.strip():
-                try:
-                    # Parse and validate the JSON
-                    json_data = json.loads(json_str)
-                    try:
-                        validate(instance=json_data, schema=VALIDATE_SCHEMA_CLASS_DIAGRAM)
-                        return json_data
-                    except ValidationError:
-                        continue  # Try next match if this one fails validation
-                except json.JSONDecodeError:
-                    continue  # Try next match if this one isn't valid JSON
-        
+        for json_str in StreamExtractor.scan(content, json_objects=True).json_candidates():
+            try:
+                json_data = json.loads(json_str)
+            except json.JSONDecodeError:
+                continue  # Try next match if this one isn't valid JSON
+            if not isinstance(json_data, dict):
+                continue
+            if schema is None or schema.is_valid(json_data):
+                return json_data
+            # Try next match if this one fails validation
+
         # If no valid JSON was found
         return {}
+
+    def _schema_for(self, diagram_type: DIAGRAM_TYPE):
+        """
+        Return the diagram type name, the JSON schema shown to the model and the
+        schema to validate against (None if the diagram type has no schema).
+        """
+        diagram_type_str = diagram_type.value if hasattr(diagram_type, "value") else diagram_type
+        schema = schema_for(diagram_type_str)
+        return diagram_type_str, schema.prompt_schema if schema else "", schema
+
     def _init_info(self, context: Context, diagram_type:DIAGRAM_TYPE):
         for key in context.requirements:
             # if any value is empty, return None
             if not context.requirements[key]:
                 print("Requirement key '%s' is empty. Skipping generation.", key)
-                return None
+                return None, None, None
         # Check if the CSV file is empty - Assuming csv_description holds content or path
         if not context.csv_description:
             print("CSV description is empty. Skipping generation.")
-            return None
+            return None, None, None
         program_features_str = ""
         if context.requirements.features:
             program_features_str = "\n".join([f"  + {feature_name}: {feature_desc}" for feature_name, feature_desc in context.requirements.features.items()] )
 
-        generated_text_doc_str = ""
-        if context.generated_text_doc:
-            generated_text_doc_str = "\n".join([f"  === {doc_name}:\n{doc_text}\n===" for doc_name, doc_text in context.generated_text_doc.items()]) # Added newline for clarity
-        diagram_type_str = diagram_type.value if isinstance(diagram_type, DIAGRAM_TYPE) else diagram_type
-        diagram_json_schema_string = ""
-        validate_schema = None
-        if diagram_type == DIAGRAM_TYPE.CLASS_DIAGRAM:
-            diagram_json_schema_string = JSON_CLASS_DIAGRAM_SCHEMA_STRING
-            validate_schema = VALIDATE_SCHEMA_CLASS_DIAGRAM
-        if diagram_type == DIAGRAM_TYPE.SEQUENCE_DIAGRAM:
-            diagram_json_schema_string = JSON_CLASS_DIAGRAM_SCHEMA_STRING
-            validate_schema = VALIDATE_SCHEMA_CLASS_DIAGRAM
-        if diagram_type == DIAGRAM_TYPE.ACTIVITY_DIAGRAM:
-            diagram_json_schema_string = JSON_CLASS_DIAGRAM_SCHEMA_STRING
-            validate_schema = VALIDATE_SCHEMA_CLASS_DIAGRAM
-        if diagram_type == DIAGRAM_TYPE.STATE_DIAGRAM:
-            diagram_json_schema_string = JSON_CLASS_DIAGRAM_SCHEMA_STRING
-            validate_schema = VALIDATE_SCHEMA_CLASS_DIAGRAM
-        if diagram_type == DIAGRAM_TYPE.USE_CASE_DIAGRAM:
-            diagram_json_schema_string = JSON_CLASS_DIAGRAM_SCHEMA_STRING
-            validate_schema = VALIDATE_SCHEMA_CLASS_DIAGRAM
+        diagram_type_str, diagram_json_schema_string, validate_schema = self._schema_for(diagram_type)
+        if validate_schema is None:
+            print(f"No schema is defined for '{diagram_type_str}'. Skipping generation.")
+            return None, None, None
+        # Fit the previous documents, diagrams and CSV data into the model's context budget
+        requirements_str = "\n".join([context.requirements.input_description, context.requirements.output_description,
+                                      program_features_str, context.tech_stack, context.requirements.further_requirements])
+        reserved_tokens = INSTRUCTION_TOKENS + count_text_tokens(diagram_json_schema_string) + count_text_tokens(requirements_str)
+        kept_context, context_report = context.cached_fragment(
+            f"assembled:{self.model}:{reserved_tokens}:diagrams:{diagram_type_str}:{self.name}",
+            lambda: assemble_project_context(context, self.model, reserved_tokens, include_diagrams=True,
+                                             target=f"{diagram_type_str} {self.name}"))
+        self._record_context_report(context_report)
+        generated_text_doc_str = "\n".join([f"  === {doc_name}:\n{kept_context[f'doc:{doc_name}']}\n===" for doc_name in context.generated_text_doc if f"doc:{doc_name}" in kept_context]) # Added newline for clarity
+        generated_diagram_str = "\n".join([f"  === {diagram_name}:\n{kept_context[f'diagram:{diagram_name}']}\n===" for diagram_name in context.generated_diagram if f"diagram:{diagram_name}" in kept_context])
+        csv_data_str = "\n".join([f"  === Table {index + 1}:\n{kept_context[f'csv:{index + 1}']}\n===" for index in range(len(context.csv_description)) if f"csv:{index + 1}" in kept_context])
         text = f'''
 You are a {diagram_type_str} generator. You are writing a {diagram_type_str} for the following project. You are very meticulous and you pay attention to every detail. You will have to try your best to analyze the project and generate a diagram that is as accurate as possible. You will have to follow the schema strictly, the infomation about the diagram will be in json format between ```json ... ``` blocks. You will have to generate the {diagram_type_str} in json format. The json format is as follows:
 ```json
@@ -96,12 +96,14 @@ Here is the infomation about the project:
 - The program features: {program_features_str}
 - Here is the tech stack of the program: {context.tech_stack}
 - The program further requirements: {context.requirements.further_requirements}
+- The project data extracted from the spreadsheets (CSV tables):
+{csv_data_str}
 
 Here is the generated text document, it contains the irreplaceable information about the project, you will have to follow it strictly, do not ignore any information in it:
 {generated_text_doc_str}
 
 Here is the previous generated diagram, you will have to follow it strictly, do not create any contradicting infomation with previous generated diagram:
-{context.generated_diagram}
+{generated_diagram_str}
 
 Remember to validate your document against all requirements, ensure all technical details are accurate, and provide comprehensive coverage of all features and functionalities. Be systematic and leave no aspect undocumented. Your documentation should serve as a definitive reference that anticipates and answers all potential questions users might have about the system.
 Example of the output:
@@ -112,35 +114,103 @@ Your thinking process...
 '''
         return text, validate_schema, diagram_type_str
 
-    def generate(self, context: Context, diagram_type: DIAGRAM_TYPE) -> str | None:
+    def _prepare_generate(self, context: Context, diagram_type: DIAGRAM_TYPE = None):
+        """Set up the conversation for a generation. Returns the schema to validate against, or None."""
+        if diagram_type is None:
+            diagram_type = DIAGRAM_TYPE.CLASS_DIAGRAM if self.diagram_type_str is None else self.diagram_type_str
+        if self._context_unchanged(context, diagram_type):
+            # The init message already reflects this context, only the schema is needed
+            self.diagram_type_str, _, validate_schema = self._schema_for(diagram_type)
+            return validate_schema
         init_message, validate_schema, diagram_type_str = self._init_info(context, diagram_type)
         if not init_message:
             print("Initialization message is empty. Skipping generation.")
             return None
-        self.message.add_user_text(init_message)
-        res = litellm.completion(model=self.model, messages=self.message.get_conversation())
-        self.message.append_llm_response(res)
-        json_content = self._extract_json_content(res)
+        self.diagram_type_str = diagram_type_str
+        self.message.replace_init_message(init_message)
+        self.message.mark_stable_prefix()
+        self._remember_context(context, diagram_type)
+        return validate_schema
+
+    def _finish_generate(self, response_content: str, validate_schema: DiagramSchema) -> str | None:
+        """Record the response and return the validated diagram as pretty-printed JSON."""
+        self.message.append_assistant_text(response_content)
+        # Candidates are validated while they are extracted, so the diagram is not validated again
+        json_content = self._extract_json_content(response_content, validate_schema)
         if not json_content:
-            print("No valid JSON content found in the response.")
+            parsed = self._extract_json_content(response_content)
+            if parsed:
+                try:
+                    validate_schema.validate(parsed)
+                except ValidationError as e:
+                    print(f"Generated JSON does not match schema: {e.message}")
+            else:
+                print("No valid JSON content found in the response.")
+            return None
+        return json.dumps(json_content, indent=4)  # Pretty print JSON
+
+    def generate(self, context: Context, diagram_type: DIAGRAM_TYPE = None) -> str | None:
+        validate_schema = self._prepare_generate(context, diagram_type)
+        if validate_schema is None:
             return None
         try:
-            validate(instance=json_content, schema=validate_schema)
-            return json.dumps(json_content, indent=4)  # Pretty print JSON
-        except ValidationError as e:
-            print(f"Generated JSON does not match schema: {e}")
+            response_content = LLMClient.complete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error during litellm completion: {e}")
             return None
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
+        return self._finish_generate(response_content, validate_schema)
+
+    async def agenerate(self, context: Context, diagram_type: DIAGRAM_TYPE = None) -> str | None:
+        """Asynchronously generate a diagram without blocking the event loop."""
+        validate_schema = self._prepare_generate(context, diagram_type)
+        if validate_schema is None:
             return None
+        try:
+            response_content = await LLMClient.acomplete(self.model, self._conversation())
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            print(f"Error during litellm completion: {e}")
             return None
+        return self._finish_generate(response_content, validate_schema)
+
+    def publish_document(self, context: Context, document: str | Dict[str, Any]) -> tuple[str, str] | None:
+        """
+        Store the diagram (JSON text from a generation, or the object returned by an edit) under its diagram name.
+        Only a diagram matching the full schema is stored, so a partial edit does not replace the stored diagram.
+        """
+        if isinstance(document, dict):
+            diagram = document
+        else:
+            try:
+                diagram = json.loads(document)
+            except json.JSONDecodeError:
+                return None
+        _, _, schema = self._schema_for(self.diagram_type_str or DIAGRAM_TYPE.CLASS_DIAGRAM)
+        if schema is None or not schema.is_valid(diagram):
+            print("The diagram does not match the full schema, the stored diagram is kept.")
+            return None
+        diagram_name = diagram.get("diagramName") or self.name
+        context.set_generated_diagram(diagram_name, diagram)
+        return "diagram", diagram_name
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return the persisted session, including the selected diagram type."""
+        state = super().get_state()
+        state["diagram_type_str"] = self.diagram_type_str
+        return state
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """Restore the session, including the selected diagram type."""
+        super().load_state(state)
+        self.diagram_type_str = state.get("diagram_type_str", self.diagram_type_str)
+
     def update_context(self, context: Context) -> None:
         """Update the agent's context."""
         # Use a default diagram type if none is set
         diagram_type = DIAGRAM_TYPE.CLASS_DIAGRAM if self.diagram_type_str is None else self.diagram_type_str
         
+        if self._context_unchanged(context, diagram_type):
+            return None # Nothing changed since the init message was built
+
         # Pass the diagram type to _init_info
         init_message, _, diagram_type_str = self._init_info(context, diagram_type)
         
@@ -153,13 +223,12 @@ Your thinking process...
         
         # Update the message with the new context
         self.message.replace_init_message(init_message)
-    def edit(self, prompt: str, attached_context: str, context: Context) -> str:
+        self._remember_context(context, diagram_type)
+    def _prepare_edit(self, prompt: str, context: Context) -> bool:
+        """Set up the conversation for an edit. Returns False if the prompt is empty."""
         if not prompt:
             print("Prompt is empty. Skipping editing.")
-            return None
-        if len(prompt) == 0:
-            print("Prompt is empty. Skipping editing.")
-            return None
+            return False
         # Basic validation checks (similar to generate)
         for key in context.requirements:
             if not context.requirements[key]:
@@ -170,17 +239,40 @@ Your thinking process...
             print("CSV description is empty during edit. Context might be incomplete.")
         self.update_context(context)
         self.message.add_user_text(f"You must write the *edit json* based on the previous response, following my instructions precisely. Dont rewrite or repeat unchanged part, just write the changed part into a json. Maintain the structure mention above\n\nMy instructions: {prompt}")
+        return True
+
+    def _finish_edit(self, response_content: str) -> Dict[str, Any] | None:
+        """
+        Record the response and extract the edit JSON from it: a complete diagram
+        if the response holds one, else the changed part only.
+        """
+        self.message.append_assistant_text(response_content)
+        _, _, schema = self._schema_for(self.diagram_type_str or DIAGRAM_TYPE.CLASS_DIAGRAM)
+        json_content = self._extract_json_content(response_content, schema) or self._extract_json_content(response_content)
+        diagram_type = json_content.get("diagramType", None)
+
+        if json_content and diagram_type:
+            return json_content
+        print("No valid JSON content found in the response.")
+        return None
+
+    def edit(self, prompt: str, attached_context: str, context: Context) -> Dict[str, Any] | None:
+        if not self._prepare_edit(prompt, context):
+            return None
         try:
-            response = litellm.completion(model=self.model, messages=self.message.get_conversation())
-            self.message.append_llm_response(response)
-            json_content = self._extract_json_content(response)
-            diagram_type = json_content.get("diagramType", None)
+            response_content = LLMClient.complete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error during litellm completion in edit: {e}")
+            return None
+        return self._finish_edit(response_content)
 
-            if json_content and diagram_type:
-                return json_content
-            else:
-                print("No valid JSON content found in the response.")
-                return None
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
+    async def aedit(self, prompt: str, attached_context: str, context: Context) -> Dict[str, Any] | None:
+        """Asynchronously edit a diagram without blocking the event loop."""
+        if not self._prepare_edit(prompt, context):
+            return None
+        try:
+            response_content = await LLMClient.acomplete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error during litellm completion in edit: {e}")
             return None
+        return self._finish_edit(response_content)
@@ -1,9 +1,21 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Callable, Optional, Tuple
 from utils.Message import Message   
 from utils.Context import Context
+from utils import LLMClient
+from utils.Compaction import CompactionPolicy, extractive_summary, transcript
+from utils.ContextAssembler import ContextAssembler
+from utils.StreamExtractor import StreamExtractor
+from config import settings
 class IAgent(ABC):
     """Interface for agents that can process tasks."""
+    # How the conversation history is compacted; agent types override this default
+    compaction_policy = CompactionPolicy()
+    # What the context assembler kept, summarized, truncated or dropped when the prompt was last built
+    last_context_report: List[Dict[str, Any]] = []
+    # Context version the init message was built from, see _context_unchanged
+    _context_key = None
+
     @abstractmethod
     def generate(self, context:Context) -> str:
         """
@@ -41,3 +53,278 @@ class IAgent(ABC):
             str: The edited document content
         """
         pass
+
+    @abstractmethod
+    async def agenerate(self, context:Context) -> str:
+        """
+        Asynchronous variant of `generate` that does not block the event loop
+        while waiting for the LLM provider.
+
+        Args:
+            context (Context): The project context to generate from
+
+        Returns:
+            str: The processing result
+        """
+        pass
+    @abstractmethod
+    async def aedit(self, prompt:str, attached_context: str, context:Context) -> str:
+        """
+        Asynchronous variant of `edit` that does not block the event loop
+        while waiting for the LLM provider.
+
+        Args:
+            prompt (str): The editing instructions
+            attached_context (str): The context to attach to the document
+            context (Context): The context for the editing process
+
+        Returns:
+            str: The edited document content
+        """
+        pass
+
+    async def astream_generate(self, context:Context) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a generation as events. Agents that support token streaming
+        override this; the default runs `agenerate` and yields only the result.
+
+        Yields:
+            Dict[str, Any]: "token" events with the text as it arrives, then a final "result" event
+        """
+        document = await self.agenerate(context)
+        yield self._result_event(document)
+
+    async def astream_edit(self, prompt:str, attached_context: str, context:Context) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream an edit as events. Agents that support token streaming
+        override this; the default runs `aedit` and yields only the result.
+
+        Yields:
+            Dict[str, Any]: "token" events with the text as it arrives, then a final "result" event
+        """
+        document = await self.aedit(prompt, attached_context, context)
+        yield self._result_event(document)
+
+    def publish_document(self, context:Context, document:Any) -> Optional[Tuple[str, str]]:
+        """
+        Store a generated document in the project context, where the other
+        agents pick it up. Agent types that produce artifacts override this.
+
+        Args:
+            context (Context): The project context
+            document (Any): A document returned by `generate` or `edit`
+
+        Returns:
+            Optional[Tuple[str, str]]: The kind ("doc", "diagram" or "prototype") and name it
+            was stored under, or None if nothing was stored
+        """
+        return None
+
+    async def _astream_completion(self, finish: Callable[[str], Any],
+                                  extractor: Optional[StreamExtractor] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a completion of the current conversation as "token" events,
+        then pass the full response text to `finish` and yield its result.
+
+        Args:
+            finish (Callable[[str], Any]): Records the response and extracts the artifact (None on failure)
+            extractor (Optional[StreamExtractor]): Watches the tokens and yields an "artifact" event as soon
+                as a block it looks for is complete, before the rest of the response arrives
+        """
+        chunks = []
+        try:
+            async for token in LLMClient.astream(self.model, self._conversation()):
+                chunks.append(token)
+                yield {"event": "token", "data": {"text": token}}
+                for artifact in extractor.feed(token) if extractor is not None else ():
+                    yield {"event": "artifact", "data": {"kind": artifact.kind, "language": artifact.language,
+                                                         "start": artifact.start, "end": artifact.end}}
+        except Exception as e:
+            print(f"Error during streaming litellm completion: {e}")
+            yield self._result_event(None, f"LLM call failed: {e}")
+            return
+        yield self._result_event(finish("".join(chunks)))
+
+    @staticmethod
+    def _result_event(document: Any, error: str = None) -> Dict[str, Any]:
+        """Build the final streaming event carrying the extracted artifact and its validation result."""
+        if document is None:
+            return {"event": "result", "data": {
+                "status": "error",
+                "valid": False,
+                "error": error or "Could not extract a valid document from the LLM response.",
+            }}
+        return {"event": "result", "data": {"status": "success", "valid": True, "document": document}}
+
+    @staticmethod
+    async def _document_of(events: AsyncIterator[Dict[str, Any]]) -> Any:
+        """Consume a stream of events and return the document of its final result event (None on failure)."""
+        result = None
+        async for event in events:
+            result = event # The stream ends with the result event
+        return result["data"].get("document") if result is not None else None
+
+    async def _acomplete_with_retries(self, label: str, messages: List[Dict[str, Any]],
+                                      extract: Callable[[str], Any], retries: int) -> Any:
+        """
+        Run one completion and extract its artifact, retrying on its own when
+        the call fails or `extract` returns None. Used for the parts of a
+        document that are generated concurrently, so one failed part does not
+        restart the others.
+
+        Args:
+            label (str): Names the part in the logs, e.g. "Section 'Scope'"
+            messages (List[Dict[str, Any]]): The conversation to complete
+            extract (Callable[[str], Any]): Extracts the artifact from the response (None on failure)
+            retries (int): Attempts after the first one
+
+        Raises:
+            Exception: The error of the last attempt once every attempt failed
+        """
+        last_error = None
+        for attempt in range(retries + 1):
+            try:
+                response_content = await LLMClient.acomplete(self.model, messages)
+            except Exception as e:
+                last_error = self._attempt_failed(label, attempt, e)
+                continue
+            result = extract(response_content)
+            if result is not None:
+                return result
+            last_error = self._attempt_failed(label, attempt)
+        raise last_error
+
+    def _complete_with_retries(self, label: str, messages: List[Dict[str, Any]],
+                               extract: Callable[[str], Any], retries: int) -> Any:
+        """Blocking variant of `_acomplete_with_retries`."""
+        last_error = None
+        for attempt in range(retries + 1):
+            try:
+                response_content = LLMClient.complete(self.model, messages)
+            except Exception as e:
+                last_error = self._attempt_failed(label, attempt, e)
+                continue
+            result = extract(response_content)
+            if result is not None:
+                return result
+            last_error = self._attempt_failed(label, attempt)
+        raise last_error
+
+    @staticmethod
+    def _attempt_failed(label: str, attempt: int, error: Exception = None) -> Exception:
+        """Log a failed attempt and return the error to raise if it was the last one."""
+        if error is not None:
+            print(f"{label} failed (attempt {attempt + 1}): {error}")
+            return error
+        print(f"{label} could not be extracted (attempt {attempt + 1})")
+        return ValueError(f"Nothing could be extracted from the response for {label}")
+
+    def _conversation(self) -> List[Dict[str, Any]]:
+        """Return the conversation to send, marked for provider-side prompt caching when the model supports it."""
+        return self.message.get_conversation(cache_prefix=LLMClient.supports_prompt_caching(self.model))
+
+    def _context_unchanged(self, context: Context, *extra: Any) -> bool:
+        """Whether the init message was built from this exact context version (and extra parameters)."""
+        return bool(self.message.messages) and self._context_key == (id(context), context.version, extra)
+
+    def _remember_context(self, context: Context, *extra: Any) -> None:
+        """Record the context version the init message was built from."""
+        self._context_key = (id(context), context.version, extra)
+
+    def _record_context_report(self, report: List[Dict[str, Any]]) -> None:
+        """Keep the context assembler report and log any section that was cut."""
+        self.last_context_report = report
+        cuts = ContextAssembler.summarize_report(report)
+        if cuts:
+            print(f"Context for agent '{self.name}' was cut to fit the budget: {cuts}")
+
+    def get_compaction_policy(self) -> CompactionPolicy:
+        """Return the compaction policy of this agent type, with overrides from the settings applied."""
+        overrides = settings.COMPACTION_POLICIES.get(self.__class__.__name__)
+        return self.compaction_policy.with_overrides(overrides) if overrides else self.compaction_policy
+
+    async def acompact_history(self) -> bool:
+        """
+        Compact the conversation once it exceeds the policy's token threshold:
+        strip images from old turns, then replace old turns with a summary.
+        The init message and the latest artifact are always kept.
+
+        Returns:
+            bool: True if the conversation was compacted
+        """
+        policy = self.get_compaction_policy()
+        if not policy.enabled:
+            return False
+        tokens_before = self.message.token_count()
+        if tokens_before <= policy.max_tokens:
+            return False
+        old_turns = self.message.compaction_candidates(policy.keep_recent_messages)
+        if not old_turns:
+            return False
+
+        if policy.strip_old_images:
+            self.message.strip_images(old_turns)
+            if self.message.token_count() <= policy.max_tokens:
+                print(f"Compacted '{self.name}' by stripping old images: {tokens_before} -> {self.message.token_count()} tokens")
+                return True
+            old_turns = self.message.compaction_candidates(policy.keep_recent_messages)
+
+        dropped = [self.message.messages[index] for index in old_turns]
+        summary = None
+        if policy.summary_mode == "llm":
+            try:
+                summary = await LLMClient.acomplete(self.model, [{"role": "user", "content": (
+                    "Summarize the following conversation between a user and a document writer. "
+                    "Keep every instruction and decision the user made; omit document bodies.\n\n"
+                    + transcript(dropped, policy.summary_max_chars * 4)
+                )}])
+                summary = summary[:policy.summary_max_chars]
+            except Exception as e:
+                print(f"LLM summarization failed, falling back to an extractive summary: {e}")
+                summary = extractive_summary(dropped, policy.summary_max_chars)
+        elif policy.summary_mode == "extractive":
+            summary = extractive_summary(dropped, policy.summary_max_chars)
+        self.message.replace_turns(old_turns, summary)
+        print(f"Compacted '{self.name}': {tokens_before} -> {self.message.token_count()} tokens, {len(dropped)} turns summarized")
+        return True
+
+    def checkpoint(self) -> tuple:
+        """Return a marker of the current conversation state for `rollback`."""
+        return self.message, self.message.checkpoint(), self._context_key
+
+    def rollback(self, checkpoint: tuple) -> None:
+        """
+        Restore the conversation to a state returned by `checkpoint`. Used when a
+        call is cancelled or fails so no dangling user turn is left behind.
+        Agents that replace their Message object get the original one back.
+        """
+        message, message_checkpoint, context_key = checkpoint
+        message.rollback(message_checkpoint)
+        self.message = message
+        self._context_key = context_key # The restored init message was built from this context
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Return a JSON-serializable snapshot of the agent session so it can be
+        persisted to disk and rehydrated later.
+
+        Returns:
+            Dict[str, Any]: The agent type, name, model and conversation history
+        """
+        return {
+            "agent_type": self.__class__.__name__,
+            "name": self.name,
+            "model": self.model,
+            "message": self.message.to_dict(),
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restore the agent session from a snapshot produced by `get_state`.
+
+        Args:
+            state (Dict[str, Any]): The persisted agent snapshot
+        """
+        self.name = state.get("name", self.name)
+        self.model = state.get("model", self.model)
+        self.message = Message.from_dict(state.get("message", {}))
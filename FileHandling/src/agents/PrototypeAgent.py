@@ -1,22 +1,43 @@
-import litellm
 from pathlib import Path
+import asyncio
 import base64
+import hashlib
+import json
+import os
+from config import settings
 from utils.Project import Project
 from utils.Message import Message
 from agents.IAgent import IAgent
+from utils.Compaction import CompactionPolicy
+from utils import LLMClient
 from utils.Context import Context
+from utils.StreamExtractor import StreamExtractor
+from utils.HtmlPatch import HtmlPatchError, apply_blocks, parse_blocks, validate
+from utils.PrototypeAssembler import Screen, assemble, screen_list
+from typing import Any, AsyncIterator, Dict, List
 
 class PrototypeAgent(IAgent):
-    def __init__(self, model: str):
+    # The conversation is rebuilt on every call; compaction only guards very large edits
+    compaction_policy = CompactionPolicy(max_tokens=96000, keep_recent_messages=4, summary_mode="drop")
+
+    def __init__(self, name: str, model: str, project: Project = None):
+        self.name = name
         self.model = model
         self.message = Message()
+        self.generation_mode = settings.PROTOTYPE_MODE # "single" or "screens"
+        self.edit_mode = settings.PROTOTYPE_EDIT_MODE # "patch" or "rewrite"
+        # Stage-one design specs by spec key (see _spec_key), oldest first
+        self.design_specs: Dict[str, str] = {}
 
-    def generate(self, context: Context) -> str:
-        """Generate a HTML preview of the images in the project."""
+    def _prepare_generate(self, context: Context) -> str | None:
+        """
+        Reset the conversation and attach the images for a generation.
+        Returns fallback HTML if the project has no images, otherwise None.
+        """
         # Initialize message with context if needed
         self.update_context(context)
         
-        if not context.diagram_image or len(context.diagram_image) == 0:
+        if not context.ui_image or len(context.ui_image) == 0:
             # Fallback HTML content if no images are found
             html_content = """
             <html>
@@ -35,18 +56,47 @@ class PrototypeAgent(IAgent):
             return html_content
         
         # Add images to the message
-        for image in context.diagram_image:
-            self.message.add_user_image_from_file(image)
+        for image in context.ui_image:
+            self.message.add_user_image_from_file(image, model=self.model)
+        # The instructions and images are the reusable prefix, the request below is not
+        self.message.mark_stable_prefix()
         
         self.message.add_user_text("From these images, write a detailed prompt to create a preview app using only HTML. Describe the flow process in detail so another AI can understand the full context of the application shown in the images.")
+        return None
+
+    def _spec_key(self, context: Context) -> str:
+        """
+        Identify the inputs of the stage-one design spec: the model, the UI images
+        (by path, size and modification time) and the requirements.
+        """
+        images = []
+        for image in context.ui_image:
+            try:
+                stat = os.stat(image)
+                images.append([image, stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                images.append([image, None, None])
+        requirements = context.requirements
+        payload = [self.model, images, context.project_name, context.tech_stack, requirements.input_description,
+                   requirements.output_description, requirements.features, requirements.further_requirements]
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
-        response = litellm.completion(
-            model=self.model,
-            messages=self.message.get_conversation()
-        )
+    def _cached_spec(self, context: Context) -> str | None:
+        return self.design_specs.get(self._spec_key(context))
 
-        self.message.append_llm_response(response)
-        generated_prompt = response.choices[0].message.content
+    def _remember_spec(self, context: Context, spec: str) -> None:
+        """Cache a design spec, keeping only the most recent PROTOTYPE_SPEC_CACHE_SIZE."""
+        if not spec or not spec.strip():
+            return
+        key = self._spec_key(context)
+        self.design_specs.pop(key, None)
+        self.design_specs[key] = spec
+        while len(self.design_specs) > max(1, settings.PROTOTYPE_SPEC_CACHE_SIZE):
+            del self.design_specs[next(iter(self.design_specs))]
+
+    def _add_secondary_message(self, generated_prompt: str) -> None:
+        """Record the stage-one design prompt and ask for the HTML built from it."""
+        self.message.append_assistant_text(generated_prompt)
         secondary_message = f"""
         Based on the following detailed prompt and the images I give you, generate a preview app using only HTML, CSS, and JavaScript.
         The preview should be fully functional as a static HTML page and visually match the screens in the images.
@@ -68,35 +118,203 @@ class PrototypeAgent(IAgent):
         """
         self.message.add_user_text(secondary_message)
 
-        response = litellm.completion(
-            model=self.model,
-            messages=self.message.get_conversation()
-        )
-        self.message.append_llm_response(response)
-
-        html_content = response.choices[0].message.content
-        # remove everything above <!DOCTYPE html> and below </html>
-        # Find the start of the HTML document
-        start_index = html_content.find('<!DOCTYPE html>')
-        # Find the end of the HTML document
-        end_index = html_content.rfind('</html>') + len('</html>')
-        # Extract the HTML content
-        html_content = html_content[start_index:end_index]
+    @staticmethod
+    def _html_extractor() -> StreamExtractor:
+        return StreamExtractor(languages=(), html=True)
 
-        
+    @staticmethod
+    def _find_html(response_content: str) -> str | None:
+        """Strip everything above <!DOCTYPE html> (or <html>) and below the last </html>."""
+        html_content = StreamExtractor.scan(response_content, languages=(), html=True).html_document()
+        if html_content is None:
+            print("Could not find valid HTML in the response")
         return html_content
-        
-    def update_context(self, context: Context) -> None:
+
+    def _current_html(self) -> str | None:
+        """The latest HTML document in the conversation (generated, rewritten or patched), or None."""
+        for message in reversed(self.message.messages):
+            if message.get("role") != "assistant" or not isinstance(message.get("content"), str):
+                continue
+            html_content = StreamExtractor.scan(message["content"], languages=(), html=True).html_document()
+            if html_content:
+                return html_content
+        return None
+
+    def _extract_html_content(self, response_content: str) -> str | None:
+        """Record the response and extract the HTML document from it."""
+        self.message.append_assistant_text(response_content)
+        return self._find_html(response_content)
+
+    # --- Per-screen mode ---
+
+    def _use_screens(self, context: Context) -> bool:
+        """Screens are generated separately only when there is more than one."""
+        return self.generation_mode == "screens" and len(context.ui_image) > 1
+
+    def _screen_conversation(self, context: Context, generated_prompt: str,
+                             screens: List[tuple[str, str]], index: int) -> List[Dict[str, Any]]:
         """
-        Update the agent's context.
-        
-        Args:
-            context (Context): The new context to set
+        The conversation generating one screen: the instructions and the design
+        prompt, shared by all screens, then the image of this screen only.
         """
-        # Reset message to clean state
-        self.message = Message()
+        screen_id, title = screens[index]
+        others = "\n".join(f"- {other_title}: showScreen('{other_id}')" for other_id, other_title in screens if other_id != screen_id)
+        message = Message()
+        message.add_system_text(self._init_text(context))
+        message.add_user_text(f"This is the design of the whole app, which other developers are building screen by screen at the same time:\n\n{generated_prompt}")
+        message.mark_stable_prefix()
+        message.add_user_image_from_file(context.ui_image[index], model=self.model)
+        message.add_user_text(f"""Build only the screen "{title}" shown in this image, as a standalone HTML page using only HTML, CSS and vanilla JavaScript.
+The pages are merged into one single-page app afterwards, which adds the navigation bar between screens, so do not add one.
+To go to another screen (for example after a button click or a form submission), call the global function for it:
+{others}
+Prefix every id and class name you define with "{screen_id}-" so they do not clash with the other screens.
+Attach event handlers with addEventListener in the script rather than with onclick and similar attributes.
+Put the CSS in one <style> tag in the head and the JavaScript in <script> tags; no external files or libraries, no comments and no explanation, just the code.""")
+        return message.get_conversation(cache_prefix=LLMClient.supports_prompt_caching(self.model))
+
+    async def _agenerate_screen(self, context: Context, generated_prompt: str,
+                                screens: List[tuple[str, str]], index: int) -> tuple[int, Screen]:
+        """Generate one screen, retrying it on its own when the call or the extraction fails."""
+        screen_id, title = screens[index]
+        page = await self._acomplete_with_retries(f"Screen '{title}'", self._screen_conversation(context, generated_prompt, screens, index),
+                                                  self._find_html, settings.PROTOTYPE_SCREEN_RETRIES)
+        return index, Screen(screen_id, title, page)
+
+    def _generate_screen(self, context: Context, generated_prompt: str,
+                         screens: List[tuple[str, str]], index: int) -> Screen:
+        """Blocking variant of `_agenerate_screen`."""
+        screen_id, title = screens[index]
+        page = self._complete_with_retries(f"Screen '{title}'", self._screen_conversation(context, generated_prompt, screens, index),
+                                           self._find_html, settings.PROTOTYPE_SCREEN_RETRIES)
+        return Screen(screen_id, title, page)
+
+    def _assemble(self, context: Context, generated_prompt: str, screens: List[Screen]) -> str | None:
+        """Merge the screens into the single-file app, recorded as the response to the usual HTML request."""
+        self._add_secondary_message(generated_prompt)
+        return self._extract_html_content(assemble(context.project_name or "Preview App", screens))
+
+    async def _astream_screens(self, context: Context, generated_prompt: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate all screens concurrently, yielding each one as it finishes,
+        then the assembled app. The wall time follows the slowest screen.
+        """
+        screens = screen_list(context.ui_image)
+        yield {"event": "stage", "data": {"stage": "screens", "screens": [title for _, title in screens]}}
+        tasks = [asyncio.ensure_future(self._agenerate_screen(context, generated_prompt, screens, index)) for index in range(len(screens))]
+        written: Dict[int, Screen] = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    index, screen = await next_done
+                except Exception as e:
+                    print(f"Error generating HTML prototype: {e}")
+                    yield self._result_event(None, f"A screen failed after {settings.PROTOTYPE_SCREEN_RETRIES + 1} attempts: {e}")
+                    return
+                written[index] = screen
+                yield {"event": "screen", "data": {"index": index, "screen_id": screen.screen_id, "title": screen.title}}
+        finally:
+            for task in tasks:
+                task.cancel() # A screen failed or the call was cancelled
+        yield self._result_event(self._assemble(context, generated_prompt, [written[index] for index in range(len(screens))]))
+
+    def generate(self, context: Context) -> str:
+        """
+        Generate a HTML preview of the images in the project. The stage-one design
+        prompt is reused while the images and requirements are unchanged, so a
+        regeneration takes a single call.
+        """
+        fallback_html = self._prepare_generate(context)
+        if fallback_html is not None:
+            return fallback_html
+        try:
+            generated_prompt = self._cached_spec(context)
+            if generated_prompt is None:
+                generated_prompt = LLMClient.complete(self.model, self._conversation())
+                self._remember_spec(context, generated_prompt)
+            if self._use_screens(context):
+                # Blocking variant: the screens are generated one after the other
+                screens = screen_list(context.ui_image)
+                return self._assemble(context, generated_prompt, [self._generate_screen(context, generated_prompt, screens, index)
+                                                                  for index in range(len(screens))])
+            self._add_secondary_message(generated_prompt)
+            html_content = LLMClient.complete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error generating HTML prototype: {e}")
+            return None
+        return self._extract_html_content(html_content)
+
+    async def agenerate(self, context: Context) -> str:
+        """Asynchronously generate a HTML preview without blocking the event loop."""
+        if self._use_screens(context):
+            return await self._document_of(self.astream_generate(context))
+        fallback_html = self._prepare_generate(context)
+        if fallback_html is not None:
+            return fallback_html
+        try:
+            generated_prompt = self._cached_spec(context)
+            if generated_prompt is None:
+                generated_prompt = await LLMClient.acomplete(self.model, self._conversation())
+                self._remember_spec(context, generated_prompt)
+            self._add_secondary_message(generated_prompt)
+            html_content = await LLMClient.acomplete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error generating HTML prototype: {e}")
+            return None
+        return self._extract_html_content(html_content)
+
+    async def astream_generate(self, context: Context) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream both stages of the generation: the design prompt tokens, then
+        the HTML tokens, then the extracted HTML document. A cached design
+        prompt is not streamed again. In screens mode the HTML stage is replaced
+        by one "screen" event per finished screen.
+        """
+        fallback_html = self._prepare_generate(context)
+        if fallback_html is not None:
+            yield self._result_event(fallback_html)
+            return
+        generated_prompt = self._cached_spec(context)
+        yield {"event": "stage", "data": {"stage": "design_spec", "cached": generated_prompt is not None}}
+        if generated_prompt is None:
+            spec_chunks = []
+            try:
+                async for token in LLMClient.astream(self.model, self._conversation()):
+                    spec_chunks.append(token)
+                    yield {"event": "token", "data": {"text": token}}
+            except Exception as e:
+                print(f"Error generating HTML prototype: {e}")
+                yield self._result_event(None, f"LLM call failed: {e}")
+                return
+            generated_prompt = "".join(spec_chunks)
+            self._remember_spec(context, generated_prompt)
+        if self._use_screens(context):
+            async for event in self._astream_screens(context, generated_prompt):
+                yield event
+            return
+        self._add_secondary_message(generated_prompt)
+        yield {"event": "stage", "data": {"stage": "html"}}
+        async for event in self._astream_completion(self._extract_html_content, self._html_extractor()):
+            yield event
         
-        # Initialize with system message about the agent's purpose
+    def get_state(self) -> Dict[str, Any]:
+        """Return the persisted session, including the cached design specs."""
+        state = super().get_state()
+        state["design_specs"] = self.design_specs
+        return state
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """Restore the session, including the cached design specs."""
+        super().load_state(state)
+        self.design_specs = dict(state.get("design_specs", {}))
+
+    def publish_document(self, context: Context, document: str) -> tuple[str, str] | None:
+        """Store the HTML as the project's prototype."""
+        context.set_prototype_code(document)
+        return "prototype", "prototype"
+
+    def _init_text(self, context: Context) -> str:
+        """The system message describing the agent's purpose and the project."""
         init_message = f"""
         You are a prototype UI generator for a web application. Your task is to analyze UI mockup images and generate 
         a functional HTML prototype that resembles the provided designs as closely as possible.
@@ -111,61 +329,167 @@ class PrototypeAgent(IAgent):
         4. Uses placeholder content where appropriate
         5. Has a consistent look and feel throughout
         """
-        
-        self.message.add_system_text(init_message.strip())
-    
-    def edit(self, prompt: str, attached_context: str, context: Context) -> str:
+        return init_message.strip()
+
+    def update_context(self, context: Context) -> None:
         """
-        Edit a prototype HTML using the provided message and context.
+        Update the agent's context.
         
         Args:
-            prompt (str): The editing instructions
-            attached_context (str): Additional context for the edit
-            context (Context): The full context
-            
-        Returns:
-            str: The edited HTML content
+            context (Context): The new context to set
+        """
+        # Reset message to clean state
+        self.message = Message()
+        
+        # Initialize with system message about the agent's purpose
+        self.message.add_system_text(self._init_text(context))
+    
+    def _prepare_edit(self, prompt: str, attached_context: str, context: Context) -> str | None:
+        """
+        Set up the conversation for an edit. Returns the HTML being edited ("" if
+        there is none), or None if the prompt is empty.
         """
         if not prompt:
             print("Prompt is empty. Skipping editing.")
             return None
             
+        # The HTML to modify: the attached one, else the latest version in the conversation
+        # (read before the context update resets it), else the stored prototype
+        current_html = attached_context or self._current_html() or context.prototype_code
+
         # Update the context first
         self.update_context(context)
         
-        # Add current HTML to modify
-        if attached_context:
-            self.message.add_user_text(f"Here is the current HTML prototype:\n\n```html\n{attached_context}\n```")
-            
-        # Add edit instructions
+        design_spec = self._cached_spec(context)
+        if design_spec:
+            self.message.add_user_text(f"Here is the design specification the prototype was built from:\n\n{design_spec}")
+        if current_html:
+            self.message.add_user_text(f"Here is the current HTML prototype:\n\n```html\n{current_html}\n```")
+        return current_html
+
+    def _add_rewrite_request(self, prompt: str) -> None:
+        """Ask for the whole HTML file with the edit applied."""
         self.message.add_user_text(f"Please modify the HTML prototype according to these instructions:\n{prompt}\n\nProvide the complete updated HTML file with all changes applied.")
-        
+
+    def _add_patch_request(self, prompt: str) -> None:
+        """Ask for the edit as search/replace blocks so only the changed lines are generated."""
+        self.message.add_user_text(f"""Please modify the HTML prototype according to these instructions:
+{prompt}
+
+Do not repeat the whole file. Reply only with search/replace blocks in this format:
+<<<<<<< SEARCH
+lines copied exactly from the current HTML
+=======
+the lines replacing them
+>>>>>>> REPLACE
+Each search text must match exactly one place in the file, so include enough surrounding lines to make it unique, but keep it short.
+Use as many blocks as needed, in file order. To add code, search for the lines next to where it goes and repeat them in the replacement.""")
+
+    def _finish_patch(self, response_content: str, current_html: str) -> str | None:
+        """
+        Apply search/replace blocks to the current HTML and check the result is
+        still well-formed. A complete HTML file in the response is accepted as
+        well. Returns None if the patch does not apply.
+        """
         try:
-            response = litellm.completion(
-                model=self.model,
-                messages=self.message.get_conversation()
-            )
-            
-            self.message.append_llm_response(response)
-            edited_html = response.choices[0].message.content
-            
-            # Extract just the HTML content
-            start_index = edited_html.find('<!DOCTYPE html>')
-            if start_index == -1:
-                # Try to find just the HTML tag if DOCTYPE is missing
-                start_index = edited_html.find('<html')
-                if start_index == -1:
-                    print("Could not find valid HTML in the response")
-                    return None
-                    
-            end_index = edited_html.rfind('</html>') + len('</html>')
-            if end_index <= len('</html>'):
-                print("Could not find end of HTML in the response")
-                return None
-                
-            edited_html = edited_html[start_index:end_index]
-            return edited_html
+            blocks = parse_blocks(response_content)
+        except HtmlPatchError:
+            if '<html' in response_content and '</html>' in response_content:
+                return self._extract_html_content(response_content) # The model rewrote the file after all
+            print("The edit response holds neither search/replace blocks nor HTML.")
+            return None
+        try:
+            patched = apply_blocks(current_html, blocks)
+            validate(current_html, patched)
+        except HtmlPatchError as e:
+            print(f"Could not apply the HTML patch: {e}")
+            return None
+        self.message.append_assistant_text(patched)
+        return patched
+
+    def edit(self, prompt: str, attached_context: str, context: Context) -> str:
+        """
+        Edit a prototype HTML using the provided message and context. In patch
+        mode the model only returns the changed lines; the whole file is
+        regenerated if they do not apply.
+        
+        Args:
+            prompt (str): The editing instructions
+            attached_context (str): The current HTML; if empty, the latest version in the conversation, then the project's prototype
+            context (Context): The full context
             
+        Returns:
+            str: The edited HTML content
+        """
+        current_html = self._prepare_edit(prompt, attached_context, context)
+        if current_html is None:
+            return None
+        try:
+            if current_html and self.edit_mode == "patch":
+                checkpoint = self.checkpoint()
+                self._add_patch_request(prompt)
+                edited = self._finish_patch(LLMClient.complete(self.model, self._conversation()), current_html)
+                if edited is not None:
+                    return edited
+                self.rollback(checkpoint)
+                print("Falling back to regenerating the entire HTML file.")
+            self._add_rewrite_request(prompt)
+            edited_html = LLMClient.complete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error editing HTML prototype: {e}")
+            return None
+        return self._extract_html_content(edited_html)
+
+    async def aedit(self, prompt: str, attached_context: str, context: Context) -> str:
+        """Asynchronously edit a prototype HTML without blocking the event loop."""
+        current_html = self._prepare_edit(prompt, attached_context, context)
+        if current_html is None:
+            return None
+        try:
+            if current_html and self.edit_mode == "patch":
+                checkpoint = self.checkpoint()
+                self._add_patch_request(prompt)
+                edited = self._finish_patch(await LLMClient.acomplete(self.model, self._conversation()), current_html)
+                if edited is not None:
+                    return edited
+                self.rollback(checkpoint)
+                print("Falling back to regenerating the entire HTML file.")
+            self._add_rewrite_request(prompt)
+            edited_html = await LLMClient.acomplete(self.model, self._conversation())
         except Exception as e:
             print(f"Error editing HTML prototype: {e}")
-            return None
\ No newline at end of file
+            return None
+        return self._extract_html_content(edited_html)
+
+    async def astream_edit(self, prompt: str, attached_context: str, context: Context) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the edited HTML tokens as they arrive, then the extracted HTML document.
+        In patch mode the search/replace blocks come first, under a "patch" stage,
+        followed by a "rewrite" stage if they do not apply.
+        """
+        current_html = self._prepare_edit(prompt, attached_context, context)
+        if current_html is None:
+            yield self._result_event(None, "The edit prompt is empty.")
+            return
+        if current_html and self.edit_mode == "patch":
+            yield {"event": "stage", "data": {"stage": "patch"}}
+            checkpoint = self.checkpoint()
+            self._add_patch_request(prompt)
+            chunks = []
+            try:
+                async for token in LLMClient.astream(self.model, self._conversation()):
+                    chunks.append(token)
+                    yield {"event": "token", "data": {"text": token}}
+            except Exception as e:
+                print(f"Error editing HTML prototype: {e}")
+                yield self._result_event(None, f"LLM call failed: {e}")
+                return
+            edited = self._finish_patch("".join(chunks), current_html)
+            if edited is not None:
+                yield self._result_event(edited)
+                return
+            self.rollback(checkpoint)
+            yield {"event": "stage", "data": {"stage": "rewrite"}}
+        self._add_rewrite_request(prompt)
+        async for event in self._astream_completion(self._extract_html_content, self._html_extractor()):
+            yield event
@@ -1,34 +1,55 @@
-import litellm
+import asyncio
 import json
-import re # Import the regular expression module
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator
+from config import settings
 from utils.Message import Message
 from utils.Context import Context
 from agents.IAgent import IAgent
+from utils.Compaction import CompactionPolicy
+from utils.ContextAssembler import assemble_project_context
+from utils.TokenCounter import count_text_tokens
+from utils import LLMClient
 from utils.Project import Project
+from utils.StreamExtractor import StreamExtractor
+from utils.MarkdownPatch import PatchError, apply_patch, outline, parse_patch
+
+# Approximate size of the fixed instructions in the init prompt
+INSTRUCTION_TOKENS = 1000
 
 class TextDocumentAgent(IAgent):
+    # Documents are long, so keep only the latest one plus a few recent edit turns
+    compaction_policy = CompactionPolicy(max_tokens=48000, keep_recent_messages=4)
+
     def __init__(self, name: str, model: str, project: Project = None):
         self.name = name
         self.model = model
         self.message = Message()
+        self.generation_mode = settings.TEXT_DOCUMENT_MODE # "single" or "sections"
+        self.edit_mode = settings.TEXT_DOCUMENT_EDIT_MODE # "patch" or "rewrite"
         
         # Initialize with project context if provided
         if project:
             self.update_context(project.context)
 
-    def _extract_markdown_content(self, response_content: str) -> tuple[str | None, str | None]:
-        # Use regex to find the markdown block, ignoring case and allowing for whitespace
-        match = re.search(r"```markdown\s*\n(.*?)\n```", response_content, re.DOTALL | re.IGNORECASE)
-        if match:
-            document_content = match.group(1).strip()
-            first_line = document_content.split('\n', 1)[0].strip()
+    @staticmethod
+    def _markdown_extractor() -> StreamExtractor:
+        return StreamExtractor(languages=("markdown",))
 
-            document_name = ''.join(e for e in first_line if e.isalnum() or e.isspace())
+    def _extract_markdown_content(self, response_content: str) -> tuple[str | None, str | None]:
+        # The first ```markdown block; code blocks inside the document do not end it
+        document_content = StreamExtractor.scan(response_content, languages=("markdown",)).fence("markdown")
+        if document_content:
+            document_name = self._document_name(document_content)
 
             if document_name:
                 return document_name, document_content
         return None, None 
+
+    @staticmethod
+    def _document_name(document_content: str) -> str:
+        """The document name is its title, the first line of the markdown."""
+        first_line = document_content.split('\n', 1)[0].strip()
+        return ''.join(e for e in first_line if e.isalnum() or e.isspace())
     def _init_info(self, context: Context):
         for key in context.requirements:
             # if any value is empty, return None
@@ -43,9 +64,16 @@ class TextDocumentAgent(IAgent):
         if context.requirements.features:
             program_features_str = "\n".join([f"  + {feature_name}: {feature_desc}" for feature_name, feature_desc in context.requirements.features.items()] )
 
-        generated_text_doc_str = ""
-        if context.generated_text_doc:
-            generated_text_doc_str = "\n".join([f"  === {doc_name}:\n{doc_text}\n===" for doc_name, doc_text in context.generated_text_doc.items()]) # Added newline for clarity
+        # Fit the previous documents and CSV data into the model's context budget
+        requirements_str = "\n".join([context.requirements.input_description, context.requirements.output_description,
+                                      program_features_str, context.tech_stack, context.requirements.further_requirements])
+        reserved_tokens = INSTRUCTION_TOKENS + count_text_tokens(requirements_str)
+        kept_context, context_report = context.cached_fragment(
+            f"assembled:{self.model}:{reserved_tokens}:{self.name}",
+            lambda: assemble_project_context(context, self.model, reserved_tokens, target=self.name))
+        self._record_context_report(context_report)
+        generated_text_doc_str = "\n".join([f"  === {doc_name}:\n{kept_context[f'doc:{doc_name}']}\n===" for doc_name in context.generated_text_doc if f"doc:{doc_name}" in kept_context]) # Added newline for clarity
+        csv_data_str = "\n".join([f"  === Table {index + 1}:\n{kept_context[f'csv:{index + 1}']}\n===" for index in range(len(context.csv_description)) if f"csv:{index + 1}" in kept_context])
 
         init_text = f'''
 You are a document writer for a programming project, you are capable of writing a dynamic range of document. You will be provided with a the context of the program.
@@ -65,6 +93,8 @@ Here is the infomation about the project:
 - The program features: {program_features_str}
 - Here is the tech stack of the program: {context.tech_stack}
 - The program further requirements: {context.requirements.further_requirements}
+- The project data extracted from the spreadsheets (CSV tables):
+{csv_data_str}
 - Here is the already generated text document. You must follow the document generated from before strictly to maintain the consistency of the program, do not violate this consistency that previous document. If this part dont have anything that mean this is the first text document generated. You will have to think thouroughly, planning so future document can depend on this document to generate further
 {generated_text_doc_str}
 
@@ -77,51 +107,29 @@ The content of the document.
 ```
         '''
         return init_text # Return the generated text for further processing
-    def generate(self, context: Context) -> str | None:
-        """Generate a document using Gemini API with both image and CSV data."""
-        init_text = self._init_info(context)
-        if init_text is None:
-            print("Initialization failed. Skipping generation.")
-            return None
+    def _prepare_generate(self, context: Context) -> bool:
+        """Set up the conversation for a generation. Returns False if the context is incomplete."""
+        if not self._context_unchanged(context):
+            init_text = self._init_info(context)
+            if init_text is None:
+                print("Initialization failed. Skipping generation.")
+                return False
+            self.message.replace_init_message(init_text)
+            self._remember_context(context)
         if context.diagram_image: # Check if list is not empty
             for image in context.diagram_image:
                 # Add the image to the message
-                self.message.add_user_image_from_file(image)
-
-        try:
-            response = litellm.completion(
-                model=self.model,
-                messages=self.message.get_conversation()
-            )
-            response_content = response.choices[0].message.content
-            self.message.append_llm_response(response_content)
-
-            # Extract the content and name using the new method
-            document_name, document_content = self._extract_markdown_content(response_content)
-
-            if document_content and document_name:
-                return document_content
-            else:
-                print("Could not extract markdown content from LLM response.")
-                return None # Indicate failure if extraction fails
-
-        except Exception as e:
-            print(f"Error during litellm completion or processing: {e}")
-            return None # Return None on API error or other exceptions
-
-
-    def update_context(self, context: Context) -> None:
-        new_init_message = self._init_info(context)
-        # Replace the initial system message with the updated context
-        self.message.replace_init_message(new_init_message)
+                self.message.add_user_image_from_file(image, model=self.model)
+        # Instructions, context and images are resent unchanged on the next call
+        self.message.mark_stable_prefix()
+        return True
 
-
-    def edit(self, prompt:str, attached_context: str, context:Context) -> str | None: # Added attached_context type hint and return type hint
-        """Edit a document using the provided message and context."""
+    def _prepare_edit(self, prompt: str, context: Context) -> bool:
+        """Set up the conversation for an edit. Returns False if there is nothing to edit."""
         # Check if there's a conversation history to edit upon
         if len(self.message.messages) == 0:
             print("Cannot edit: No previous conversation history.")
-            return None
+            return False
         # Basic validation checks (similar to generate)
         for key in context.requirements:
             if not context.requirements[key]:
@@ -132,27 +140,322 @@ The content of the document.
             print("CSV description is empty during edit. Context might be incomplete.")
             # return None
         self.update_context(context) # Update the context with the new document
-        # Add the user's edit request
-        # Consider adding attached_context if relevant for the edit prompt
+        return True
+
+    def _add_rewrite_request(self, prompt: str) -> None:
+        """Ask for the whole document again with the edit applied."""
         self.message.add_user_text(f"You must rewrite the *entire document* based on the previous response, following my instructions precisely. Remember to keep the ```markdown``` format with the title on the first line.\n\nMy instructions: {prompt}")
 
+    def _current_document(self) -> str | None:
+        """The latest document in the conversation, or None if no response holds one."""
+        for message in reversed(self.message.messages):
+            if message.get("role") != "assistant" or not isinstance(message.get("content"), str):
+                continue
+            _, document_content = self._extract_markdown_content(message["content"])
+            if document_content:
+                return document_content
+        return None
+
+    def _add_patch_request(self, prompt: str, document: str) -> None:
+        """Ask for the edit as operations on the sections of the current document instead of a full rewrite."""
+        sections = "\n".join(f"- {path}" for path in outline(document))
+        self.message.add_user_text(f'''Apply my instructions to the latest document by changing only the sections that need it.
+Reply with a ```patch``` block holding one or more operations, each a line of the form "@@ <operation>: <section>" followed by the new markdown:
+- "@@ replace: <section>": the new content of the section, subsections included. Start with the heading line to rename the section, otherwise the heading is kept.
+- "@@ insert_after: <section>" / "@@ insert_before: <section>": a new section, starting with its heading line.
+- "@@ delete: <section>": no content.
+Refer to sections by heading, prefixed with parent headings separated by " > " when the heading alone is ambiguous. The sections of the document are:
+{sections}
+Do not change the title line. If the instructions change most of the document, reply with the entire document in a ```markdown``` block instead.
+
+My instructions: {prompt}''')
+
+    def _finish_patch(self, response_content: str, document: str) -> str | None:
+        """
+        Apply a patch response to the document and record the patched document
+        as the response. A full document in the response is accepted as well.
+        Returns None if the patch does not apply.
+        """
         try:
-            response = litellm.completion(
-                model=self.model,
-                messages=self.message.get_conversation()
-            )
-            response_content = response.choices[0].message.content
-            self.message.append_llm_response(response_content)
+            operations = parse_patch(response_content)
+        except PatchError:
+            if self._extract_markdown_content(response_content)[1]:
+                return self._finish(response_content) # The model rewrote the document after all
+            print("The edit response holds neither a patch nor a document.")
+            return None
+        try:
+            patched = apply_patch(document, operations)
+        except PatchError as e:
+            print(f"Could not apply the edit patch: {e}")
+            return None
+        # Later edits work on the full document, so record it rather than the patch
+        return self._finish(f"```markdown\n{patched}\n```")
 
-            # Extract the updated content and name using the reusable method
-            document_name, document_content = self._extract_markdown_content(response_content)
+    def _finish(self, response_content: str) -> str | None:
+        """Record the response and extract the markdown document from it."""
+        self.message.append_assistant_text(response_content)
 
-            if document_content and document_name:
-                return document_content
-            else:
-                print("Could not extract markdown content from LLM response during edit.")
-                return None # Indicate failure if extraction fails
+        # Extract the content and name using the reusable method
+        document_name, document_content = self._extract_markdown_content(response_content)
+
+        if document_content and document_name:
+            return document_content
+        print("Could not extract markdown content from LLM response.")
+        return None # Indicate failure if extraction fails
+
+    # --- Outline-then-sections mode ---
+
+    def _outline_request(self) -> Dict[str, Any]:
+        return {"role": "user", "content": f"""Before writing the document, plan it. Reply with the outline only, in a ```markdown``` block:
+the first line is the title of the document, then one line per top-level section in the form "## Section heading",
+each followed by one or two lines saying what the section covers. Use at most {settings.TEXT_DOCUMENT_MAX_SECTIONS} sections."""}
+
+    def _parse_outline(self, response_content: str) -> tuple[str, List[tuple[str, str]]] | None:
+        """Return the title and the (heading, brief) pairs of an outline, or None if it has no sections."""
+        _, outline = self._extract_markdown_content(response_content)
+        if not outline:
+            return None
+        lines = outline.split('\n')
+        title = lines[0].strip()
+        sections: List[tuple[str, str]] = []
+        for line in lines[1:]:
+            if line.startswith('## '):
+                sections.append((line[3:].strip(), ""))
+            elif sections and line.strip():
+                heading, brief = sections[-1]
+                sections[-1] = (heading, f"{brief} {line.strip()}".strip())
+        if not sections:
+            return None
+        return title, sections[:settings.TEXT_DOCUMENT_MAX_SECTIONS]
+
+    def _section_request(self, title: str, sections: List[tuple[str, str]], index: int) -> Dict[str, Any]:
+        outline = "\n".join(f"{number + 1}. {heading}: {brief}" for number, (heading, brief) in enumerate(sections))
+        heading, brief = sections[index]
+        return {"role": "user", "content": f"""The document "{title}" has this outline:
+{outline}
+
+Other writers are writing the other sections at the same time. Write only section {index + 1}, "{heading}" ({brief}).
+Put it in a ```markdown``` block whose first line is "## {heading}". Use ### and deeper headings inside the section."""}
+
+    @staticmethod
+    def _extract_section(response_content: str, heading: str) -> str | None:
+        section = StreamExtractor.scan(response_content, languages=("markdown",)).fence("markdown")
+        if not section:
+            return None
+        if not section.startswith('## '):
+            section = f"## {heading}\n\n{section}"
+        return section
 
+    @staticmethod
+    def _stitch(title: str, sections: List[str]) -> str:
+        """Assemble the sections into a response in the same format as a single-shot generation."""
+        body = "\n\n".join(sections)
+        return f"```markdown\n{title}\n\n{body}\n```"
+
+    async def _agenerate_section(self, base: List[Dict[str, Any]], title: str,
+                                 sections: List[tuple[str, str]], index: int) -> tuple[int, str]:
+        """Generate one section, retrying it on its own when the call or the extraction fails."""
+        heading = sections[index][0]
+        section = await self._acomplete_with_retries(f"Section '{heading}'", base + [self._section_request(title, sections, index)],
+                                                     lambda response_content: self._extract_section(response_content, heading),
+                                                     settings.TEXT_DOCUMENT_SECTION_RETRIES)
+        return index, section
+
+    def _generate_section(self, base: List[Dict[str, Any]], title: str,
+                          sections: List[tuple[str, str]], index: int) -> str:
+        """Blocking variant of `_agenerate_section`."""
+        heading = sections[index][0]
+        return self._complete_with_retries(f"Section '{heading}'", base + [self._section_request(title, sections, index)],
+                                           lambda response_content: self._extract_section(response_content, heading),
+                                           settings.TEXT_DOCUMENT_SECTION_RETRIES)
+
+    async def _astream_sections(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate the outline, then all sections concurrently with the same
+        conversation as shared (prompt-cached) prefix, yielding each section as
+        it finishes, then the stitched document. Falls back to a single
+        completion if no outline could be parsed.
+        """
+        yield {"event": "stage", "data": {"stage": "outline"}}
+        try:
+            outline = self._parse_outline(await LLMClient.acomplete(self.model, self._conversation() + [self._outline_request()]))
+        except Exception as e:
+            print(f"Error during litellm completion or processing: {e}")
+            yield self._result_event(None, f"LLM call failed: {e}")
+            return
+        if outline is None:
+            print("Could not parse the outline, generating the document in one completion.")
+            async for event in self._astream_completion(self._finish, self._markdown_extractor()):
+                yield event
+            return
+        title, sections = outline
+        yield {"event": "outline", "data": {"title": title, "sections": [heading for heading, _ in sections]}}
+        yield {"event": "stage", "data": {"stage": "sections"}}
+        base = self._conversation()
+        tasks = [asyncio.ensure_future(self._agenerate_section(base, title, sections, index)) for index in range(len(sections))]
+        written: Dict[int, str] = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    index, section = await next_done
+                except Exception as e:
+                    print(f"Error during litellm completion or processing: {e}")
+                    yield self._result_event(None, f"A section failed after {settings.TEXT_DOCUMENT_SECTION_RETRIES + 1} attempts: {e}")
+                    return
+                written[index] = section
+                yield {"event": "section", "data": {"index": index, "heading": sections[index][0], "text": section}}
+        finally:
+            for task in tasks:
+                task.cancel() # A section failed or the call was cancelled
+        yield self._result_event(self._finish(self._stitch(title, [written[index] for index in range(len(sections))])))
+
+    def _generate_sections(self) -> str | None:
+        """Blocking variant of the sections mode; the sections are written one after the other."""
+        outline = self._parse_outline(LLMClient.complete(self.model, self._conversation() + [self._outline_request()]))
+        if outline is None:
+            print("Could not parse the outline, generating the document in one completion.")
+            return self._finish(LLMClient.complete(self.model, self._conversation()))
+        title, sections = outline
+        base = self._conversation()
+        written = [self._generate_section(base, title, sections, index) for index in range(len(sections))]
+        return self._finish(self._stitch(title, written))
+
+    def generate(self, context: Context) -> str | None:
+        """Generate a document using Gemini API with both image and CSV data."""
+        if not self._prepare_generate(context):
+            return None
+        if self.generation_mode == "sections":
+            try:
+                return self._generate_sections()
+            except Exception as e:
+                print(f"Error during litellm completion or processing: {e}")
+                return None
+        try:
+            response_content = LLMClient.complete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error during litellm completion or processing: {e}")
+            return None # Return None on API error or other exceptions
+        return self._finish(response_content)
+
+    async def agenerate(self, context: Context) -> str | None:
+        """Asynchronously generate a document without blocking the event loop."""
+        if self.generation_mode == "sections":
+            return await self._document_of(self.astream_generate(context))
+        if not self._prepare_generate(context):
+            return None
+        try:
+            response_content = await LLMClient.acomplete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error during litellm completion or processing: {e}")
+            return None # Return None on API error or other exceptions
+        return self._finish(response_content)
+
+    async def astream_generate(self, context: Context) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the document tokens as they arrive, then the extracted markdown."""
+        if not self._prepare_generate(context):
+            yield self._result_event(None, "The project context is incomplete.")
+            return
+        if self.generation_mode == "sections":
+            async for event in self._astream_sections():
+                yield event
+            return
+        async for event in self._astream_completion(self._finish, self._markdown_extractor()):
+            yield event
+
+
+    def publish_document(self, context: Context, document: str) -> tuple[str, str] | None:
+        """Store the document in the context under its title."""
+        document_name = self._document_name(document) or self.name
+        context.set_generated_text_doc(document_name, document)
+        return "doc", document_name
+
+    def update_context(self, context: Context) -> None:
+        if self._context_unchanged(context):
+            return # Nothing changed since the init message was built
+        new_init_message = self._init_info(context)
+        if new_init_message is None:
+            return
+        # Replace the initial system message with the updated context
+        self.message.replace_init_message(new_init_message)
+        self._remember_context(context)
+
+
+    def edit(self, prompt:str, attached_context: str, context:Context) -> str | None: # Added attached_context type hint and return type hint
+        """
+        Edit a document using the provided message and context. In patch mode
+        only the affected sections are regenerated; the whole document is
+        rewritten if the patch does not apply.
+        """
+        if not self._prepare_edit(prompt, context):
+            return None
+        document = self._current_document() if self.edit_mode == "patch" else None
+        try:
+            if document is not None:
+                checkpoint = self.checkpoint()
+                self._add_patch_request(prompt, document)
+                edited = self._finish_patch(LLMClient.complete(self.model, self._conversation()), document)
+                if edited is not None:
+                    return edited
+                self.rollback(checkpoint)
+                print("Falling back to rewriting the entire document.")
+            self._add_rewrite_request(prompt)
+            response_content = LLMClient.complete(self.model, self._conversation())
         except Exception as e:
             print(f"Error during litellm completion or processing in edit: {e}")
             return None # Return None on API error or other exceptions
+        return self._finish(response_content)
+
+    async def aedit(self, prompt:str, attached_context: str, context:Context) -> str | None:
+        """Asynchronously edit a document without blocking the event loop."""
+        if not self._prepare_edit(prompt, context):
+            return None
+        document = self._current_document() if self.edit_mode == "patch" else None
+        try:
+            if document is not None:
+                checkpoint = self.checkpoint()
+                self._add_patch_request(prompt, document)
+                edited = self._finish_patch(await LLMClient.acomplete(self.model, self._conversation()), document)
+                if edited is not None:
+                    return edited
+                self.rollback(checkpoint)
+                print("Falling back to rewriting the entire document.")
+            self._add_rewrite_request(prompt)
+            response_content = await LLMClient.acomplete(self.model, self._conversation())
+        except Exception as e:
+            print(f"Error during litellm completion or processing in edit: {e}")
+            return None # Return None on API error or other exceptions
+        return self._finish(response_content)
+
+    async def astream_edit(self, prompt:str, attached_context: str, context:Context) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the edited document tokens as they arrive, then the extracted markdown.
+        In patch mode the patch tokens come first, under a "patch" stage, followed
+        by a "rewrite" stage if the patch does not apply.
+        """
+        if not self._prepare_edit(prompt, context):
+            yield self._result_event(None, "There is no previous document to edit.")
+            return
+        document = self._current_document() if self.edit_mode == "patch" else None
+        if document is not None:
+            yield {"event": "stage", "data": {"stage": "patch"}}
+            checkpoint = self.checkpoint()
+            self._add_patch_request(prompt, document)
+            chunks = []
+            try:
+                async for token in LLMClient.astream(self.model, self._conversation()):
+                    chunks.append(token)
+                    yield {"event": "token", "data": {"text": token}}
+            except Exception as e:
+                print(f"Error during streaming litellm completion: {e}")
+                yield self._result_event(None, f"LLM call failed: {e}")
+                return
+            edited = self._finish_patch("".join(chunks), document)
+            if edited is not None:
+                yield self._result_event(edited)
+                return
+            self.rollback(checkpoint)
+            yield {"event": "stage", "data": {"stage": "rewrite"}}
+        self._add_rewrite_request(prompt)
+        async for event in self._astream_completion(self._finish, self._markdown_extractor()):
+            yield event
+
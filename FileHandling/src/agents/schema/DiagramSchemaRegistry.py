@@ -0,0 +1,79 @@
+# Registry of the diagram JSON schemas, with validators built once at import
+from typing import Any, Callable, Dict, Optional
+from jsonschema import ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+from config import settings
+from agents.schema.ClassDiagramSchema import JSON_CLASS_DIAGRAM_SCHEMA_STRING, VALIDATE_SCHEMA_CLASS_DIAGRAM
+from agents.schema.DatabaseDiagramSchema import JSON_DATABASE_DIAGRAM_SCHEMA_STRING, VALIDATE_SCHEMA_DATABASE_DIAGRAM
+from agents.schema.SequenceDiagramSchema import JSON_SEQUENCE_DIAGRAM_SCHEMA_STRING, VALIDATE_SCHEMA_SEQUENCE_DIAGRAM
+
+try:
+    import fastjsonschema # Optional: compiles schemas to Python code, several times faster than jsonschema
+except ImportError:
+    fastjsonschema = None
+
+
+class DIAGRAM_TYPE:
+    CLASS_DIAGRAM = "UML Class Diagram"
+    SEQUENCE_DIAGRAM = "UML Sequence Diagram"
+    ACTIVITY_DIAGRAM = "UML Activity Diagram"
+    STATE_DIAGRAM = "UML State Diagram"
+    USE_CASE_DIAGRAM = "UML Use Case Diagram"
+    DATABASE_DIAGRAM = "ER Diagram"
+
+
+class DiagramSchema:
+    """The schema of one diagram type: the text shown to the model and a pre-built validator."""
+
+    def __init__(self, diagram_type: str, prompt_schema: str, validate_schema: Dict[str, Any]):
+        self.diagram_type = diagram_type
+        self.prompt_schema = prompt_schema
+        self.validate_schema = validate_schema
+        validator_class = validator_for(validate_schema)
+        validator_class.check_schema(validate_schema) # A broken schema fails at startup, not on the first diagram
+        self._validator = validator_class(validate_schema)
+        self._fast: Optional[Callable[[Any], Any]] = None
+        if fastjsonschema is not None and settings.DIAGRAM_FAST_VALIDATION:
+            # Defaults are not filled in, the diagram is stored as the model wrote it
+            self._fast = fastjsonschema.compile(validate_schema, use_default=False)
+
+    def is_valid(self, instance: Any) -> bool:
+        if self._fast is not None:
+            try:
+                self._fast(instance)
+                return True
+            except fastjsonschema.JsonSchemaException:
+                return False
+        return self._validator.is_valid(instance)
+
+    def validate(self, instance: Any) -> None:
+        """
+        Raises:
+            ValidationError: The most relevant error if the instance does not match the schema
+        """
+        if self.is_valid(instance):
+            return
+        # Invalid data is the rare path, so the detailed error comes from jsonschema
+        error = best_match(self._validator.iter_errors(instance))
+        if error is not None:
+            raise error
+        raise ValidationError(f"The diagram does not match the {self.diagram_type} schema")
+
+
+_CLASS_DIAGRAM_SCHEMA = DiagramSchema(DIAGRAM_TYPE.CLASS_DIAGRAM, JSON_CLASS_DIAGRAM_SCHEMA_STRING, VALIDATE_SCHEMA_CLASS_DIAGRAM)
+
+DIAGRAM_SCHEMAS: Dict[str, DiagramSchema] = {
+    DIAGRAM_TYPE.CLASS_DIAGRAM: _CLASS_DIAGRAM_SCHEMA,
+    DIAGRAM_TYPE.SEQUENCE_DIAGRAM: DiagramSchema(DIAGRAM_TYPE.SEQUENCE_DIAGRAM, JSON_SEQUENCE_DIAGRAM_SCHEMA_STRING, VALIDATE_SCHEMA_SEQUENCE_DIAGRAM),
+    DIAGRAM_TYPE.DATABASE_DIAGRAM: DiagramSchema(DIAGRAM_TYPE.DATABASE_DIAGRAM, JSON_DATABASE_DIAGRAM_SCHEMA_STRING, VALIDATE_SCHEMA_DATABASE_DIAGRAM),
+    # No schema of their own yet: generated with the class diagram schema, as before the registry
+    DIAGRAM_TYPE.ACTIVITY_DIAGRAM: _CLASS_DIAGRAM_SCHEMA,
+    DIAGRAM_TYPE.STATE_DIAGRAM: _CLASS_DIAGRAM_SCHEMA,
+    DIAGRAM_TYPE.USE_CASE_DIAGRAM: _CLASS_DIAGRAM_SCHEMA,
+}
+
+
+def schema_for(diagram_type: str) -> Optional[DiagramSchema]:
+    """Return the schema of a diagram type, or None if the type has no schema."""
+    return DIAGRAM_SCHEMAS.get(diagram_type)
@@ -0,0 +1,205 @@
+# benchmark.py
+"""
+End-to-end load test of the API against the mock LLM provider.
+
+Drives the FastAPI app in-process through the whole workflow (create project,
+upload, process, add agents, generate and edit) at increasing concurrency and
+reports throughput and latency percentiles per concurrency level. No real LLM
+provider is called and Excel is not needed: processing uses a stand-in handler
+that writes synthetic sheets.
+
+Usage:
+    python benchmark.py --concurrency 1 2 4 8 16 --rounds 2 --latency 0.5 --tokens-per-second 200
+"""
+import os
+
+# Must be set before the settings are loaded
+os.environ.setdefault("MOCK_LLM_ENABLED", "true")
+os.environ.setdefault("LLM_CACHE_MODE", "off") # Cached responses would hide the LLM path
+
+import argparse
+import asyncio
+import csv
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from PIL import Image, ImageDraw
+
+from config import settings
+from dependencies import app_state, get_excel_handler
+from main import app
+from utils.Context import Context
+
+AGENT_TYPES = ["TextDocumentAgent", "DiagramAgent", "PrototypeAgent"]
+SHEETS = {"Requirements": "table", "Screen": "ui"}
+
+
+class BenchmarkExcelHandler:
+    """Stands in for ExcelFileHandler, which needs Excel, and writes synthetic sheets."""
+
+    def __init__(self, requirement_rows: int):
+        self.requirement_rows = requirement_rows
+
+    def get_sheet_names(self, excel_file_path: str) -> List[str]:
+        return list(SHEETS)
+
+    def process_sheets(self, excel_file_path: str, output_folder: str, sheet_types: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+        result: Dict[str, Dict[str, str]] = {}
+        for sheet_name, sheet_type in sheet_types.items():
+            if sheet_type.lower() == 'table':
+                output_path = os.path.join(output_folder, f"{sheet_name}.csv")
+                with open(output_path, 'w', newline='', encoding='utf-8') as csv_file:
+                    writer = csv.writer(csv_file)
+                    writer.writerow(["ID", "Feature", "Description", "Priority"])
+                    for i in range(self.requirement_rows):
+                        writer.writerow([f"REQ-{i}", f"Feature {i}", f"The system shall support feature {i}.", "High" if i % 3 == 0 else "Normal"])
+            else:
+                output_path = os.path.join(output_folder, f"{sheet_name}.png")
+                image = Image.new("RGB", (1280, 800), "white")
+                draw = ImageDraw.Draw(image)
+                for row in range(8):
+                    draw.rectangle([40, 40 + row * 90, 1240, 110 + row * 90], outline="black")
+                    draw.text((60, 60 + row * 90), f"{sheet_name} field {row}", fill="black")
+                image.save(output_path)
+            result[sheet_name] = {"status": "success", "type": sheet_type.lower(), "output_path": output_path}
+        return result
+
+
+def fill_requirements(context: Context) -> None:
+    """Fill in the project requirements, which the agents refuse to work without. No endpoint sets them yet."""
+    requirements = context.requirements
+    requirements.input_description = "Customers, products and orders entered through web forms."
+    requirements.output_description = "Order confirmations, invoices and monthly sales reports."
+    requirements.features = {f"Feature {i}": f"The system shall support feature {i}." for i in range(10)}
+    requirements.further_requirements = "Pages must load within two seconds."
+    context.project_name = "Benchmark Shop"
+    context.tech_stack = "FastAPI, PostgreSQL, React"
+    context.touch()
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _check(response: httpx.Response, step: str) -> Dict[str, Any]:
+    if response.status_code >= 400:
+        raise RuntimeError(f"{step} failed ({response.status_code}): {response.text}")
+    return response.json()
+
+
+async def setup_project(client: httpx.AsyncClient, base_dir: str, level: int, agent_types: List[str], model: str) -> List[str]:
+    """Create, upload and process a project for a concurrency level and add one agent per worker."""
+    _check(await client.post("/projects/create", json={"project_name": f"benchmark-{level}", "base_dir": base_dir}), "Create project")
+    upload = _check(await client.post("/files/upload-excel", files={"file": ("benchmark.xlsx", b"benchmark workbook")}), "Upload")
+    _check(await client.post("/files/process-excel", json={"files": [
+        {"path": upload["file_path"], "name": upload["original_filename"], "sheets": SHEETS}]}), "Process")
+    fill_requirements(app_state["current_project"].context)
+    agent_names = []
+    for worker in range(level):
+        agent_name = f"benchmark-{level}-{worker}"
+        _check(await client.post("/agent/add", json={
+            "agent_name": agent_name, "agent_type": agent_types[worker % len(agent_types)], "model": model}), "Add agent")
+        agent_names.append(agent_name)
+    return agent_names
+
+
+async def run_worker(client: httpx.AsyncClient, agent_name: str, rounds: int, stream: bool,
+                     latencies: Dict[str, List[float]], errors: Dict[str, int]) -> None:
+    """Generate then edit a document `rounds` times, recording the latency of every request."""
+    params = {"stream": "true"} if stream else {}
+    requests = [
+        ("generate", f"/agent/generate/{agent_name}", {}),
+        ("edit", f"/agent/edit/{agent_name}", {"prompt": "Add more detail to the first section.", "attached_context": ""}),
+    ]
+    for _ in range(rounds):
+        for operation, url, body in requests:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, params=params, json=body)
+                # A stream reports failures in its final event
+                failed = response.status_code >= 400 or (stream and '"status": "success"' not in response.text)
+                if failed:
+                    print(f"{operation} on '{agent_name}' failed ({response.status_code}): {response.text[-200:]}")
+            except Exception as e:
+                print(f"{operation} on '{agent_name}' failed: {e}")
+                failed = True
+            if failed:
+                errors[operation] = errors.get(operation, 0) + 1
+            else:
+                latencies.setdefault(operation, []).append(time.perf_counter() - started)
+
+
+async def run_level(client: httpx.AsyncClient, base_dir: str, level: int, args: argparse.Namespace) -> Dict[str, Any]:
+    agent_names = await setup_project(client, base_dir, level, args.agent_types, args.model)
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    started = time.perf_counter()
+    await asyncio.gather(*[run_worker(client, agent_name, args.rounds, args.stream, latencies, errors) for agent_name in agent_names])
+    elapsed = time.perf_counter() - started
+    project_stats = _check(await client.get("/projects/stats"), "Project stats")["total"]
+    _check(await client.post("/agent/clear-all"), "Clear agents")
+    completed = sum(len(values) for values in latencies.values())
+    return {
+        "concurrency": level,
+        "completed": completed,
+        "errors": sum(errors.values()),
+        "seconds": elapsed,
+        "throughput": completed / elapsed if elapsed else 0.0,
+        "latencies": latencies,
+        "avg_queue_wait": project_stats["avg_queue_wait_seconds"],
+        "avg_first_token": project_stats["avg_time_to_first_token_seconds"],
+    }
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    print()
+    print(f"{'conc':>5} {'ok':>5} {'err':>4} {'req/s':>7} {'operation':>9} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'queue s':>8} {'ttft s':>7}")
+    for result in results:
+        first_token = result["avg_first_token"]
+        for operation, values in sorted(result["latencies"].items()):
+            print(f"{result['concurrency']:>5} {result['completed']:>5} {result['errors']:>4} {result['throughput']:>7.2f} "
+                  f"{operation:>9} {percentile(values, 0.5):>7.2f} {percentile(values, 0.95):>7.2f} {percentile(values, 0.99):>7.2f} "
+                  f"{result['avg_queue_wait']:>8.2f} {first_token if first_token is not None else float('nan'):>7.2f}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    settings.MOCK_LLM_LATENCY_SECONDS = args.latency
+    settings.MOCK_LLM_TOKENS_PER_SECOND = args.tokens_per_second
+    settings.MOCK_LLM_OUTPUT_TOKENS = args.output_tokens
+    settings.MOCK_LLM_RATE_LIMIT_RATE = args.rate_limit_rate
+    settings.MOCK_LLM_ERROR_RATE = args.error_rate
+
+    with tempfile.TemporaryDirectory(prefix="docgen-benchmark-") as base_dir:
+        # Keep benchmark projects out of the real projects registry
+        settings.PROJECTS_REGISTRY_FILE = Path(base_dir) / "projects_registry.json"
+        handler = BenchmarkExcelHandler(args.requirement_rows)
+        app.dependency_overrides[get_excel_handler] = lambda: handler
+        results = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None) as client:
+            for level in args.concurrency:
+                print(f"Running concurrency {level}...")
+                results.append(await run_level(client, base_dir, level, args))
+        app.dependency_overrides.pop(get_excel_handler, None)
+    print_report(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the document generation API against the mock LLM provider.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Concurrent agents per level")
+    parser.add_argument("--rounds", type=int, default=2, help="Generate/edit rounds per agent")
+    parser.add_argument("--agent-types", nargs="+", default=AGENT_TYPES, help="Agent types, assigned to workers in turn")
+    parser.add_argument("--model", default="mock/auto", help="Model the agents use")
+    parser.add_argument("--stream", action="store_true", help="Use the SSE endpoints")
+    parser.add_argument("--requirement-rows", type=int, default=200, help="Rows of the synthetic requirements sheet")
+    parser.add_argument("--latency", type=float, default=settings.MOCK_LLM_LATENCY_SECONDS, help="Mock time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=settings.MOCK_LLM_TOKENS_PER_SECOND, help="Mock output token rate")
+    parser.add_argument("--output-tokens", type=int, default=settings.MOCK_LLM_OUTPUT_TOKENS, help="Mock response size")
+    parser.add_argument("--rate-limit-rate", type=float, default=settings.MOCK_LLM_RATE_LIMIT_RATE, help="Share of mock calls answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=settings.MOCK_LLM_ERROR_RATE, help="Share of mock calls failing with a 500")
+    asyncio.run(main(parser.parse_args()))
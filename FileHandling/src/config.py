@@ -14,6 +14,95 @@ class Settings(BaseSettings):
     ALLOWED_UPLOAD_EXTENSIONS: set[str] = {'xlsx', 'xls'}
     PROJECTS_REGISTRY_FILE: Path = ROOT_DIR / 'projects_registry.json'
     APP_SECRET_KEY: str = os.urandom(24).hex() # For potential future session/cookie use
+    # Agent sessions are persisted under <project_dir>/<AGENT_SESSION_DIR_NAME>
+    AGENT_SESSION_DIR_NAME: str = 'agent_sessions'
+    AGENT_MAX_LOADED: int = 32 # Maximum number of agents kept in memory before idle ones are evicted
+    AGENT_MEMORY_BUDGET_MB: int = 256 # Approximate memory budget for all loaded agent conversations
+    DISCONNECT_POLL_SECONDS: float = 0.5 # How often a running agent call checks whether the client is still connected
+    # Images sent to the LLM are downscaled and re-encoded once, then served from a cache keyed by path+mtime
+    IMAGE_PIPELINE_ENABLED: bool = True
+    IMAGE_MAX_DIMENSION: int = 1600 # Longest side in pixels
+    IMAGE_FORMAT: str = 'WEBP' # WEBP, JPEG or PNG
+    IMAGE_QUALITY: int = 80 # Starting quality for lossy formats
+    IMAGE_QUANTIZE_COLORS: int = 0 # Palette size for PNG output (0 disables quantization)
+    IMAGE_MAX_BYTES: int = 1_000_000 # Default size budget per encoded image
+    IMAGE_MODEL_BUDGETS: dict[str, int] = { # Per-model size budgets, matched by model string prefix
+        'gemini': 3_000_000,
+        'gpt-4o-mini': 1_000_000,
+        'gpt-4o': 2_000_000,
+        'claude': 3_500_000,
+        'anthropic': 3_500_000,
+    }
+    IMAGE_CACHE_MB: int = 128 # Memory budget for cached encoded images
+    # Token budget for project context (documents, diagrams, CSV data) pasted into agent prompts
+    CONTEXT_TOKEN_BUDGET: int = 100_000
+    MODEL_CONTEXT_BUDGETS: dict[str, int] = { # Per-model budgets, matched by model string prefix
+        'gemini': 400_000,
+        'gpt-4o': 60_000,
+        'claude': 120_000,
+        'anthropic': 120_000,
+    }
+    # Once the project context exceeds RETRIEVAL_BUDGET_FRACTION of the tokens the model's budget leaves
+    # for it, prompts only include the top-k chunks retrieved from a per-project SQLite FTS5 index
+    # stored at <project_dir>/<RETRIEVAL_INDEX_FILE_NAME>
+    RETRIEVAL_ENABLED: bool = True
+    RETRIEVAL_INDEX_FILE_NAME: str = 'retrieval_index.sqlite'
+    RETRIEVAL_BUDGET_FRACTION: float = 0.75
+    RETRIEVAL_TOP_K: int = 12
+    RETRIEVAL_CHUNK_CHARS: int = 1_500
+    # Mark the stable prompt prefix with cache_control for models litellm reports as supporting prompt caching
+    PROMPT_CACHING_ENABLED: bool = True
+    # On-disk LLM response cache: "off", "readwrite" (record and reuse) or "replay" (recorded responses only, no network)
+    LLM_CACHE_MODE: str = 'off'
+    LLM_CACHE_DIR: Path = ROOT_DIR / 'llm_cache'
+    LLM_CACHE_MAX_MB: int = 512
+    # LLM call scheduling: per-model budgets matched by model string prefix (0 disables a budget)
+    LLM_MODEL_LIMITS: dict[str, dict[str, int]] = {
+        'gemini': {'rpm': 150, 'tpm': 1_000_000, 'concurrency': 8},
+        'mock': {'rpm': 0, 'tpm': 0, 'concurrency': 0},
+    }
+    LLM_DEFAULT_LIMITS: dict[str, int] = {'rpm': 60, 'tpm': 200_000, 'concurrency': 4}
+    LLM_EXPECTED_OUTPUT_TOKENS: int = 2_000 # Output tokens assumed when budgeting a call without max_tokens
+    LLM_MAX_RETRIES: int = 5
+    LLM_BACKOFF_BASE_SECONDS: float = 1.0
+    LLM_BACKOFF_MAX_SECONDS: float = 60.0
+    # Model routing, keyed by the model string an agent was added with, e.g.
+    # {"gemini/gemini-2.0-flash": {"fallbacks": ["gpt-4o-mini"], "strategy": "fastest", "hedge": True}}
+    MODEL_ROUTES: dict[str, dict] = {}
+    ROUTE_LATENCY_WINDOW: int = 50 # Latency samples kept per model
+    ROUTE_HEDGE_DEFAULT_SECONDS: float = 20.0 # Hedge delay until the primary model has enough samples for a p95
+    ROUTE_UNHEALTHY_FAILURES: int = 3 # Consecutive failures before a model is skipped
+    ROUTE_UNHEALTHY_COOLDOWN_SECONDS: float = 60.0
+    # Local mock LLM provider for load tests: model strings "mock/markdown", "mock/json", "mock/html"
+    # or "mock/auto" (picks the response kind from the prompt) answer with canned documents
+    MOCK_LLM_ENABLED: bool = False
+    MOCK_LLM_LATENCY_SECONDS: float = 0.5 # Time to first token
+    MOCK_LLM_LATENCY_JITTER: float = 0.25 # Latency varies uniformly by this fraction
+    MOCK_LLM_TOKENS_PER_SECOND: float = 200.0 # Output token rate, 0 answers instantly
+    MOCK_LLM_OUTPUT_TOKENS: int = 1_500 # Approximate size of the canned responses
+    MOCK_LLM_RATE_LIMIT_RATE: float = 0.0 # Share of calls rejected with a 429
+    MOCK_LLM_RETRY_AFTER_SECONDS: float = 1.0 # Retry-After sent with injected 429s
+    MOCK_LLM_ERROR_RATE: float = 0.0 # Share of calls failing with a 500 (streams fail halfway)
+    # TextDocumentAgent generation: "single" (one completion) or "sections" (outline first,
+    # then the sections concurrently, each retried on its own, then stitched together)
+    TEXT_DOCUMENT_MODE: str = 'single'
+    TEXT_DOCUMENT_MAX_SECTIONS: int = 12
+    TEXT_DOCUMENT_SECTION_RETRIES: int = 2 # Extra attempts per failed section
+    # TextDocumentAgent edits: "patch" (the model returns operations on the affected sections, applied
+    # and validated here, with a full rewrite only if the patch does not apply) or "rewrite"
+    TEXT_DOCUMENT_EDIT_MODE: str = 'patch'
+    # PrototypeAgent edits: "patch" (the model returns search/replace blocks, applied and checked for
+    # well-formedness here, with a full regeneration only if they do not apply) or "rewrite"
+    PROTOTYPE_EDIT_MODE: str = 'patch'
+    PROTOTYPE_SPEC_CACHE_SIZE: int = 4 # Stage-one design specs kept per prototype agent
+    # PrototypeAgent generation: "single" (one completion for the whole app) or "screens" (one completion
+    # per UI image, run concurrently, then merged into a single-file app with shared navigation)
+    PROTOTYPE_MODE: str = 'single'
+    PROTOTYPE_SCREEN_RETRIES: int = 2 # Extra attempts per failed screen
+    # Validate diagrams with code generated by fastjsonschema when it is installed (jsonschema otherwise)
+    DIAGRAM_FAST_VALIDATION: bool = True
+    # Per agent type overrides of the conversation compaction policy, e.g. {"TextDocumentAgent": {"max_tokens": 80000}}
+    COMPACTION_POLICIES: dict[str, dict] = {}
     class Config:
         env_file = '.env'
         env_file_encoding = 'utf-8'
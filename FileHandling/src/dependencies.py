@@ -1,9 +1,16 @@
 # dependencies.py
-from typing import Dict, Optional, Annotated
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Annotated
 from fastapi import Depends, HTTPException, status
 
 from config import settings
 from agents.IAgent import IAgent
+from agents.TextDocumentAgent import TextDocumentAgent
+from agents.DiagramAgent import ClassDiagramAgent
+from agents.PrototypeAgent import PrototypeAgent
+from utils.AgentStore import AgentStore
+from utils.AgentRegistry import AgentRegistry
 from utils.Project import Project
 from utils.ExcelFileHandler import ExcelFileHandler
 
@@ -23,52 +30,100 @@ def get_excel_handler() -> ExcelFileHandler:
     # Could add configuration here if needed
     return ExcelFileHandler()
 
-# Store the agent instance globally within this module, the user can add multiple instances of the same agent type but with different names
-_agent_instances: Dict[str, IAgent] = {}
+# Agent classes that can be created through the API and rehydrated from persisted sessions
+AGENT_TYPES: Dict[str, type] = {
+    "TextDocumentAgent": TextDocumentAgent,
+    "DiagramAgent": ClassDiagramAgent,
+    "ClassDiagramAgent": ClassDiagramAgent,
+    "PrototypeAgent": PrototypeAgent,
+}
 
-def add_agent_instance(agent_name: str, agent: IAgent) -> None:
-    """Adds a agent instance to the global dictionary."""
-    _agent_instances[agent_name] = agent
+# Store the agent instances globally within this module, the user can add multiple instances of the same agent type but with different names.
+# Idle agents are evicted to <project_dir>/agent_sessions and rehydrated on their next use.
+# The registry indexes agents by type and project and serializes calls on the same agent.
+agent_registry = AgentRegistry(AgentStore(
+    agent_types=AGENT_TYPES,
+    session_dir_name=settings.AGENT_SESSION_DIR_NAME,
+    max_loaded=settings.AGENT_MAX_LOADED,
+    memory_budget_bytes=settings.AGENT_MEMORY_BUDGET_MB * 1024 * 1024,
+))
+
+def add_agent_instance(agent_name: str, agent: IAgent, project: Optional[Project] = None) -> None:
+    """Adds a agent instance to the registry and persists it under the project directory."""
+    agent_registry.add(agent_name, agent, project)
+
+def agent_instance_exists(agent_name: str, project: Optional[Project] = None) -> bool:
+    """Checks whether a agent is loaded or persisted for the given project."""
+    return agent_registry.exists(agent_name, project)
 
 def get_agent_instance(agent_name: str) -> IAgent:
-    """Retrieves a agent instance from the global dictionary."""
-    if agent_name not in _agent_instances:
+    """Retrieves a agent instance, rehydrating it from the current project's sessions if needed."""
+    agent = agent_registry.get(agent_name, app_state.get("current_project"))
+    if agent is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"agent '{agent_name}' not found."
         )
-    return _agent_instances[agent_name]
+    return agent
 
-def remove_agent_instance(agent_name: str = None) -> None:
+@asynccontextmanager
+async def use_agent_instance(agent_name: str) -> AsyncIterator[IAgent]:
+    """
+    Acquires exclusive use of a agent instance for one call.
+    Calls on the same agent are queued, and the session is persisted when the call ends.
     """
-    Removes a agent instance from the global dictionary.
+    project = app_state.get("current_project")
+    # Indexing the project reads its persisted sessions, so it runs off the event loop
+    if not await asyncio.to_thread(agent_registry.exists, agent_name, project):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"agent '{agent_name}' not found."
+        )
+    async with agent_registry.session(agent_name, project) as agent:
+        yield agent
+
+def save_agent_instance(agent_name: str) -> None:
+    """Persists the current session of a agent instance to disk."""
+    agent_registry.save(agent_name, app_state.get("current_project"))
+
+def remove_agent_instance(agent_name: str = None, project: Optional[Project] = None) -> None:
+    """
+    Removes a agent instance and its persisted session, looked up in the project's sessions if it is not loaded.
     If agent_name is None, removes all agent instances.
     """
     if agent_name is None:
-        _agent_instances.clear()
-    elif agent_name in _agent_instances:
-        del _agent_instances[agent_name]
+        agent_registry.clear(project)
+    else:
+        agent_registry.remove(agent_name, project)
 
-def get_agent_with_type(agent_type: str) -> Dict[str, IAgent]:
+def get_agent_with_type(agent_type: str, project: Optional[Project] = None) -> Dict[str, IAgent]:
     """
-    Retrieves all agent instances of a specific type from the global dictionary.
+    Retrieves all agent instances of a specific type using the registry's type index.
+    Persisted agents of the project are rehydrated.
     
     Args:
         agent_type (str): The type name of the agent to retrieve (e.g., "TextDocumentAgent")
+        project (Project, optional): Restrict the result to agents of this project
         
     Returns:
         Dict[str, IAgent]: Dictionary of agents matching the specified type
     """
     result = {}
-    for name, agent in _agent_instances.items():
-        # Check agent class name against the requested type
-        if agent.__class__.__name__ == agent_type:
+    for name in list_agent_names_with_type(agent_type, project):
+        agent = agent_registry.get(name, project)
+        if agent is not None:
             result[name] = agent
     return result
 
+def list_agent_names_with_type(agent_type: str, project: Optional[Project] = None) -> List[str]:
+    """Lists the names of all agents of a specific type without loading them."""
+    agent_class = AGENT_TYPES.get(agent_type)
+    class_name = agent_class.__name__ if agent_class else agent_type
+    return agent_registry.names_with_type(class_name, project)
+
 def clear_agent_instances() -> None:
-    """Clears all agent instances from the global dictionary."""
-    _agent_instances.clear()
+    """Clears all agent instances and their persisted sessions."""
+    agent_registry.clear(app_state.get("current_project"))
 
 
 
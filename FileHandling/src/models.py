@@ -67,6 +67,36 @@ class TextGenerationResponse(BaseModel):
     message: str
     dir: str # Path to the generated file
 
+class AgentDocumentResponse(BaseModel):
+    status: str
+    agent_name: str
+    document: Any # Markdown, diagram JSON or HTML depending on the agent type
+
+class BatchNode(BaseModel):
+    id: str = Field(..., description="Unique id of the node in the plan")
+    agent_name: str = Field(..., description="Agent generating the document")
+    agent_type: Optional[str] = Field(None, description="Type of the agent, to create it if it does not exist")
+    model: Optional[str] = Field(None, description="Model of the agent, to create it if it does not exist")
+    depends_on: List[str] = Field(default_factory=list, description="Ids of the nodes whose documents this node is given")
+
+class BatchGenerationRequest(BaseModel):
+    nodes: List[BatchNode] = Field(..., description="The document plan, a DAG of nodes")
+
+class BatchNodeResult(BaseModel):
+    id: str
+    agent_name: str
+    status: str # "success", "error" or "skipped"
+    document: Any = None
+    error: Optional[str] = None
+    started_seconds: Optional[float] = None # Since the start of the batch
+    seconds: Optional[float] = None
+
+class BatchGenerationResponse(BaseModel):
+    status: str # "success", "partial" or "error"
+    seconds: float
+    sequential_seconds: float # Sum of the node durations, what generating one by one would take
+    results: List[BatchNodeResult]
+
 class SimpleStatusResponse(BaseModel):
     status: str
     message: Optional[str] = None
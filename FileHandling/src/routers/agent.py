@@ -1,18 +1,29 @@
 # routers/generation.py
 import os
-from typing import Annotated, Dict, Any, List
-from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.responses import HTMLResponse, FileResponse
+import json
+import asyncio
+from typing import Annotated, Dict, Any, List, Optional, AsyncIterator, Awaitable, Callable
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from pathlib import Path
 
+from config import settings
+from agents.IAgent import IAgent
 from utils.Project import Project
-from agents import TextDocumentAgent, DiagramAgent, PrototypeAgent
+from utils import LLMClient
+from utils.ResponseCache import response_cache
+from utils.ModelRouter import model_router
+from utils.Telemetry import telemetry
+from utils.LLMScheduler import llm_scheduler, call_priority, priority_scope, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BATCH
+from utils.DocumentPlan import DocumentPlanError, run_plan, topological_order
 from models import (
     GenerationResponse, TextGenerationResponse, ErrorResponse,
-    SimpleStatusResponse
+    SimpleStatusResponse, AgentDocumentResponse,
+    BatchNode, BatchGenerationRequest, BatchNodeResult, BatchGenerationResponse
 )
-from dependencies import get_current_project, get_agent_with_type
+from dependencies import get_current_project, get_optional_current_project, AGENT_TYPES
 from dependencies import add_agent_instance, get_agent_instance, remove_agent_instance
+from dependencies import agent_instance_exists, list_agent_names_with_type, use_agent_instance, agent_registry
 from fastapi import Body
 
 router = APIRouter(
@@ -21,6 +32,23 @@ router = APIRouter(
     responses={404: {"description": "Not found", "model": ErrorResponse}},
 )
 
+def _create_agent(agent_name: str, agent_type: str, model: str, project: Project) -> None:
+    """
+    Create an agent and add it to the registry.
+
+    Raises:
+        HTTPException: 400 if the agent type is not supported
+    """
+    agent_class = AGENT_TYPES.get(agent_type)
+    if agent_class is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported agent type '{agent_type}'."
+        )
+    agent = agent_class(agent_name, model, project)
+    
+    add_agent_instance(agent_name, agent, project)
+
 @router.post("/add")
 def add_agent(
     agent_name: str = Body(..., embed=True, description="Name of the agent"),
@@ -31,128 +59,373 @@ def add_agent(
     """
     Add an agent instance to the global dictionary.
     """
-    if agent_name in get_agent_with_type(agent_type):
+    if agent_instance_exists(agent_name, project):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Agent '{agent_name}' already exists."
         )
     
-    if agent_type == "TextDocumentAgent":
-        agent = TextDocumentAgent(agent_name, model, project)
-    elif agent_type == "DiagramAgent":
-        agent = DiagramAgent(agent_name, model, project)
-    elif agent_type == "PrototypeAgent":
-        agent = PrototypeAgent(agent_name, model, project)
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Unsupported agent type '{agent_type}'."
-        )
-    
-    add_agent_instance(agent_name, agent)
+    _create_agent(agent_name, agent_type, model, project)
     
     return SimpleStatusResponse(status="success", message=f"Agent '{agent_name}' added successfully.")
 
 @router.get("/list-agents-with-type/{agent_type}")
 def list_agents_with_type(
-    agent_type: str
+    agent_type: str,
+    project: Optional[Project] = Depends(get_optional_current_project),
 ) -> List[str]:
     """
-    List all agent instances of a specific type.
+    List all agent instances of a specific type, including sessions persisted for the current project.
     """
-    agents = get_agent_with_type(agent_type)
-    return [agent.name for agent in agents.values()]
+    return list_agent_names_with_type(agent_type, project)
 
 @router.post("/delete/{agent_name}")
 def delete_agent(
     agent_name: str,
+    project: Optional[Project] = Depends(get_optional_current_project),
 ) -> SimpleStatusResponse:
     """
-    Delete an agent instance from the global dictionary.
+    Delete an agent instance and its persisted session.
     """
-    remove_agent_instance(agent_name)
+    remove_agent_instance(agent_name, project)
     return SimpleStatusResponse(status="success", message=f"Agent '{agent_name}' deleted successfully.")
 
 @router.post("/clear-all")
-def clear_all_agents() -> SimpleStatusResponse:
+def clear_all_agents(
+    project: Optional[Project] = Depends(get_optional_current_project),
+) -> SimpleStatusResponse:
     """
-    Clear all agent instances from the global dictionary.
+    Clear all agent instances and their persisted sessions.
     """
-    remove_agent_instance()
+    remove_agent_instance(project=project)
     return SimpleStatusResponse(status="success", message="All agents cleared successfully.")
 
-@router.post("/generate/{agent_name}")
-def generate_text_document(
+@router.get("/context-report/{agent_name}")
+def get_context_report(
     agent_name: str,
-    project: Project = Depends(get_current_project)
-) -> TextGenerationResponse:
+) -> List[Dict[str, Any]]:
     """
-    Generate a text document using the specified agent.
+    Report how the agent's last prompt context was fitted into the token budget:
+    which sections were kept, summarized, truncated or dropped.
     """
-    agent = get_agent_instance(agent_name)
-    
-    if agent is None:
+    return get_agent_instance(agent_name).last_context_report
+
+@router.get("/metrics")
+def get_agent_metrics() -> Dict[str, Any]:
+    """
+    Report agent call telemetry (latency, queue wait, time to first token,
+    tokens, cost, payload and image sizes, extraction failures) in total and
+    per project, agent type and model.
+    """
+    return telemetry.metrics()
+
+@router.get("/stats/prompt-cache")
+def get_prompt_cache_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Report token usage per model, including how many prompt tokens were
+    served from the provider's prompt cache.
+    """
+    return LLMClient.usage_stats()
+
+@router.get("/stats/response-cache")
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Report the mode, hits, misses and size of the on-disk LLM response cache."""
+    return response_cache.get_stats()
+
+@router.get("/stats/scheduler")
+def get_scheduler_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Report LLM scheduler metrics per model: queued calls by priority, calls in
+    flight, budget usage over the last minute, retries, rate limits and queue wait times.
+    """
+    return llm_scheduler.stats()
+
+@router.get("/stats/routing")
+def get_routing_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Report per-model latency percentiles, health, and how often calls were
+    hedged to or fell back to each model.
+    """
+    return model_router.stats()
+
+@router.get("/stats/locks")
+def get_agent_lock_stats(
+    project: Optional[Project] = Depends(get_optional_current_project),
+) -> Dict[str, Dict[str, float]]:
+    """
+    Report per-agent lock statistics of the current project: number of calls,
+    callers currently queued and wait times.
+    """
+    return agent_registry.wait_stats(project)
+
+def _sse_event(event: Dict[str, Any]) -> str:
+    """Format an agent event as a Server-Sent Events message."""
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+async def _stream_agent_events(
+    agent_name: str,
+    project: Project,
+    operation: str,
+    events: Callable[[IAgent], AsyncIterator[Dict[str, Any]]],
+    priority: int = PRIORITY_NORMAL,
+) -> StreamingResponse:
+    """
+    Stream the events of an agent call over SSE. Tokens are forwarded as they
+    arrive; the extracted document and its validation result are the last event.
+    The agent stays locked for the whole stream. LLM calls are scheduled at `priority`.
+    """
+    # Fail before the stream starts, while a proper HTTP error can still be returned
+    if not await asyncio.to_thread(agent_instance_exists, agent_name, project):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Agent '{agent_name}' not found."
         )
-    
-    if not isinstance(agent, TextDocumentAgent):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Agent '{agent_name}' is not a TextDocumentAgent."
-        )
-    
-    # Generate the document
-    document = agent.generate(project.context)
-    
-    if document is None:
+
+    async def event_stream() -> AsyncIterator[str]:
+        # A client disconnect or /agent/cancel cancels this task, which closes the
+        # provider stream and rolls the conversation back when the session exits
+        task = asyncio.current_task()
+        agent_registry.track(agent_name, task, project)
+        call_priority.set(priority) # The stream runs in its own task
+        try:
+            async with use_agent_instance(agent_name) as agent:
+                checkpoint = agent.checkpoint()
+                with telemetry.agent_call(project.id, agent_name, agent, operation) as call_record:
+                    async for event in events(agent):
+                        if event["event"] == "result":
+                            call_record.extraction_ok = event["data"]["status"] == "success"
+                            if call_record.extraction_ok:
+                                # Generated and edited documents replace the stored version
+                                agent.publish_document(project.context, event["data"]["document"])
+                                # Update the context with the generated document
+                                agent.update_context(project.context)
+                            else:
+                                agent.rollback(checkpoint)
+                        yield _sse_event(event)
+        finally:
+            agent_registry.untrack(agent_name, task, project)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _run_cancellable(request: Request, agent_name: str, project: Project, call: Awaitable[Any],
+                           priority: int = PRIORITY_NORMAL) -> Any:
+    """
+    Run an agent call as a task that is cancelled, aborting the provider
+    request, when the client disconnects or /agent/cancel is called.
+    LLM calls made by the task are scheduled at `priority`. The call acquires
+    the agent session itself, so a client that disconnects while the call is
+    queued behind another one on the same agent is detected as well.
+
+    Raises:
+        HTTPException: 499 if the call was cancelled
+    """
+    with priority_scope(priority):
+        task = asyncio.ensure_future(call) # The task copies the current context, including the priority
+    agent_registry.track(agent_name, task, project)
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_SECONDS)
+            if not task.done() and await request.is_disconnected():
+                print(f"Client disconnected, cancelling call on agent '{agent_name}'")
+                task.cancel()
+                await asyncio.wait({task})
+    except asyncio.CancelledError:
+        task.cancel() # The request itself was cancelled (e.g. server shutdown)
+        raise
+    finally:
+        agent_registry.untrack(agent_name, task, project)
+    if task.cancelled():
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to generate document with agent '{agent_name}'."
+            status_code=499, # Client Closed Request
+            detail=f"Call on agent '{agent_name}' was cancelled."
         )
+    return task.result()
+
+@router.post("/cancel/{agent_name}")
+async def cancel_agent_call(
+    agent_name: str,
+    project: Optional[Project] = Depends(get_optional_current_project),
+) -> SimpleStatusResponse:
+    """
+    Cancel the running call of an agent. The provider request is aborted and the
+    agent's conversation is rolled back to its state before the call.
+    """
+    cancelled = agent_registry.cancel(agent_name, project)
+    if not cancelled:
+        return SimpleStatusResponse(status="success", message=f"Agent '{agent_name}' has no running call.")
+    return SimpleStatusResponse(status="success", message=f"Cancelled {cancelled} running call(s) on agent '{agent_name}'.")
+
+@router.post("/generate/{agent_name}", response_model=None)
+async def generate_document(
+    request: Request,
+    agent_name: str,
+    stream: bool = Query(False, description="Stream tokens as Server-Sent Events"),
+    project: Project = Depends(get_current_project)
+) -> AgentDocumentResponse | StreamingResponse:
+    """
+    Generate a document (markdown, diagram JSON or HTML prototype) using the specified agent.
+    The LLM call runs asynchronously, so it does not hold a server thread while waiting.
+    Concurrent calls on the same agent are serialized. The call is cancelled if the
+    client disconnects or /agent/cancel is called.
+
+    With `stream=true` the response is an SSE stream of `token` events followed by a
+    final `result` event holding the extracted document and its validation result.
+    """
+    if stream:
+        return await _stream_agent_events(agent_name, project, "generate", lambda agent: agent.astream_generate(project.context))
+
+    async def generate() -> Any:
+        async with use_agent_instance(agent_name) as agent:
+            # Generate the document
+            with telemetry.agent_call(project.id, agent_name, agent, "generate") as call_record:
+                document = await agent.agenerate(project.context)
+                call_record.extraction_ok = document is not None
+            
+            if document is None:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to generate document with agent '{agent_name}'."
+                )
+            
+            # Update the context with the generated document
+            agent.publish_document(project.context, document)
+            agent.update_context(project.context)
+        return document
+
+    document = await _run_cancellable(request, agent_name, project, generate())
     
-    # Update the context with the generated document
-    agent.update_context(project.context)
-    
-    return TextGenerationResponse(
+    return AgentDocumentResponse(
         status="success",
         document=document,
         agent_name=agent_name
     )
 
-@router.post("/edit/{agent_name}")
-def edit_document(
+@router.post("/generate-batch")
+async def generate_batch(
+    request: Request,
+    plan: BatchGenerationRequest,
+    project: Project = Depends(get_current_project)
+) -> BatchGenerationResponse:
+    """
+    Generate a set of documents from a plan. The plan is a DAG: each node names
+    the agent generating a document and the nodes it depends on (e.g. SRS ->
+    architecture -> API spec, plus independent documents). A node starts as
+    soon as its dependencies are done and is given only their documents, not
+    every document of the project, so independent documents are generated
+    concurrently and the batch takes about as long as its longest chain.
+
+    Missing agents are created when the node gives an agent type and model.
+    Nodes whose dependencies failed are skipped. LLM calls run at batch priority,
+    behind interactive requests. Cancelling a node's agent fails that node.
+    """
+    try:
+        topological_order(plan.nodes)
+    except DocumentPlanError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    for node in plan.nodes:
+        if await asyncio.to_thread(agent_instance_exists, node.agent_name, project):
+            continue
+        if not node.agent_type or not node.model:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Agent '{node.agent_name}' not found and node '{node.id}' has no agent type and model to create it."
+            )
+        # Building an agent assembles its context, syncs the retrieval index and encodes images
+        await asyncio.to_thread(_create_agent, node.agent_name, node.agent_type, node.model, project)
+
+    published: Dict[str, tuple] = {} # node id -> (kind, name) of the document it stored in the context
+
+    async def run_node(node: BatchNode) -> Any:
+        dependencies = [published[dependency] for dependency in node.depends_on if published.get(dependency)]
+        scoped_context = project.context.scoped(
+            text_docs=[name for kind, name in dependencies if kind == "doc"],
+            diagrams=[name for kind, name in dependencies if kind == "diagram"],
+            prototype=any(kind == "prototype" for kind, _ in dependencies),
+        )
+
+        async def generate() -> Any:
+            async with use_agent_instance(node.agent_name) as agent:
+                with telemetry.agent_call(project.id, node.agent_name, agent, "generate-batch") as call_record:
+                    document = await agent.agenerate(scoped_context)
+                    call_record.extraction_ok = document is not None
+                if document is None:
+                    raise RuntimeError(f"Failed to generate document with agent '{node.agent_name}'.")
+                published[node.id] = agent.publish_document(project.context, document)
+                # Later single calls on this agent see the whole project again
+                agent.update_context(project.context)
+            return document
+
+        return await _run_cancellable(request, node.agent_name, project, generate(), priority=PRIORITY_BATCH)
+
+    outcomes = await run_plan(plan.nodes, run_node)
+    results = [
+        BatchNodeResult(
+            id=node.id,
+            agent_name=node.agent_name,
+            status=outcomes[node.id].status,
+            document=outcomes[node.id].result,
+            error=outcomes[node.id].error,
+            started_seconds=outcomes[node.id].started,
+            seconds=outcomes[node.id].seconds,
+        )
+        for node in plan.nodes
+    ]
+    succeeded = sum(1 for result in results if result.status == "success")
+    return BatchGenerationResponse(
+        status="success" if succeeded == len(results) else "partial" if succeeded else "error",
+        seconds=max((outcome.finished for outcome in outcomes.values() if outcome.finished is not None), default=0.0),
+        sequential_seconds=sum(outcome.seconds or 0.0 for outcome in outcomes.values()),
+        results=results,
+    )
+
+@router.post("/edit/{agent_name}", response_model=None)
+async def edit_document(
+    request: Request,
     agent_name: str,
     prompt: str = Body(..., embed=True, description="Prompt for editing"),
     attached_context: str = Body(..., embed=True, description="Context to attach to the document"),
+    stream: bool = Query(False, description="Stream tokens as Server-Sent Events"),
     project: Project = Depends(get_current_project)
-) -> TextGenerationResponse:
+) -> AgentDocumentResponse | StreamingResponse:
     """
     Edit a document using the specified agent.
+    The LLM call runs asynchronously, so it does not hold a server thread while waiting.
+    Concurrent calls on the same agent are serialized. The call is cancelled if the
+    client disconnects or /agent/cancel is called.
+
+    With `stream=true` the response is an SSE stream of `token` events followed by a
+    final `result` event holding the extracted document and its validation result.
     """
-    agent = get_agent_instance(agent_name)
-    
-    if agent is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Agent '{agent_name}' not found."
-        )
-    
-    # Edit the document
-    edited_document = agent.edit(prompt, attached_context, project.context)
-    
-    if edited_document is None:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to edit document with agent '{agent_name}'."
-        )
-    
-    # Update the context with the edited document
-    agent.update_context(project.context)
+    if stream:
+        return await _stream_agent_events(agent_name, project, "edit", lambda agent: agent.astream_edit(prompt, attached_context, project.context),
+                                           priority=PRIORITY_INTERACTIVE)
+
+    async def edit() -> Any:
+        async with use_agent_instance(agent_name) as agent:
+            # Edit the document
+            with telemetry.agent_call(project.id, agent_name, agent, "edit") as call_record:
+                edited_document = await agent.aedit(prompt, attached_context, project.context)
+                call_record.extraction_ok = edited_document is not None
+            
+            if edited_document is None:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to edit document with agent '{agent_name}'."
+                )
+            
+            # Update the context with the edited document
+            agent.publish_document(project.context, edited_document)
+            agent.update_context(project.context)
+        return edited_document
+
+    edited_document = await _run_cancellable(request, agent_name, project, edit(), priority=PRIORITY_INTERACTIVE)
     
-    return TextGenerationResponse(
+    return AgentDocumentResponse(
         status="success",
         document=edited_document,
         agent_name=agent_name
-    )
\ No newline at end of file
+    )
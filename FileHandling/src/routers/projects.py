@@ -11,6 +11,7 @@ from utils.Project import Project
 from utils import RegistryHandler # Import the module
 from models import ProjectCreateRequest, ProjectInfo, ProjectListItem, SimpleStatusResponse, ErrorResponse
 from dependencies import get_app_state, get_agent_instance, get_optional_current_project
+from utils.Telemetry import telemetry
 
 router = APIRouter(
     prefix="/projects",
@@ -165,6 +166,19 @@ async def get_project_details(
     )
 
 
+@router.get("/stats", summary="Get agent usage statistics of the current project")
+async def get_project_stats(
+    current_project: Annotated[Project, Depends(get_optional_current_project)]
+) -> Dict[str, Any]:
+    """Returns the agent call telemetry of the active project, in total and per agent and model."""
+    if not current_project:
+         raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No active project. Please create or load a project first."
+         )
+    return telemetry.project_stats(current_project.id)
+
+
 # --- Internal Helper Functions ---
 # TODO: remove the GeneralAgent parameter because it has been deleted
 async def close_project_internal(app_state: dict):
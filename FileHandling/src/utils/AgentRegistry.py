@@ -0,0 +1,233 @@
+# utils/AgentRegistry.py
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from agents.IAgent import IAgent
+from utils.AgentStore import AgentKey, AgentStore, agent_key
+from utils.Project import Project
+
+
+class AgentRegistry:
+    """
+    Registry of agent instances indexed by agent type and project.
+
+    Agent objects themselves live in an AgentStore (bounded memory, persisted
+    sessions); the registry only keeps lightweight indices so lookups by type
+    or project never scan or rehydrate unrelated agents. Every agent has its
+    own lock: calls on the same agent are serialized so their conversation
+    appends never interleave, while different agents run fully in parallel.
+    """
+
+    def __init__(self, store: AgentStore):
+        self.store = store
+        self._lock = threading.RLock() # Guards the indices and the store
+        # Agents are keyed by (project id, agent name), so projects may reuse agent names
+        self._types: Dict[AgentKey, str] = {} # agent -> agent class name
+        self._by_type: Dict[str, Set[AgentKey]] = {}
+        self._by_project: Dict[Optional[str], Set[str]] = {} # project id -> agent names
+        self._indexed_projects: Set[str] = set()
+        self._project_session_dirs: Dict[str, Path] = {} # project id -> session directory
+        self._agent_locks: Dict[AgentKey, asyncio.Lock] = {}
+        self._wait_stats: Dict[AgentKey, Dict[str, float]] = {}
+        self._inflight: Dict[AgentKey, Set[asyncio.Task]] = {} # agent -> running calls
+
+    # --- Indexing ---
+
+    def _index(self, key: AgentKey, agent_type: str) -> None:
+        self._types[key] = agent_type
+        self._by_type.setdefault(agent_type, set()).add(key)
+        self._by_project.setdefault(key[0], set()).add(key[1])
+
+    def _unindex(self, key: AgentKey) -> None:
+        agent_type = self._types.pop(key, None)
+        self._by_type.get(agent_type, set()).discard(key)
+        self._by_project.get(key[0], set()).discard(key[1])
+        self._agent_locks.pop(key, None)
+        self._wait_stats.pop(key, None)
+
+    def _index_project(self, project: Optional[Project]) -> None:
+        """Index the sessions persisted for a project without loading them."""
+        if project is None or project.id in self._indexed_projects:
+            return
+        self._project_session_dirs[project.id] = self.store.session_dir(project)
+        for agent_name, agent_type in self.store.list_persisted(project).items():
+            key = agent_key(agent_name, project)
+            if key not in self._types:
+                self._index(key, agent_type)
+        self._indexed_projects.add(project.id)
+
+    # --- Public API ---
+
+    def add(self, agent_name: str, agent: IAgent, project: Optional[Project] = None) -> None:
+        """Register a new agent under its type and project."""
+        with self._lock:
+            self._index_project(project)
+            self.store.add(agent_name, agent, project)
+            self._index(agent_key(agent_name, project), agent.__class__.__name__)
+
+    def exists(self, agent_name: str, project: Optional[Project] = None) -> bool:
+        """Check whether an agent is registered in a project, including its persisted sessions."""
+        with self._lock:
+            self._index_project(project)
+            return agent_key(agent_name, project) in self._types
+
+    def get(self, agent_name: str, project: Optional[Project] = None) -> Optional[IAgent]:
+        """Return an agent of a project, rehydrating it from the project's sessions if needed."""
+        with self._lock:
+            self._index_project(project)
+            agent = self.store.get(agent_name, project)
+            key = agent_key(agent_name, project)
+            if agent is not None and key not in self._types:
+                self._index(key, agent.__class__.__name__)
+            return agent
+
+    def save(self, agent_name: str, project: Optional[Project] = None) -> None:
+        """Persist the current session of an agent."""
+        with self._lock:
+            self.store.save(agent_name, project)
+
+    def remove(self, agent_name: str, project: Optional[Project] = None) -> None:
+        """
+        Remove an agent and its persisted session. The session is found through
+        the project index, so agents that are not loaded are deleted too.
+        """
+        with self._lock:
+            self._index_project(project)
+            key = agent_key(agent_name, project)
+            session_dir = self._project_session_dirs.get(key[0])
+            self.store.remove(agent_name, project, session_dir)
+            self._unindex(key)
+
+    def clear(self, project: Optional[Project] = None) -> None:
+        """Remove every registered agent and every session persisted for the indexed projects."""
+        with self._lock:
+            self._index_project(project)
+            self.store.clear(self._project_session_dirs.values())
+            for key in list(self._types.keys()):
+                self._unindex(key)
+
+    def names_with_type(self, agent_type: str, project: Optional[Project] = None) -> List[str]:
+        """
+        Return the names of all agents of a type. When a project is given, only
+        agents belonging to that project are returned.
+        """
+        with self._lock:
+            self._index_project(project)
+            keys = self._by_type.get(agent_type, set())
+            if project is not None:
+                return sorted(agent_name for project_id, agent_name in keys if project_id == project.id)
+            return sorted({agent_name for _, agent_name in keys})
+
+    def names_in_project(self, project: Project) -> List[str]:
+        """Return the names of all agents belonging to a project."""
+        with self._lock:
+            self._index_project(project)
+            return sorted(self._by_project.get(project.id, set()))
+
+    # --- Per-agent concurrency control ---
+
+    @asynccontextmanager
+    async def session(self, agent_name: str, project: Optional[Project] = None) -> AsyncIterator[IAgent]:
+        """
+        Acquire exclusive use of an agent for the duration of a call.
+
+        Calls on the same agent queue up behind each other on an asyncio lock,
+        so waiting callers do not hold a server thread; the time spent waiting
+        is recorded and reported by `wait_stats`. The agent is pinned in memory
+        while the session is held and persisted when it ends. If the call is
+        cancelled or fails, the conversation is rolled back to its state at the
+        start of the session so no dangling user turn is persisted.
+
+        Raises:
+            KeyError: If the agent does not exist
+        """
+        key = agent_key(agent_name, project)
+        with self._lock:
+            agent_lock = self._agent_locks.setdefault(key, asyncio.Lock())
+            stats = self._wait_stats.setdefault(key, {
+                "calls": 0, "waiting": 0, "total_wait_seconds": 0.0,
+                "max_wait_seconds": 0.0, "last_wait_seconds": 0.0,
+            })
+            stats["waiting"] += 1
+
+        started = time.perf_counter()
+        try:
+            await agent_lock.acquire()
+        finally:
+            waited = time.perf_counter() - started
+            with self._lock:
+                stats["waiting"] -= 1
+        try:
+            with self._lock:
+                stats["calls"] += 1
+                stats["total_wait_seconds"] += waited
+                stats["last_wait_seconds"] = waited
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+            # Rehydrating a persisted session reads and decodes it, which should not block the event loop
+            agent = await asyncio.to_thread(self.get, agent_name, project)
+            if agent is None:
+                raise KeyError(agent_name)
+            with self._lock:
+                self.store.pin(agent_name, project)
+            if waited > 0.05:
+                print(f"Agent '{agent_name}' waited {waited:.2f}s for a previous call to finish")
+            # Compact before the checkpoint so a rollback never restores an oversized history
+            await agent.acompact_history()
+            checkpoint = agent.checkpoint()
+            try:
+                yield agent
+            except BaseException:
+                agent.rollback(checkpoint)
+                raise
+            finally:
+                # Writing a large session should not block the event loop
+                await asyncio.to_thread(self.save, agent_name, project)
+                with self._lock:
+                    self.store.unpin(agent_name, project)
+        finally:
+            agent_lock.release()
+
+    # --- Cancellation ---
+
+    def track(self, agent_name: str, task: asyncio.Task, project: Optional[Project] = None) -> None:
+        """Record a running call on an agent so it can be cancelled."""
+        with self._lock:
+            self._inflight.setdefault(agent_key(agent_name, project), set()).add(task)
+
+    def untrack(self, agent_name: str, task: asyncio.Task, project: Optional[Project] = None) -> None:
+        """Forget a finished call."""
+        with self._lock:
+            self._inflight.get(agent_key(agent_name, project), set()).discard(task)
+
+    def cancel(self, agent_name: str, project: Optional[Project] = None) -> int:
+        """
+        Cancel every running call on an agent of a project. Cancelling the task
+        aborts the provider request it is awaiting. Returns the number of calls cancelled.
+        """
+        with self._lock:
+            tasks = [task for task in self._inflight.get(agent_key(agent_name, project), set()) if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            print(f"Cancelled {len(tasks)} running call(s) on agent '{agent_name}'")
+        return len(tasks)
+
+    def wait_stats(self, project: Optional[Project] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Return per-agent lock statistics (calls, queued callers and wait times).
+        With a project, only its agents are reported, by name; otherwise every
+        agent is reported as "<project id>/<agent name>".
+        """
+        with self._lock:
+            return {
+                (agent_name if project is not None or project_id is None else f"{project_id}/{agent_name}"): {
+                    **stats,
+                    "avg_wait_seconds": stats["total_wait_seconds"] / stats["calls"] if stats["calls"] else 0.0,
+                }
+                for (project_id, agent_name), stats in self._wait_stats.items()
+                if project is None or project_id == project.id
+            }
@@ -0,0 +1,217 @@
+# utils/AgentStore.py
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from agents.IAgent import IAgent
+from utils.Project import Project
+
+# Agents are identified by their project id (None for agents without a project) and their name,
+# so the same name can be used in several projects
+AgentKey = Tuple[Optional[str], str]
+
+
+def agent_key(agent_name: str, project: Optional[Project] = None) -> AgentKey:
+    """Return the key of an agent of a project."""
+    return (project.id if project is not None else None, agent_name)
+
+
+class AgentStore:
+    """
+    Keeps agent sessions bounded in memory and persisted to per-project storage.
+
+    Loaded agents are kept in LRU order. When the number of loaded agents or the
+    approximate size of their conversations exceeds the configured budget, the
+    least recently used agents are written to disk and dropped from memory. They
+    are rehydrated transparently on their next use, including after a restart.
+    """
+
+    def __init__(self, agent_types: Dict[str, type], session_dir_name: str,
+                 max_loaded: int, memory_budget_bytes: int):
+        """
+        Args:
+            agent_types: Mapping of agent class name to agent class, used for rehydration
+            session_dir_name: Name of the session folder inside each project directory
+            max_loaded: Maximum number of agents kept in memory
+            memory_budget_bytes: Approximate memory budget for all loaded conversations
+        """
+        self.agent_types = agent_types
+        self.session_dir_name = session_dir_name
+        self.max_loaded = max_loaded
+        self.memory_budget_bytes = memory_budget_bytes
+        self._loaded: "OrderedDict[AgentKey, IAgent]" = OrderedDict()
+        # Where each known agent is persisted; agents without a project are pinned in memory
+        self._session_dirs: Dict[AgentKey, Path] = {}
+        # Agents currently in use by a call, which must not be evicted
+        self._pinned: Set[AgentKey] = set()
+
+    # --- Paths ---
+
+    def session_dir(self, project: Project) -> Path:
+        """Return the directory holding the agent sessions of a project."""
+        return Path(project.project_dir) / self.session_dir_name
+
+    def _session_file(self, session_dir: Path, agent_name: str) -> Path:
+        safe_name = "".join(c if c.isalnum() or c in "-_ " else "_" for c in agent_name)
+        return session_dir / f"{safe_name}.json"
+
+    # --- Public API ---
+
+    def add(self, agent_name: str, agent: IAgent, project: Optional[Project] = None) -> None:
+        """Register a new agent, persist it and enforce the memory budget."""
+        key = agent_key(agent_name, project)
+        if project is not None:
+            self._session_dirs[key] = self.session_dir(project)
+        self._loaded[key] = agent
+        self._loaded.move_to_end(key)
+        self._save(key)
+        self._enforce_budget()
+
+    def get(self, agent_name: str, project: Optional[Project] = None) -> Optional[IAgent]:
+        """
+        Return a loaded agent of a project, rehydrating it from disk if it was
+        evicted or the server restarted. Returns None if the agent is unknown.
+        """
+        key = agent_key(agent_name, project)
+        agent = self._loaded.get(key)
+        if agent is not None:
+            self._loaded.move_to_end(key)
+            return agent
+
+        session_dir = self._session_dirs.get(key)
+        if session_dir is None and project is not None:
+            session_dir = self.session_dir(project)
+        if session_dir is None:
+            return None
+
+        agent = self._load_from_disk(session_dir, agent_name)
+        if agent is None:
+            return None
+        self._session_dirs[key] = session_dir
+        self._loaded[key] = agent
+        self._enforce_budget()
+        return agent
+
+    def save(self, agent_name: str, project: Optional[Project] = None) -> bool:
+        """Write a loaded agent session to disk. Returns False if it cannot be persisted."""
+        return self._save(agent_key(agent_name, project))
+
+    def remove(self, agent_name: str, project: Optional[Project] = None, session_dir: Optional[Path] = None) -> None:
+        """
+        Remove an agent from memory and delete its persisted session.
+
+        Args:
+            agent_name: The agent to remove
+            project: The project the agent belongs to
+            session_dir: Where the session is stored, for agents that were never loaded since a restart
+        """
+        self._remove(agent_key(agent_name, project), session_dir)
+
+    def clear(self, session_dirs: Iterable[Path] = ()) -> None:
+        """
+        Remove every known agent from memory and delete their persisted sessions,
+        as well as every session stored in `session_dirs`, loaded or not.
+        """
+        for key in list(self._loaded.keys()) + list(self._session_dirs.keys()):
+            self._remove(key)
+        for session_dir in session_dirs:
+            for session_file in Path(session_dir).glob("*.json"):
+                try:
+                    session_file.unlink(missing_ok=True)
+                except Exception as e:
+                    print(f"Error deleting agent session {session_file}: {e}")
+
+    def pin(self, agent_name: str, project: Optional[Project] = None) -> None:
+        """Prevent an agent from being evicted while it is in use."""
+        self._pinned.add(agent_key(agent_name, project))
+
+    def unpin(self, agent_name: str, project: Optional[Project] = None) -> None:
+        """Allow an agent to be evicted again."""
+        self._pinned.discard(agent_key(agent_name, project))
+
+    def loaded_agents(self) -> Dict[AgentKey, IAgent]:
+        """Return the agents currently held in memory by key (does not touch LRU order)."""
+        return dict(self._loaded)
+
+    def list_persisted(self, project: Project) -> Dict[str, str]:
+        """Return the name and agent type of every agent session stored for a project."""
+        session_dir = self.session_dir(project)
+        if not session_dir.is_dir():
+            return {}
+        sessions = {}
+        for session_file in session_dir.glob("*.json"):
+            try:
+                with open(session_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                sessions[state.get("name", session_file.stem)] = state.get("agent_type", "")
+            except Exception as e:
+                print(f"Error reading agent session {session_file}: {e}")
+        return sessions
+
+    # --- Internal Helpers ---
+
+    def _save(self, key: AgentKey) -> bool:
+        agent = self._loaded.get(key)
+        session_dir = self._session_dirs.get(key)
+        if agent is None or session_dir is None:
+            return False
+        agent_name = key[1]
+        try:
+            session_dir.mkdir(parents=True, exist_ok=True)
+            session_file = self._session_file(session_dir, agent_name)
+            tmp_file = session_file.with_suffix(".json.tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(agent.get_state(), f)
+            os.replace(tmp_file, session_file) # Atomic, so a crash never leaves a half-written session
+            return True
+        except Exception as e:
+            print(f"Error saving agent session '{agent_name}': {e}")
+            return False
+
+    def _remove(self, key: AgentKey, session_dir: Optional[Path] = None) -> None:
+        self._loaded.pop(key, None)
+        self._pinned.discard(key)
+        session_dir = self._session_dirs.pop(key, None) or session_dir
+        if session_dir is not None:
+            session_file = self._session_file(session_dir, key[1])
+            try:
+                session_file.unlink(missing_ok=True)
+            except Exception as e:
+                print(f"Error deleting agent session '{key[1]}': {e}")
+
+    def _load_from_disk(self, session_dir: Path, agent_name: str) -> Optional[IAgent]:
+        session_file = self._session_file(session_dir, agent_name)
+        if not session_file.exists():
+            return None
+        try:
+            with open(session_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            print(f"Error loading agent session '{agent_name}': {e}")
+            return None
+
+        agent_class = self.agent_types.get(state.get("agent_type"))
+        if agent_class is None:
+            print(f"Unknown agent type '{state.get('agent_type')}' for session '{agent_name}'.")
+            return None
+        agent = agent_class(state.get("name", agent_name), state.get("model", ""))
+        agent.load_state(state)
+        print(f"Agent '{agent_name}' rehydrated from {session_file}")
+        return agent
+
+    def _enforce_budget(self) -> None:
+        """Evict least recently used agents until the count and size budgets are met."""
+        sizes = {key: agent.message.estimate_size() for key, agent in self._loaded.items()}
+        total_size = sum(sizes.values())
+        # The most recently used agent is never evicted
+        for key in list(self._loaded.keys())[:-1]:
+            if len(self._loaded) <= self.max_loaded and total_size <= self.memory_budget_bytes:
+                break
+            if key not in self._session_dirs or key in self._pinned:
+                continue # Cannot be persisted or is in use, keep it in memory
+            if self._save(key):
+                del self._loaded[key]
+                total_size -= sizes[key]
+                print(f"Agent '{key[1]}' evicted from memory")
@@ -0,0 +1,77 @@
+# utils/Compaction.py
+from typing import Any, Dict, List
+
+
+class CompactionPolicy:
+    """
+    Settings controlling how an agent's conversation history is compacted.
+
+    Once the conversation exceeds `max_tokens`, images are stripped from old
+    turns, and if that is not enough the old turns are replaced by a single
+    summary message. The init message, the latest assistant artifact and the
+    most recent `keep_recent_messages` messages are always kept.
+    """
+
+    SUMMARY_MODES = ("extractive", "llm", "drop")
+
+    def __init__(self, enabled: bool = True, max_tokens: int = 60000, keep_recent_messages: int = 4,
+                 strip_old_images: bool = True, summary_mode: str = "extractive",
+                 summary_max_chars: int = 4000):
+        """
+        Args:
+            enabled: Whether compaction runs at all
+            max_tokens: Conversation size in tokens above which compaction starts
+            keep_recent_messages: Number of trailing messages that are never compacted
+            strip_old_images: Remove images from old turns before dropping them
+            summary_mode: "extractive" keeps the user's earlier instructions, "llm" asks the
+                model for a summary, "drop" removes old turns without a summary
+            summary_max_chars: Maximum length of the summary message
+        """
+        if summary_mode not in self.SUMMARY_MODES:
+            raise ValueError(f"Unknown summary mode '{summary_mode}', expected one of {self.SUMMARY_MODES}")
+        self.enabled = enabled
+        self.max_tokens = max_tokens
+        self.keep_recent_messages = keep_recent_messages
+        self.strip_old_images = strip_old_images
+        self.summary_mode = summary_mode
+        self.summary_max_chars = summary_max_chars
+
+    def with_overrides(self, overrides: Dict[str, Any]) -> "CompactionPolicy":
+        """Return a copy of the policy with some settings replaced."""
+        values = dict(self.__dict__)
+        values.update(overrides or {})
+        return CompactionPolicy(**values)
+
+
+def message_text(message: Any) -> str:
+    """Return the text parts of a message joined together."""
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(entry.get("text", "") for entry in content if entry.get("type") == "text")
+    return ""
+
+
+def extractive_summary(messages: List[Dict[str, Any]], max_chars: int) -> str:
+    """
+    Summarize compacted turns without an LLM call by keeping the user's
+    instructions (which carry the intent) and dropping the bulky responses.
+    """
+    lines = []
+    for message in messages:
+        if message.get("role") != "user":
+            continue
+        text = " ".join(message_text(message).split())
+        if text:
+            lines.append(f"- {text[:500]}")
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        summary = "...\n" + summary[-max_chars:] # Keep the most recent instructions
+    return summary
+
+
+def transcript(messages: List[Dict[str, Any]], max_chars: int) -> str:
+    """Render turns as plain text for an LLM summarization prompt."""
+    text = "\n\n".join(f"{message.get('role', 'user')}: {message_text(message)}" for message in messages)
+    return text[-max_chars:]
@@ -1,5 +1,8 @@
 from utils.Project import Project
-from typing import Dict, List, Any
+from utils.RetrievalIndex import RetrievalIndex
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional, Tuple
+import copy
+import os
 import csv
 
 class Requirements:
@@ -10,6 +13,13 @@ class Requirements:
         self.features: Dict[str, str] = {}
         self.further_requirements: str = ""
 
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the requirement keys, so agents can check that none is empty."""
+        return iter(["input_description", "output_description", "features", "further_requirements"])
+
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self, key)
+
 class Context:
     def __init__(self):
         # raw data from the excel file
@@ -26,18 +36,109 @@ class Context:
         self.generated_text_doc: Dict[str, str] = {}  # name and the text of the doc
         self.generated_diagram: Dict[Any] = {}
         self.prototype_code: str = ""
-        
+
+        # BM25 index over the artifacts above, kept in the project directory
+        self.retrieval_index: Optional[RetrievalIndex] = None
+
+        # Incremented whenever the context changes, so agents can skip rebuilding their prompts.
+        # Fields edited in place (e.g. requirements) must be followed by touch().
+        self.version: int = 0
+        self._csv_files: Dict[str, Tuple[int, int, str]] = {} # path -> (mtime_ns, size, content)
+        self._fragments: Dict[str, Tuple[int, Any]] = {} # key -> (version, derived value)
+
+    def touch(self) -> None:
+        """Mark the context as changed."""
+        self.version += 1
+
+    def set_generated_text_doc(self, name: str, text: str) -> None:
+        """Store a generated document, bumping the version only if it changed."""
+        if self.generated_text_doc.get(name) != text:
+            self.generated_text_doc[name] = text
+            self.touch()
+
+    def set_generated_diagram(self, name: str, diagram: Any) -> None:
+        """Store a generated diagram, bumping the version only if it changed."""
+        if self.generated_diagram.get(name) != diagram:
+            self.generated_diagram[name] = diagram
+            self.touch()
+
+    def set_prototype_code(self, code: str) -> None:
+        """Store the generated prototype, bumping the version only if it changed."""
+        if self.prototype_code != code:
+            self.prototype_code = code
+            self.touch()
+
+    def cached_fragment(self, key: str, build: Callable[[], Any]) -> Any:
+        """
+        Return a value derived from the context (e.g. a prompt fragment), building
+        it only if the context changed since it was last built.
+
+        Args:
+            key (str): Identifies the fragment, including any parameter it depends on
+            build (Callable[[], Any]): Builds the fragment from the current context
+        """
+        cached = self._fragments.get(key)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        value = build()
+        self._fragments[key] = (self.version, value)
+        return value
+
+    def scoped(self, text_docs: Iterable[str] = (), diagrams: Iterable[str] = (), prototype: bool = False) -> "Context":
+        """
+        Return a view of the context holding only the given generated artifacts,
+        for an agent that must see its declared dependencies and nothing else.
+        The view shares the requirements and spreadsheet data with this context.
+        It only holds a few artifacts, so it is fitted to the budget without retrieval.
+
+        Args:
+            text_docs (Iterable[str]): Names of the generated documents to keep
+            diagrams (Iterable[str]): Names of the generated diagrams to keep
+            prototype (bool): Whether to keep the generated prototype
+        """
+        view = copy.copy(self)
+        view.generated_text_doc = {name: self.generated_text_doc[name] for name in text_docs if name in self.generated_text_doc}
+        view.generated_diagram = {name: self.generated_diagram[name] for name in diagrams if name in self.generated_diagram}
+        view.prototype_code = self.prototype_code if prototype else ""
+        view.retrieval_index = None
+        view._fragments = {}
+        return view
+
     def update_context(self, project: Project)->None:
         """
-        Update the context with project information.
-        
+        Update the context with project information. Only CSV files whose
+        modification time or size changed are read again, and the version is
+        bumped only if some content actually changed.
+
         Args:
             project (Project): The project to update the context with.
         """
-        self.csv_description = []
+        changed = False
+        csv_files: Dict[str, Tuple[int, int, str]] = {}
         for csv_file in project.get_csv_dirs():
-            with open(csv_file, 'r') as file:
+            try:
+                stat = os.stat(csv_file)
+            except OSError as e:
+                print(f"Error reading CSV file {csv_file}: {e}")
+                continue
+            cached = self._csv_files.get(csv_file)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                csv_files[csv_file] = cached
+                continue
+            with open(csv_file, 'r', encoding='utf-8', errors='replace') as file:
                 csv_content = file.read()
-                self.csv_description.append(csv_content)
-        
-        self.ui_image = project.get_image_dirs()
\ No newline at end of file
+            changed = changed or cached is None or cached[2] != csv_content
+            csv_files[csv_file] = (stat.st_mtime_ns, stat.st_size, csv_content)
+        # Files removed or reordered also change the context
+        changed = changed or list(csv_files) != list(self._csv_files)
+        self._csv_files = csv_files
+        self.csv_description = [content for _, _, content in csv_files.values()]
+
+        ui_image = project.get_image_dirs()
+        if ui_image != self.ui_image:
+            self.ui_image = ui_image
+            changed = True
+        if self.retrieval_index is None:
+            self.retrieval_index = RetrievalIndex.for_project(project)
+        if changed:
+            self.touch()
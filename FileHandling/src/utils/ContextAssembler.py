@@ -0,0 +1,196 @@
+# utils/ContextAssembler.py
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+from utils.RetrievalIndex import project_sources
+from utils.TokenCounter import count_text_tokens
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]{3,}")
+_KIND_PRIORITIES = {"doc": 0.9, "diagram": 0.7, "csv": 0.4}
+_TRUNCATION_MARKER = "\n[... truncated to fit the context budget ...]\n"
+
+
+def context_budget_for(model: Optional[str]) -> int:
+    """Return the context token budget for a model (longest matching prefix wins)."""
+    if model:
+        model_name = model.lower()
+        matches = [prefix for prefix in settings.MODEL_CONTEXT_BUDGETS if model_name.startswith(prefix) or f"/{prefix}" in model_name]
+        if matches:
+            return settings.MODEL_CONTEXT_BUDGETS[max(matches, key=len)]
+    return settings.CONTEXT_TOKEN_BUDGET
+
+
+def _terms(text: str) -> set:
+    return set(_WORD_PATTERN.findall(text.lower()))
+
+
+def outline(text: str, max_line_chars: int = 200) -> str:
+    """Summarize a markdown document by its headings and the first line under each."""
+    lines = []
+    take_next = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            lines.append(stripped)
+            take_next = True
+        elif take_next and stripped:
+            lines.append(stripped[:max_line_chars])
+            take_next = False
+    return "\n".join(lines)
+
+
+class ContextSection:
+    """A named piece of prompt context with a base priority."""
+
+    def __init__(self, name: str, text: str, priority: float = 0.5, required: bool = False):
+        """
+        Args:
+            name: Identifier used in the report
+            text: The section content
+            priority: Base value of the section between 0 and 1
+            required: Required sections are always kept in full
+        """
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.required = required
+        self.tokens = count_text_tokens(self.text)
+
+
+class ContextAssembler:
+    """
+    Fits prompt context sections into a token budget.
+
+    Required sections are always kept. Optional sections are ranked by their
+    priority weighted by term overlap with the query (what is being written),
+    then kept in full while they fit. The lowest-value sections that do not
+    fit are summarized to a markdown outline, truncated, or dropped, and every
+    decision is recorded in the report.
+    """
+
+    def __init__(self, budget_tokens: int, min_section_tokens: int = 200):
+        self.budget_tokens = budget_tokens
+        self.min_section_tokens = min_section_tokens
+        self.sections: List[ContextSection] = []
+
+    def add(self, name: str, text: str, priority: float = 0.5, required: bool = False) -> None:
+        """Add a section to assemble."""
+        self.sections.append(ContextSection(name, text, priority, required))
+
+    def _relevance(self, section: ContextSection, query_terms: set) -> float:
+        if not query_terms:
+            return section.priority
+        overlap = len(_terms(section.text) & query_terms) / len(query_terms)
+        return section.priority * (0.5 + 0.5 * overlap)
+
+    def assemble(self, query: str = "") -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+        """
+        Select the content of every section within the budget.
+
+        Args:
+            query (str): Text describing what the prompt is for, used to rank sections
+
+        Returns:
+            Tuple[Dict[str, str], List[Dict[str, Any]]]: The kept text per section name
+            (omitted if dropped) and a report entry per section
+        """
+        kept: Dict[str, str] = {}
+        report: List[Dict[str, Any]] = []
+        remaining = self.budget_tokens
+
+        for section in self.sections:
+            if section.required:
+                kept[section.name] = section.text
+                remaining -= section.tokens
+                report.append({"section": section.name, "action": "kept", "tokens": section.tokens, "original_tokens": section.tokens})
+
+        query_terms = _terms(query)
+        optional = sorted((s for s in self.sections if not s.required), key=lambda s: self._relevance(s, query_terms), reverse=True)
+        for section in optional:
+            action, text = self._fit(section, remaining)
+            tokens = count_text_tokens(text) if text else 0
+            if text:
+                kept[section.name] = text
+                remaining -= tokens
+            report.append({"section": section.name, "action": action, "tokens": tokens, "original_tokens": section.tokens})
+        return kept, report
+
+    def _fit(self, section: ContextSection, remaining: int) -> Tuple[str, Optional[str]]:
+        """Return how a section fits the remaining budget and the text to keep."""
+        if section.tokens <= remaining:
+            return "kept", section.text
+        if remaining < self.min_section_tokens:
+            return "dropped", None
+        summary = outline(section.text)
+        if summary and count_text_tokens(summary) <= remaining:
+            return "summarized", summary
+        # Cut by characters in proportion to the remaining budget, keeping the start
+        keep_chars = int(len(section.text) * remaining / max(section.tokens, 1)) - len(_TRUNCATION_MARKER)
+        if keep_chars <= 0:
+            return "dropped", None
+        return "truncated", section.text[:keep_chars] + _TRUNCATION_MARKER
+
+    @staticmethod
+    def summarize_report(report: List[Dict[str, Any]]) -> str:
+        """Return a one-line description of what was cut, or an empty string if nothing was."""
+        cuts = [f"{entry['section']} {entry['action']} ({entry['original_tokens']} -> {entry['tokens']} tokens)"
+                for entry in report if entry["action"] != "kept"]
+        return "; ".join(cuts)
+
+
+def assemble_project_context(context: Any, model: Optional[str], reserved_tokens: int,
+                             include_diagrams: bool = False, target: str = "") -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+    """
+    Fit the generated documents, diagrams and CSV data of a project into the
+    model's context budget. When the context has a retrieval index and is
+    larger than RETRIEVAL_BUDGET_FRACTION of the budget, only the top-k
+    retrieved chunks of each artifact are considered; the artifacts without a
+    retrieved chunk are reported as dropped.
+
+    Args:
+        context (Context): The project context
+        model (str): The agent's model, used to pick the budget
+        reserved_tokens (int): Tokens already used by the fixed part of the prompt
+        include_diagrams (bool): Whether previously generated diagrams are part of the context
+        target (str): Name or purpose of the document being written, used to rank and retrieve
+            the context; the project requirements are used if empty
+
+    Returns:
+        Tuple[Dict[str, str], List[Dict[str, Any]]]: Kept text keyed by "doc:", "diagram:" or
+        "csv:" section names, and the assembler report
+    """
+    query = target.strip()
+    if not query:
+        requirements = context.requirements
+        query = " ".join([
+            context.project_name,
+            requirements.input_description,
+            requirements.output_description,
+            " ".join(f"{name} {desc}" for name, desc in requirements.features.items()),
+            requirements.further_requirements,
+        ])
+    budget = max(context_budget_for(model) - reserved_tokens, 0)
+    sources = project_sources(context, include_diagrams)
+    not_retrieved: List[Dict[str, Any]] = []
+    index = getattr(context, "retrieval_index", None)
+    if index is not None:
+        # Keeps the index current as artifacts are produced; unchanged artifacts cost one hash each
+        index.sync_context(context)
+        source_tokens = {source: count_text_tokens(text) for source, (_, text) in sources.items()}
+        if sum(source_tokens.values()) > budget * settings.RETRIEVAL_BUDGET_FRACTION:
+            # Large projects: only the chunks most relevant to the document being written go into the prompt
+            kinds = ["doc", "diagram", "csv"] if include_diagrams else ["doc", "csv"]
+            retrieved = index.retrieve(query, settings.RETRIEVAL_TOP_K, kinds)
+            if retrieved:
+                print(f"Retrieved chunks from {len(retrieved)} of {len(sources)} source(s) for the prompt")
+                not_retrieved = [{"section": source, "action": "dropped", "tokens": 0, "original_tokens": source_tokens[source]}
+                                 for source in sources if source not in retrieved]
+                sources = {source: (sources[source][0], text) for source, text in retrieved.items() if source in sources}
+
+    assembler = ContextAssembler(budget)
+    # Earlier documents define the project, so they outrank diagrams and raw data
+    for source, (kind, text) in sources.items():
+        assembler.add(source, text, priority=_KIND_PRIORITIES[kind])
+    kept, report = assembler.assemble(query)
+    return kept, report + not_retrieved
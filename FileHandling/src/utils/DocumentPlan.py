@@ -0,0 +1,115 @@
+# utils/DocumentPlan.py
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Protocol
+
+
+class PlanNode(Protocol):
+    """A node of a document plan: one document generated by one agent."""
+    id: str
+    depends_on: List[str]
+
+
+class DocumentPlanError(ValueError):
+    """Raised when a document plan is not a valid DAG."""
+
+
+class NodeOutcome:
+    """Result of one node of a plan run."""
+
+    def __init__(self, status: str, result: Any = None, error: Optional[str] = None,
+                 started: Optional[float] = None, finished: Optional[float] = None):
+        self.status = status # "success", "error" or "skipped"
+        self.result = result
+        self.error = error
+        self.started = started # Seconds since the start of the run
+        self.finished = finished
+
+    @property
+    def seconds(self) -> Optional[float]:
+        return None if self.started is None or self.finished is None else self.finished - self.started
+
+
+def topological_order(nodes: List[PlanNode]) -> List[str]:
+    """
+    Return the node ids in an order where every node comes after its
+    dependencies, keeping the given order where the plan allows.
+
+    Raises:
+        DocumentPlanError: If ids are duplicated, a dependency is unknown or the plan has a cycle
+    """
+    ids = [node.id for node in nodes]
+    if len(set(ids)) != len(ids):
+        duplicates = sorted({node_id for node_id in ids if ids.count(node_id) > 1})
+        raise DocumentPlanError(f"Duplicate node id(s): {', '.join(duplicates)}")
+    remaining: Dict[str, set] = {}
+    for node in nodes:
+        unknown = [dependency for dependency in node.depends_on if dependency not in ids]
+        if unknown:
+            raise DocumentPlanError(f"Node '{node.id}' depends on unknown node(s): {', '.join(unknown)}")
+        remaining[node.id] = set(node.depends_on)
+    order: List[str] = []
+    while remaining:
+        ready = [node_id for node_id in ids if node_id in remaining and not remaining[node_id]]
+        if not ready:
+            raise DocumentPlanError(f"The plan has a dependency cycle between: {', '.join(sorted(remaining))}")
+        for node_id in ready:
+            order.append(node_id)
+            del remaining[node_id]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+    return order
+
+
+async def run_plan(nodes: List[PlanNode], run_node: Callable[[PlanNode], Awaitable[Any]]) -> Dict[str, NodeOutcome]:
+    """
+    Run a document plan. Every node starts as soon as all its dependencies
+    succeeded, so independent nodes run concurrently and the plan takes about
+    as long as its critical path. Nodes depending on a failed node are skipped.
+
+    Args:
+        nodes (List[PlanNode]): The plan, see `topological_order`
+        run_node (Callable[[PlanNode], Awaitable[Any]]): Generates the document of a node;
+            an exception marks the node as failed
+
+    Returns:
+        Dict[str, NodeOutcome]: The outcome of every node, by node id
+    """
+    order = topological_order(nodes)
+    by_id = {node.id: node for node in nodes}
+    outcomes: Dict[str, NodeOutcome] = {}
+    running: Dict[asyncio.Task, str] = {}
+    run_started = time.perf_counter()
+    elapsed = lambda: time.perf_counter() - run_started
+    started: Dict[str, float] = {}
+
+    try:
+        while True:
+            for node_id in order:
+                if node_id in outcomes or node_id in running.values():
+                    continue
+                dependencies = [outcomes.get(dependency) for dependency in by_id[node_id].depends_on]
+                if any(outcome is not None and outcome.status != "success" for outcome in dependencies):
+                    failed = [dependency for dependency, outcome in zip(by_id[node_id].depends_on, dependencies)
+                              if outcome is not None and outcome.status != "success"]
+                    outcomes[node_id] = NodeOutcome("skipped", error=f"Dependency failed: {', '.join(failed)}")
+                elif all(outcome is not None for outcome in dependencies):
+                    started[node_id] = elapsed()
+                    running[asyncio.ensure_future(run_node(by_id[node_id]))] = node_id
+            if not running:
+                return outcomes
+            done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                node_id = running.pop(task)
+                if task.cancelled():
+                    outcomes[node_id] = NodeOutcome("error", error="Cancelled", started=started[node_id], finished=elapsed())
+                elif task.exception() is not None:
+                    error = task.exception()
+                    outcomes[node_id] = NodeOutcome("error", error=getattr(error, "detail", None) or str(error),
+                                                    started=started[node_id], finished=elapsed())
+                else:
+                    outcomes[node_id] = NodeOutcome("success", result=task.result(),
+                                                    started=started[node_id], finished=elapsed())
+    finally:
+        for task in running:
+            task.cancel() # The run itself was cancelled
@@ -0,0 +1,122 @@
+# utils/HtmlPatch.py
+import re
+from html.parser import HTMLParser
+from typing import List, Tuple
+
+_BLOCK = re.compile(r"^<{5,9} SEARCH\s*\n(.*?)^={5,9}\s*\n(.*?)^>{5,9} REPLACE\s*$", re.MULTILINE | re.DOTALL)
+# Elements that never have a closing tag
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+
+class HtmlPatchError(ValueError):
+    """Raised when search/replace blocks cannot be parsed or do not apply to the document."""
+
+
+def parse_blocks(response_content: str) -> List[Tuple[str, str]]:
+    """
+    Parse the search/replace blocks of a response:
+
+        <<<<<<< SEARCH
+        exact lines of the current HTML
+        =======
+        the lines replacing them
+        >>>>>>> REPLACE
+
+    Returns:
+        List[Tuple[str, str]]: (search, replace) pairs in order
+
+    Raises:
+        HtmlPatchError: If the response holds no block
+    """
+    blocks = [(search.rstrip("\n"), replace.rstrip("\n")) for search, replace in _BLOCK.findall(response_content)]
+    if not blocks:
+        raise HtmlPatchError("The response holds no search/replace block")
+    return blocks
+
+
+def _find_lines(html: str, search: str) -> Tuple[int, int] | None:
+    """Locate `search` line by line ignoring indentation. Returns the character span of the unique match."""
+    lines = html.split("\n")
+    wanted = [line.strip() for line in search.split("\n")]
+    stripped = [line.strip() for line in lines]
+    matches = [start for start in range(len(lines) - len(wanted) + 1) if stripped[start:start + len(wanted)] == wanted]
+    if len(matches) != 1:
+        return None
+    start = sum(len(line) + 1 for line in lines[:matches[0]])
+    end = start + sum(len(line) + 1 for line in lines[matches[0]:matches[0] + len(wanted)]) - 1
+    return start, end
+
+
+def apply_blocks(html: str, blocks: List[Tuple[str, str]]) -> str:
+    """
+    Apply search/replace blocks one after the other. Each search text must
+    occur exactly once; when it does not occur verbatim, a match that only
+    differs in indentation is accepted.
+
+    Raises:
+        HtmlPatchError: If a block does not apply or the result is not well-formed
+    """
+    for search, replace in blocks:
+        if not search.strip():
+            raise HtmlPatchError("A search/replace block has an empty search text")
+        count = html.count(search)
+        if count == 1:
+            html = html.replace(search, replace, 1)
+            continue
+        if count > 1:
+            raise HtmlPatchError(f"The search text occurs {count} times: {search[:80]!r}")
+        span = _find_lines(html, search)
+        if span is None:
+            raise HtmlPatchError(f"The search text was not found: {search[:80]!r}")
+        html = html[:span[0]] + replace + html[span[1]:]
+    return html
+
+
+class _TagBalance(HTMLParser):
+    """Counts tags that are closed without being open or left open."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[str] = []
+        self.unmatched = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        if tag not in self.stack:
+            self.unmatched += 1
+            return
+        # Elements left open inside the closed one (e.g. an unclosed <li>) count once each
+        while self.stack:
+            open_tag = self.stack.pop()
+            if open_tag == tag:
+                break
+            self.unmatched += 1
+
+
+def structure_errors(html: str) -> int:
+    """Number of unbalanced tags in an HTML document."""
+    parser = _TagBalance()
+    parser.feed(html)
+    parser.close()
+    return parser.unmatched + len(parser.stack)
+
+
+def validate(original: str, patched: str) -> None:
+    """
+    Check that a patched document is still a complete HTML document and is not
+    less well-formed than the original, which may already have unclosed tags.
+
+    Raises:
+        HtmlPatchError: If the patched document is broken
+    """
+    lowered = patched.lower()
+    if "<html" not in lowered or "</html>" not in lowered:
+        raise HtmlPatchError("The patch removed the <html> element")
+    before, after = structure_errors(original), structure_errors(patched)
+    if after > before:
+        raise HtmlPatchError(f"The patch unbalances the document ({after} unmatched tags, {before} before)")
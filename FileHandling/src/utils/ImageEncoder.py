@@ -0,0 +1,153 @@
+# utils/ImageEncoder.py
+import base64
+import io
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+
+_MIME_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+_MIN_QUALITY = 40
+_MIN_DIMENSION = 320
+
+
+class ImageEncoder:
+    """
+    Turns image files into data URIs for LLM requests.
+
+    Each image goes through a configurable pipeline (downscale to a maximum
+    dimension, optional palette quantization, WebP/JPEG/PNG re-encode) and is
+    shrunk further until it fits the size budget of the target model. Encoded
+    payloads are cached by path, modification time and pipeline settings, so
+    repeated generations never re-read or re-encode an unchanged image.
+    """
+
+    def __init__(self, enabled: bool, max_dimension: int, image_format: str, quality: int,
+                 quantize_colors: int, max_bytes: int, model_budgets: Dict[str, int],
+                 cache_bytes: int):
+        self.enabled = enabled
+        self.max_dimension = max_dimension
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.quantize_colors = quantize_colors
+        self.max_bytes = max_bytes
+        self.model_budgets = model_budgets
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._cache_size = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def budget_for(self, model: Optional[str]) -> int:
+        """Return the encoded size budget for a model (longest matching prefix wins)."""
+        if model:
+            model_name = model.lower()
+            matches = [prefix for prefix in self.model_budgets if model_name.startswith(prefix) or f"/{prefix}" in model_name]
+            if matches:
+                return self.model_budgets[max(matches, key=len)]
+        return self.max_bytes
+
+    def encode_file(self, image_path: str, model: Optional[str] = None, mime_type: str = "image/png") -> str:
+        """
+        Return the data URI of an image file, encoding it only if it is not cached.
+
+        Args:
+            image_path (str): Path to the image file
+            model (str, optional): Target model, used to pick the size budget
+            mime_type (str): MIME type of the raw file, used when the pipeline is disabled
+
+        Returns:
+            str: A base64 data URI
+        """
+        path = Path(image_path).resolve()
+        stat = path.stat()
+        budget = self.budget_for(model)
+        key = (str(path), stat.st_mtime_ns, stat.st_size, self.enabled, self.max_dimension,
+               self.image_format, self.quality, self.quantize_colors, budget)
+
+        with self._lock:
+            data_uri = self._cache.get(key)
+            if data_uri is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return data_uri
+
+        raw_bytes = path.read_bytes()
+        if self.enabled:
+            encoded_bytes, mime_type = self._run_pipeline(raw_bytes, budget)
+        else:
+            encoded_bytes = raw_bytes
+        data_uri = f"data:{mime_type};base64,{base64.b64encode(encoded_bytes).decode('utf-8')}"
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["bytes_in"] += len(raw_bytes)
+            self.stats["bytes_out"] += len(encoded_bytes)
+            if key not in self._cache:
+                self._cache[key] = data_uri
+                self._cache_size += len(data_uri)
+            while self._cache_size > self.cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_size -= len(evicted)
+        print(f"Encoded image {path.name}: {len(raw_bytes)} -> {len(encoded_bytes)} bytes")
+        return data_uri
+
+    def _run_pipeline(self, raw_bytes: bytes, budget: int) -> Tuple[bytes, str]:
+        """Downscale and re-encode an image until it fits the size budget."""
+        with Image.open(io.BytesIO(raw_bytes)) as source:
+            source_format = (source.format or "").upper()
+            image = source.copy()
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA") # Palette/CMYK images cannot be resampled directly
+        original_size = image.size
+        image.thumbnail((self.max_dimension, self.max_dimension), Image.Resampling.LANCZOS)
+        resized = image.size != original_size
+
+        quality = self.quality
+        while True:
+            encoded = self._encode(image, quality)
+            if len(encoded) <= budget:
+                break
+            if self.image_format != "PNG" and quality > _MIN_QUALITY:
+                quality = max(_MIN_QUALITY, quality - 15)
+            elif max(image.size) > _MIN_DIMENSION:
+                image = image.resize((max(1, int(image.width * 0.75)), max(1, int(image.height * 0.75))), Image.Resampling.LANCZOS)
+                resized = True
+            else:
+                break # Smallest we are willing to go
+
+        # Keep the original file if re-encoding did not help
+        if not resized and len(raw_bytes) <= min(len(encoded), budget) and source_format in _MIME_TYPES:
+            return raw_bytes, _MIME_TYPES[source_format]
+        return encoded, _MIME_TYPES.get(self.image_format, "image/png")
+
+    def _encode(self, image: Image.Image, quality: int) -> bytes:
+        output = io.BytesIO()
+        if self.image_format == "JPEG":
+            image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+        elif self.image_format == "WEBP":
+            converted = image if image.mode in ("RGB", "RGBA") else image.convert("RGBA")
+            converted.save(output, format="WEBP", quality=quality, method=4)
+        else:
+            converted = image
+            if self.quantize_colors:
+                converted = image.convert("RGBA").quantize(colors=self.quantize_colors, method=Image.Quantize.FASTOCTREE)
+            converted.save(output, format="PNG", optimize=True)
+        return output.getvalue()
+
+
+# Shared encoder so every agent reuses the same cache
+image_encoder = ImageEncoder(
+    enabled=settings.IMAGE_PIPELINE_ENABLED,
+    max_dimension=settings.IMAGE_MAX_DIMENSION,
+    image_format=settings.IMAGE_FORMAT,
+    quality=settings.IMAGE_QUALITY,
+    quantize_colors=settings.IMAGE_QUANTIZE_COLORS,
+    max_bytes=settings.IMAGE_MAX_BYTES,
+    model_budgets=settings.IMAGE_MODEL_BUDGETS,
+    cache_bytes=settings.IMAGE_CACHE_MB * 1024 * 1024,
+)
@@ -0,0 +1,247 @@
+# utils/LLMClient.py
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+import litellm
+
+from config import settings
+from utils import MockLLMProvider
+from utils.LLMScheduler import llm_scheduler
+from utils.ModelRouter import model_router
+from utils.ResponseCache import normalize_messages, response_cache
+from utils.Telemetry import telemetry
+from utils.TokenCounter import count_message_tokens
+
+_caching_support: Dict[str, bool] = {}
+_usage_lock = threading.Lock()
+_usage: Dict[str, Dict[str, int]] = {} # model -> token counters
+
+if settings.MOCK_LLM_ENABLED:
+    MockLLMProvider.register()
+
+
+def supports_prompt_caching(model: str) -> bool:
+    """Whether prompt prefixes sent to a model should be marked with `cache_control`."""
+    if not settings.PROMPT_CACHING_ENABLED:
+        return False
+    if model not in _caching_support:
+        try:
+            _caching_support[model] = bool(litellm.get_model_info(model).get("supports_prompt_caching"))
+        except Exception:
+            _caching_support[model] = False # Unknown to litellm, do not send provider specific fields
+    return _caching_support[model]
+
+
+def record_usage(model: str, usage: Any) -> None:
+    """Add the token usage of a response, including prompt cache hits and writes, to the per-model counters."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0
+    with _usage_lock:
+        counters = _usage.setdefault(model, {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "cached_tokens": 0, "cache_creation_tokens": 0,
+        })
+        counters["calls"] += 1
+        counters["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        counters["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        counters["cached_tokens"] += cached_tokens
+        counters["cache_creation_tokens"] += getattr(usage, "cache_creation_input_tokens", 0) or 0
+
+
+def usage_stats() -> Dict[str, Dict[str, float]]:
+    """Return the token counters per model with the share of prompt tokens served from the provider cache."""
+    with _usage_lock:
+        return {
+            model: {
+                **counters,
+                "cache_hit_ratio": counters["cached_tokens"] / counters["prompt_tokens"] if counters["prompt_tokens"] else 0.0,
+            }
+            for model, counters in _usage.items()
+        }
+
+
+def estimate_call_tokens(messages: List[Dict[str, Any]], params: Dict[str, Any]) -> int:
+    """Estimate the tokens a call uses (prompt plus expected output), for the scheduler's token budget."""
+    return count_message_tokens(messages) + (params.get("max_tokens") or settings.LLM_EXPECTED_OUTPUT_TOKENS)
+
+
+def response_text(response: Any) -> str:
+    """Return the text content of a litellm completion response."""
+    return response.choices[0].message.content or ""
+
+
+def _for_model(model: str, requested_model: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop prompt caching markers from a conversation routed to a model that does not support them."""
+    if model == requested_model or supports_prompt_caching(model):
+        return messages
+    return normalize_messages(messages)
+
+
+def _record_request(model: str, messages: List[Dict[str, Any]], usage: Any = None, cache_hit: bool = False) -> None:
+    """Add an LLM request to the telemetry of the agent call in progress."""
+    call_record = telemetry.current()
+    if call_record is not None:
+        call_record.add_request(model, messages, usage, cache_hit)
+
+
+def _timed_request(model: str, request: Callable[[], Any]) -> Any:
+    """Send a provider request and record its latency for routing; runs inside the scheduler slot."""
+    started = time.perf_counter()
+    response = request()
+    model_router.record_latency(model, time.perf_counter() - started)
+    return response
+
+
+async def _atimed_request(model: str, request: Callable[[], Awaitable[Any]]) -> Any:
+    """Async variant of `_timed_request`."""
+    started = time.perf_counter()
+    response = await request()
+    model_router.record_latency(model, time.perf_counter() - started)
+    return response
+
+
+def _complete_one(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    cached = response_cache.lookup(model, messages, params)
+    if cached is not None:
+        _record_request(model, messages, cache_hit=True)
+        return cached
+    response = llm_scheduler.run_sync(
+        model, lambda: _timed_request(model, lambda: litellm.completion(model=model, messages=messages, **params)),
+        estimate_call_tokens(messages, params))
+    record_usage(model, getattr(response, "usage", None))
+    _record_request(model, messages, getattr(response, "usage", None))
+    text = response_text(response)
+    response_cache.store(model, messages, params, text)
+    return text
+
+
+async def _acomplete_one(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    cached = response_cache.lookup(model, messages, params)
+    if cached is not None:
+        _record_request(model, messages, cache_hit=True)
+        return cached
+    response = await llm_scheduler.run(
+        model, lambda: _atimed_request(model, lambda: litellm.acompletion(model=model, messages=messages, **params)),
+        estimate_call_tokens(messages, params))
+    record_usage(model, getattr(response, "usage", None))
+    _record_request(model, messages, getattr(response, "usage", None))
+    text = response_text(response)
+    response_cache.store(model, messages, params, text)
+    return text
+
+
+def complete(model: str, messages: List[Dict[str, Any]], **params: Any) -> str:
+    """
+    Run a blocking completion and return the response text. Responses are
+    served from and recorded to the response cache depending on its mode;
+    provider calls go through the scheduler, which applies the model's rate
+    budgets and retries rate limits and transient errors. If the model has a
+    route, the call falls back along it when the model fails.
+
+    Args:
+        model (str): Any model string accepted by litellm
+        messages (List[Dict[str, Any]]): The conversation to send
+        **params: Extra parameters forwarded to litellm
+
+    Returns:
+        str: The assistant's response text
+    """
+    return model_router.run_sync(
+        model, lambda candidate: _complete_one(candidate, _for_model(candidate, model, messages), params))
+
+
+async def acomplete(model: str, messages: List[Dict[str, Any]], **params: Any) -> str:
+    """
+    Run a completion without blocking the event loop and return the response text.
+    Many calls can be in flight at once; they are only limited by the provider.
+    The model's route may hedge the call to a second model or fall back to one.
+
+    Args:
+        model (str): Any model string accepted by litellm
+        messages (List[Dict[str, Any]]): The conversation to send
+        **params: Extra parameters forwarded to litellm
+
+    Returns:
+        str: The assistant's response text
+    """
+    return await model_router.arun(
+        model, lambda candidate: _acomplete_one(candidate, _for_model(candidate, model, messages), params))
+
+
+async def _astream_one(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> AsyncIterator[str]:
+    cached = response_cache.lookup(model, messages, params)
+    if cached is not None:
+        _record_request(model, messages, cache_hit=True)
+        yield cached
+        return
+    tokens = []
+    stream_usage = None
+    estimated_tokens = estimate_call_tokens(messages, params)
+    attempt = 0
+    while True:
+        try:
+            # The slot is held until the stream ends, so streams count against the concurrency budget
+            async with llm_scheduler.slot(model, estimated_tokens):
+                started = time.perf_counter()
+                response = await litellm.acompletion(model=model, messages=messages, stream=True,
+                                                     stream_options={"include_usage": True}, **params) # The last chunk reports usage
+                async for chunk in response:
+                    usage = getattr(chunk, "usage", None)
+                    if usage is not None:
+                        record_usage(model, usage)
+                        stream_usage = usage
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        tokens.append(token)
+                        yield token
+                model_router.record_latency(model, time.perf_counter() - started)
+            break
+        except Exception as e:
+            # Once part of the answer was sent the stream cannot be restarted
+            delay = None if tokens else llm_scheduler.retry_delay(model, e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+    # Only complete responses are recorded, a cancelled stream never reaches this point
+    _record_request(model, messages, stream_usage)
+    response_cache.store(model, messages, params, "".join(tokens))
+
+
+async def astream(model: str, messages: List[Dict[str, Any]], **params: Any) -> AsyncIterator[str]:
+    """
+    Run a streaming completion and yield the response text as tokens arrive.
+    If the model has a route, the stream falls back along it when a model fails
+    before its first token. Streams are never hedged.
+
+    Args:
+        model (str): Any model string accepted by litellm
+        messages (List[Dict[str, Any]]): The conversation to send
+        **params: Extra parameters forwarded to litellm
+
+    Yields:
+        str: Chunks of the assistant's response text
+    """
+    candidates = model_router.candidates(model)
+    for index, candidate in enumerate(candidates):
+        streamed = False
+        try:
+            async for token in _astream_one(candidate, _for_model(candidate, model, messages), params):
+                if not streamed and telemetry.current() is not None:
+                    telemetry.current().mark_first_token()
+                streamed = True
+                yield token
+        except Exception as e:
+            model_router.record(candidate, failed=True)
+            if streamed or index == len(candidates) - 1:
+                raise
+            print(f"LLM stream from '{candidate}' failed: {e}, falling back to '{candidates[index + 1]}'")
+            continue
+        model_router.record(candidate)
+        return
@@ -0,0 +1,364 @@
+# utils/LLMScheduler.py
+import asyncio
+import contextvars
+import email.utils
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import litellm
+
+from config import settings
+from utils.Telemetry import telemetry
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0 # A user waiting on an edit
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2 # Background or bulk generation
+
+# Priority of the LLM calls made by the current request; set by the routers
+call_priority: contextvars.ContextVar[int] = contextvars.ContextVar("call_priority", default=PRIORITY_NORMAL)
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+_RETRYABLE_ERRORS = tuple(
+    error for error in (
+        getattr(litellm, name, None)
+        for name in ("RateLimitError", "Timeout", "APIConnectionError", "ServiceUnavailableError", "InternalServerError")
+    ) if isinstance(error, type)
+)
+_WINDOW_SECONDS = 60.0
+_IDLE_RECHECK_SECONDS = 1.0
+
+
+class _ModelState:
+    """Budgets, queue and counters of one model."""
+
+    def __init__(self, limits: Dict[str, int]):
+        self.rpm = limits.get("rpm", 0)
+        self.tpm = limits.get("tpm", 0)
+        self.concurrency = limits.get("concurrency", 0)
+        self.in_flight = 0
+        self.requests: deque = deque() # Start times within the last minute
+        self.tokens: deque = deque() # [start time, tokens] within the last minute
+        self.token_total = 0
+        self.cooldown_until = 0.0 # Set when the provider rate limits us
+        self.queue: List[Tuple[int, int]] = [] # Heap of (priority, sequence) tickets
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self.stats = {
+            "admitted": 0, "completed": 0, "failed": 0, "retries": 0, "rate_limited": 0,
+            "total_queue_wait_seconds": 0.0, "max_queue_wait_seconds": 0.0,
+        }
+
+
+class LLMScheduler:
+    """
+    Central admission control for LLM calls.
+
+    Every call waits in a per-model priority queue until it is at the head and
+    the model's request-per-minute, token-per-minute and concurrency budgets
+    allow it. Retryable failures (rate limits, timeouts, 5xx) are retried with
+    jittered exponential backoff; a Retry-After from the provider is honored
+    and pauses the whole model, not just the failing call. Both coroutines and
+    blocking callers are supported, and queue metrics are kept per model.
+    """
+
+    def __init__(self, model_limits: Dict[str, Dict[str, int]], default_limits: Dict[str, int],
+                 max_retries: int, backoff_base: float, backoff_max: float):
+        """
+        Args:
+            model_limits: Budgets per model prefix, e.g. {"gemini": {"rpm": 60, "tpm": 1000000, "concurrency": 8}}
+            default_limits: Budgets of models matching no prefix (0 disables a budget)
+            max_retries: Retries of a failed call before the error is raised
+            backoff_base: First backoff delay in seconds, doubled on every retry
+            backoff_max: Upper bound of a backoff delay in seconds
+        """
+        self.model_limits = model_limits
+        self.default_limits = default_limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock) # Wakes blocking waiters
+        self._states: Dict[str, _ModelState] = {}
+        self._sequence = itertools.count()
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._states.get(model)
+        if state is None:
+            model_name = model.lower()
+            matches = [prefix for prefix in self.model_limits if model_name.startswith(prefix) or f"/{prefix}" in model_name]
+            limits = self.model_limits[max(matches, key=len)] if matches else self.default_limits
+            state = self._states[model] = _ModelState(limits)
+        return state
+
+    # --- Admission ---
+
+    def _try_admit(self, state: _ModelState, ticket: Tuple[int, int], tokens: int) -> Tuple[bool, float]:
+        """Admit a ticket if it is next in line and the budgets allow. Returns (admitted, seconds to wait)."""
+        now = time.monotonic()
+        while state.requests and now - state.requests[0] >= _WINDOW_SECONDS:
+            state.requests.popleft()
+        while state.tokens and now - state.tokens[0][0] >= _WINDOW_SECONDS:
+            state.token_total -= state.tokens.popleft()[1]
+
+        if state.queue[0] != ticket:
+            return False, _IDLE_RECHECK_SECONDS # Woken up when the queue moves
+        if now < state.cooldown_until:
+            return False, state.cooldown_until - now
+        if state.concurrency and state.in_flight >= state.concurrency:
+            return False, _IDLE_RECHECK_SECONDS # Woken up when a call finishes
+        if state.rpm and len(state.requests) >= state.rpm:
+            return False, _WINDOW_SECONDS - (now - state.requests[0])
+        # A call larger than the whole token budget is admitted alone rather than never
+        if state.tpm and state.tokens and state.token_total + tokens > state.tpm:
+            return False, _WINDOW_SECONDS - (now - state.tokens[0][0])
+
+        heapq.heappop(state.queue)
+        state.in_flight += 1
+        state.requests.append(now)
+        state.tokens.append([now, tokens])
+        state.token_total += tokens
+        state.stats["admitted"] += 1
+        return True, 0.0
+
+    def _notify(self, state: _ModelState) -> None:
+        """Wake every waiter of a model so the next one in line can be admitted. Caller holds the lock."""
+        self._condition.notify_all()
+        for loop, event in state.async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _enqueue(self, state: _ModelState, priority: int) -> Tuple[int, int]:
+        ticket = (priority, next(self._sequence))
+        heapq.heappush(state.queue, ticket)
+        return ticket
+
+    def _dequeue(self, state: _ModelState, ticket: Tuple[int, int]) -> None:
+        """Remove a ticket that gave up waiting (e.g. the call was cancelled). Caller holds the lock."""
+        if ticket in state.queue:
+            state.queue.remove(ticket)
+            heapq.heapify(state.queue)
+            self._notify(state)
+
+    def _record_wait(self, state: _ModelState, waited: float) -> None:
+        call_record = telemetry.current()
+        if call_record is not None:
+            call_record.queue_wait += waited
+        state.stats["total_queue_wait_seconds"] += waited
+        state.stats["max_queue_wait_seconds"] = max(state.stats["max_queue_wait_seconds"], waited)
+
+    async def _acquire(self, model: str, tokens: int, priority: int) -> None:
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        started = time.monotonic()
+        with self._lock:
+            state = self._state(model)
+            ticket = self._enqueue(state, priority)
+            state.async_waiters.append((loop, event))
+        try:
+            while True:
+                with self._lock:
+                    event.clear()
+                    admitted, wait = self._try_admit(state, ticket, tokens)
+                    if admitted:
+                        self._record_wait(state, time.monotonic() - started)
+                        # The next ticket may be admissible too (e.g. free concurrency slots)
+                        self._notify(state)
+                        return
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._lock:
+                self._dequeue(state, ticket)
+            raise
+        finally:
+            with self._lock:
+                state.async_waiters.remove((loop, event))
+
+    def _acquire_sync(self, model: str, tokens: int, priority: int) -> None:
+        started = time.monotonic()
+        with self._lock:
+            state = self._state(model)
+            ticket = self._enqueue(state, priority)
+            try:
+                while True:
+                    admitted, wait = self._try_admit(state, ticket, tokens)
+                    if admitted:
+                        self._record_wait(state, time.monotonic() - started)
+                        self._notify(state)
+                        return
+                    self._condition.wait(timeout=wait)
+            except BaseException:
+                self._dequeue(state, ticket)
+                raise
+
+    def _release(self, model: str, succeeded: bool) -> None:
+        with self._lock:
+            state = self._state(model)
+            state.in_flight -= 1
+            state.stats["completed" if succeeded else "failed"] += 1
+            self._notify(state)
+
+    # --- Retries ---
+
+    @staticmethod
+    def _is_retryable(error: BaseException) -> bool:
+        if _RETRYABLE_ERRORS and isinstance(error, _RETRYABLE_ERRORS):
+            return True
+        return getattr(error, "status_code", None) in _RETRYABLE_STATUS
+
+    def _retry_after(self, error: BaseException) -> Optional[float]:
+        """
+        Return the delay requested by the provider's Retry-After header, if any,
+        capped at `backoff_max` so a quota reset hours away does not hold the call.
+        A malformed header is ignored, the provider's error is what gets reported.
+        """
+        headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "litellm_response_headers", None)
+        value = headers.get("retry-after") if headers else None
+        if value is None:
+            return None
+        try:
+            delay = float(value)
+        except (TypeError, ValueError):
+            try:
+                retry_at = email.utils.parsedate_to_datetime(value) # HTTP date form
+            except (TypeError, ValueError):
+                return None
+            if retry_at is None:
+                return None
+            delay = retry_at.timestamp() - time.time()
+        return min(max(0.0, delay), self.backoff_max)
+
+    def retry_delay(self, model: str, error: BaseException, attempt: int) -> Optional[float]:
+        """Return how long to wait before retrying a failed call, or None if it must not be retried."""
+        if attempt >= self.max_retries or not self._is_retryable(error):
+            return None
+        # Full jitter spreads the retries of a burst out instead of retrying in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = self._retry_after(error)
+        with self._lock:
+            state = self._state(model)
+            state.stats["retries"] += 1
+            if getattr(error, "status_code", None) == 429 or retry_after is not None:
+                state.stats["rate_limited"] += 1
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, self.backoff_base)
+                    # Every call to this model holds off, not only the one that was rejected
+                    state.cooldown_until = max(state.cooldown_until, time.monotonic() + delay)
+        print(f"LLM call to '{model}' failed ({type(error).__name__}), retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+        return delay
+
+    # --- Public API ---
+
+    async def run(self, model: str, call: Callable[[], Awaitable[Any]], tokens: int = 0,
+                  priority: Optional[int] = None) -> Any:
+        """
+        Run an LLM call once admitted, retrying retryable failures.
+
+        Args:
+            model (str): Model the call goes to
+            call (Callable[[], Awaitable[Any]]): Starts the call; invoked again on every retry
+            tokens (int): Estimated tokens of the call, counted against the token budget
+            priority (int, optional): Queue priority, defaults to the priority of the current request
+
+        Returns:
+            Any: The result of the call
+        """
+        priority = call_priority.get() if priority is None else priority
+        for attempt in itertools.count():
+            await self._acquire(model, tokens, priority)
+            try:
+                result = await call()
+            except Exception as e:
+                self._release(model, succeeded=False)
+                delay = self.retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._release(model, succeeded=False)
+                raise
+            self._release(model, succeeded=True)
+            return result
+
+    def run_sync(self, model: str, call: Callable[[], Any], tokens: int = 0, priority: Optional[int] = None) -> Any:
+        """Blocking version of `run` for synchronous callers."""
+        priority = call_priority.get() if priority is None else priority
+        for attempt in itertools.count():
+            self._acquire_sync(model, tokens, priority)
+            try:
+                result = call()
+            except Exception as e:
+                self._release(model, succeeded=False)
+                delay = self.retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self._release(model, succeeded=False)
+                raise
+            self._release(model, succeeded=True)
+            return result
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int = 0, priority: Optional[int] = None) -> AsyncIterator[None]:
+        """
+        Hold an admission slot for a call that cannot simply be retried as a
+        whole, such as a stream that has already yielded tokens.
+        """
+        priority = call_priority.get() if priority is None else priority
+        await self._acquire(model, tokens, priority)
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            self._release(model, succeeded)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return queue and budget metrics per model."""
+        with self._lock:
+            return {
+                model: {
+                    **state.stats,
+                    "queued": len(state.queue),
+                    "queued_by_priority": {
+                        str(priority): sum(1 for ticket in state.queue if ticket[0] == priority)
+                        for priority in sorted({ticket[0] for ticket in state.queue})
+                    },
+                    "in_flight": state.in_flight,
+                    "requests_last_minute": len(state.requests),
+                    "tokens_last_minute": state.token_total,
+                    "cooldown_seconds": max(0.0, state.cooldown_until - time.monotonic()),
+                    "avg_queue_wait_seconds": state.stats["total_queue_wait_seconds"] / state.stats["admitted"] if state.stats["admitted"] else 0.0,
+                }
+                for model, state in self._states.items()
+            }
+
+
+@contextmanager
+def priority_scope(priority: int) -> Iterator[None]:
+    """Run the LLM calls made inside the block at the given priority."""
+    token = call_priority.set(priority)
+    try:
+        yield
+    finally:
+        call_priority.reset(token)
+
+
+# Shared scheduler used by LLMClient
+llm_scheduler = LLMScheduler(
+    model_limits=settings.LLM_MODEL_LIMITS,
+    default_limits=settings.LLM_DEFAULT_LIMITS,
+    max_retries=settings.LLM_MAX_RETRIES,
+    backoff_base=settings.LLM_BACKOFF_BASE_SECONDS,
+    backoff_max=settings.LLM_BACKOFF_MAX_SECONDS,
+)
@@ -0,0 +1,146 @@
+# utils/MarkdownPatch.py
+import re
+from typing import List, Tuple
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_OPERATION = re.compile(r"^@@\s*(replace|insert_after|insert_before|delete)\s*:\s*(.+?)\s*$", re.IGNORECASE)
+PATH_SEPARATOR = " > "
+
+
+class PatchError(ValueError):
+    """Raised when a patch cannot be parsed or does not apply to the document."""
+
+
+class Section:
+    """A heading of a markdown document and the lines it spans, subsections included."""
+
+    def __init__(self, level: int, title: str, path: List[str], start: int, end: int):
+        self.level = level
+        self.title = title
+        self.path = path # Titles of the enclosing headings and this one
+        self.start = start # Line of the heading
+        self.end = end # Line after the last line of the section
+
+    @property
+    def path_str(self) -> str:
+        return PATH_SEPARATOR.join(self.path)
+
+
+def _normalize(title: str) -> str:
+    return " ".join(title.strip().strip("#").split()).lower()
+
+
+def heading_tree(lines: List[str]) -> List[Section]:
+    """Return the sections of a markdown document in order. Headings inside code fences are ignored."""
+    sections: List[Section] = []
+    stack: List[Section] = []
+    in_fence = False
+    for number, line in enumerate(lines):
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+            continue
+        match = None if in_fence else _HEADING.match(line)
+        if not match:
+            continue
+        level = len(match.group(1))
+        while stack and stack[-1].level >= level:
+            stack.pop().end = number
+        section = Section(level, match.group(2), [parent.title for parent in stack] + [match.group(2)], number, len(lines))
+        sections.append(section)
+        stack.append(section)
+    return sections
+
+
+def outline(markdown: str) -> List[str]:
+    """Return the section paths of a document, for the model to reference."""
+    return [section.path_str for section in heading_tree(markdown.split("\n"))]
+
+
+def find_section(sections: List[Section], reference: str) -> Section:
+    """
+    Resolve a section reference: a heading, optionally prefixed with parent
+    headings separated by " > ". The reference must match exactly one section.
+
+    Raises:
+        PatchError: If no section or several sections match
+    """
+    wanted = [_normalize(part) for part in reference.split(PATH_SEPARATOR.strip())]
+    matches = [section for section in sections
+               if [_normalize(title) for title in section.path[-len(wanted):]] == wanted]
+    if not matches:
+        raise PatchError(f"No section matches '{reference}'")
+    if len(matches) > 1:
+        raise PatchError(f"'{reference}' matches {len(matches)} sections: {', '.join(section.path_str for section in matches)}")
+    return matches[0]
+
+
+def parse_patch(response_content: str) -> List[Tuple[str, str, str]]:
+    """
+    Parse the operations of a patch, given either inside a ```patch``` block or
+    as bare "@@ operation: section" lines.
+
+    Returns:
+        List[Tuple[str, str, str]]: (operation, section reference, content) in order
+
+    Raises:
+        PatchError: If the response holds no operation
+    """
+    start = response_content.find("```patch")
+    if start != -1:
+        # Sections may contain code fences, so the block ends at the last fence
+        block = response_content[start:].split("\n", 1)
+        body = block[1] if len(block) > 1 else ""
+        end = body.rfind("```")
+        response_content = body if end == -1 else body[:end]
+    operations: List[Tuple[str, str, List[str]]] = []
+    for line in response_content.split("\n"):
+        match = _OPERATION.match(line.strip())
+        if match:
+            operations.append((match.group(1).lower(), match.group(2), []))
+        elif operations:
+            operations[-1][2].append(line)
+    if not operations:
+        raise PatchError("The response holds no patch operation")
+    return [(operation, reference, "\n".join(content).strip("\n")) for operation, reference, content in operations]
+
+
+def _block(lines: List[str]) -> List[str]:
+    """Lines of an inserted block, followed by a blank line."""
+    return lines + [""] if lines and lines[-1].strip() else lines
+
+
+def apply_patch(markdown: str, operations: List[Tuple[str, str, str]]) -> str:
+    """
+    Apply patch operations to a document, one after the other. Replacing or
+    deleting a section covers its subsections. A replacement that does not start
+    with a heading of the section's level keeps the heading of the section.
+
+    Raises:
+        PatchError: If an operation does not apply or the result is not a valid document
+    """
+    lines = markdown.split("\n")
+    title = lines[0]
+    for operation, reference, content in operations:
+        section = find_section(heading_tree(lines), reference)
+        content_lines = content.split("\n") if content.strip() else []
+        if operation != "delete" and not content_lines:
+            raise PatchError(f"'{operation}' of '{reference}' has no content")
+        if operation == "replace":
+            heading = _HEADING.match(content_lines[0])
+            if not heading or len(heading.group(1)) != section.level:
+                content_lines = [lines[section.start], ""] + content_lines
+            lines[section.start:section.end] = _block(content_lines)
+        elif operation == "delete":
+            lines[section.start:section.end] = []
+        elif operation == "insert_after":
+            lines[section.end:section.end] = _block(content_lines)
+            if section.end > 0 and lines[section.end - 1].strip():
+                lines.insert(section.end, "")
+        else: # insert_before
+            lines[section.start:section.start] = _block(content_lines)
+    patched = "\n".join(lines).strip()
+    if not patched or patched.split("\n")[0] != title:
+        raise PatchError("The patch removed the title of the document")
+    if sum(1 for line in patched.split("\n") if line.lstrip().startswith("```")) % 2:
+        raise PatchError("The patch leaves a code fence open")
+    return patched
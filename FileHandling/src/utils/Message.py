@@ -1,18 +1,35 @@
 import base64
+import hashlib
 import os
 from pathlib import Path
 import litellm
 import pprint
+from typing import Any, Dict, List
+from utils.ImageEncoder import image_encoder
+from utils.TokenCounter import count_message_tokens
 class Message:
     def __init__(self):
         # Maintain a list of messages (each message is a dict with "role" and "content")
         self.messages = []
+        # Image payloads stored once by content id; messages hold {"type": "image_ref"} entries
+        self.images: Dict[str, str] = {}
+        # Number of leading messages that stay identical between calls (instructions, context, images)
+        self.stable_prefix_length = 0
     def replace_init_message(self, new_init_message):
-        """Replace the initial message in the conversation."""
+        """Replace the initial message in the conversation, or add it if the conversation is empty."""
+        init_message = {"role": "user", "content": [{"type": "text", "text": new_init_message}]}
         if self.messages:
-            self.messages[0] = {"role": "user", "content": [{"type": "text", "text": new_init_message}]}
+            self.messages[0] = init_message
         else:
-            raise IndexError("No messages available to replace.")
+            self.messages.append(init_message)
+    def mark_stable_prefix(self):
+        """Mark every message added so far as the stable prompt prefix, reused across calls."""
+        self.stable_prefix_length = len(self.messages)
+
+    def add_system_text(self, text):
+        """Add a system message to the conversation."""
+        self.messages.append({"role": "system", "content": text})
+
     def add_user_text(self, text, cache_control=None):
         """Add a user text message to the conversation."""
         entry = {"type": "text", "text": text}
@@ -20,16 +37,27 @@ class Message:
             entry["cache_control"] = cache_control
         self.messages.append({"role": "user", "content": [entry]})
 
-    def add_user_image_from_file(self, image_path, mime_type="image/png"):
-        """Read an image file, encode it in base64, and add it as a user image message."""
-        image_bytes = Path(image_path).read_bytes()
-        encoded_data = base64.b64encode(image_bytes).decode("utf-8")
-        data_uri = f"data:{mime_type};base64,{encoded_data}"
+    def add_user_image_from_file(self, image_path, mime_type="image/png", model=None):
+        """
+        Add an image file as a user image message. The image is downscaled and
+        re-encoded to fit the size budget of `model`, and the encoded payload
+        is cached so unchanged files are not read or encoded again.
+        """
+        data_uri = image_encoder.encode_file(image_path, model=model, mime_type=mime_type)
         self.add_user_image(data_uri)
 
     def add_user_image(self, image_url):
-        """Add a user image message using a data URI or direct URL."""
-        entry = {"type": "image_url", "image_url": image_url}
+        """
+        Add a user image message using a data URI or direct URL.
+        Data URIs are stored once by content id, so adding the same image again
+        only appends a small reference instead of another copy of the payload.
+        """
+        if image_url.startswith("data:"):
+            image_id = hashlib.sha256(image_url.encode("utf-8")).hexdigest()[:16]
+            self.images.setdefault(image_id, image_url)
+            entry = {"type": "image_ref", "image_id": image_id}
+        else:
+            entry = {"type": "image_url", "image_url": image_url}
         self.messages.append({"role": "user", "content": [entry]})
 
     def append_to_last_message(self, entry):
@@ -55,8 +83,208 @@ class Message:
         except (KeyError, IndexError) as e:
             raise ValueError("LLM response format is not as expected.") from e
         
-    def get_conversation(self):
-        """Return the full conversation history as a list of message dictionaries."""
-        return self.messages
+    def append_assistant_text(self, text):
+        """Append the assistant's response text to the conversation."""
+        self.messages.append({"role": "assistant", "content": text})
+
+    def checkpoint(self) -> tuple:
+        """Return a marker of the current conversation state for `rollback`."""
+        return len(self.messages), (self.messages[0] if self.messages else None)
+
+    def rollback(self, checkpoint: tuple) -> None:
+        """
+        Restore the conversation to a state returned by `checkpoint`, dropping
+        every turn added since (e.g. the user turn of a cancelled call).
+        """
+        length, init_message = checkpoint
+        del self.messages[length:]
+        self.stable_prefix_length = min(self.stable_prefix_length, length)
+        if init_message is not None and self.messages:
+            self.messages[0] = init_message
+        self._prune_images()
+
+    def get_conversation(self, cache_prefix=False):
+        """
+        Return the conversation to send to the provider as a list of message dictionaries.
+        Image references are resolved to their payloads, and only the latest
+        reference to each image is kept so stale duplicates are never resent.
+
+        Args:
+            cache_prefix (bool): Mark the end of the stable prefix and the end of the
+                history before the latest turn with `cache_control`, so providers
+                that support prompt caching reuse them on the next call
+        """
+        last_reference = {}
+        for index, message in enumerate(self.messages):
+            for entry in self._content_entries(message):
+                if entry.get("type") == "image_ref":
+                    last_reference[entry["image_id"]] = index
+
+        conversation = []
+        sources = [] # Index in self.messages of each outgoing message
+        for index, message in enumerate(self.messages):
+            content = message.get("content") if isinstance(message, dict) else None
+            if not isinstance(content, list) or not any(entry.get("type") == "image_ref" for entry in content):
+                conversation.append(message)
+                sources.append(index)
+                continue
+            resolved = []
+            for entry in content:
+                if entry.get("type") != "image_ref":
+                    resolved.append(entry)
+                elif last_reference.get(entry["image_id"]) == index and entry["image_id"] in self.images:
+                    resolved.append({"type": "image_url", "image_url": self.images[entry["image_id"]]})
+            if resolved:
+                conversation.append({**message, "content": resolved})
+                sources.append(index)
+        if cache_prefix:
+            conversation = self._mark_cache_breakpoints(conversation, sources)
+        return conversation
+
+    def _mark_cache_breakpoints(self, conversation: List[Any], sources: List[int]) -> List[Any]:
+        """Return the conversation with `cache_control` on the last message of the stable prefix and of the history."""
+        breakpoints = {max(self.stable_prefix_length, 1) - 1, len(self.messages) - 2}
+        marked = set()
+        for boundary in breakpoints:
+            # The message itself may not be sent (e.g. a stale image), use the closest one before it
+            candidates = [position for position, index in enumerate(sources) if index <= boundary]
+            if candidates:
+                marked.add(candidates[-1])
+        conversation = list(conversation)
+        for position in marked:
+            conversation[position] = self._with_cache_control(self._to_plain_message(conversation[position]))
+        return conversation
+
+    @staticmethod
+    def _with_cache_control(message: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a copy of a message whose last content entry carries an ephemeral `cache_control`."""
+        content = message.get("content")
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        if not isinstance(content, list) or not content:
+            return message
+        content = list(content)
+        content[-1] = {**content[-1], "cache_control": {"type": "ephemeral"}}
+        return {**message, "content": content}
+
+    @staticmethod
+    def _content_entries(message: Any) -> List[Dict[str, Any]]:
+        content = message.get("content") if isinstance(message, dict) else None
+        return content if isinstance(content, list) else []
+
+    def _prune_images(self) -> None:
+        """Drop stored images that are no longer referenced by any message."""
+        referenced = {
+            entry["image_id"]
+            for message in self.messages
+            for entry in self._content_entries(message)
+            if entry.get("type") == "image_ref"
+        }
+        for image_id in list(self.images.keys()):
+            if image_id not in referenced:
+                del self.images[image_id]
+
+    def token_count(self) -> int:
+        """Return the approximate prompt tokens of the outgoing conversation."""
+        return count_message_tokens(self.get_conversation())
+
+    def compaction_candidates(self, keep_recent_messages: int) -> List[int]:
+        """
+        Return the indices of old turns that may be compacted. The init message,
+        the latest assistant response (the current artifact) and the trailing
+        `keep_recent_messages` messages are never candidates.
+        """
+        protected = {0}
+        for index in range(len(self.messages) - 1, -1, -1):
+            message = self.messages[index]
+            role = message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+            if role == "assistant":
+                protected.add(index)
+                break
+        recent_start = max(1, len(self.messages) - keep_recent_messages)
+        protected.update(range(recent_start, len(self.messages)))
+        return [index for index in range(1, len(self.messages)) if index not in protected]
+
+    def strip_images(self, indices: List[int]) -> None:
+        """Remove image entries from the given turns, dropping turns left empty."""
+        empty = []
+        for index in indices:
+            message = self.messages[index]
+            content = message.get("content") if isinstance(message, dict) else None
+            if not isinstance(content, list):
+                continue
+            kept = [entry for entry in content if entry.get("type") not in ("image_ref", "image_url")]
+            if kept:
+                message["content"] = kept
+            else:
+                empty.append(index)
+        for index in reversed(empty):
+            del self.messages[index]
+        if indices:
+            # The prefix changed, only what comes before the first edited turn is still cached
+            self.stable_prefix_length = min(self.stable_prefix_length, min(indices))
+        self._prune_images()
+
+    def replace_turns(self, indices: List[int], summary: str = None) -> None:
+        """
+        Remove the given turns. If a summary is provided, it is inserted as a
+        single user message where the first removed turn was.
+        """
+        if not indices:
+            return
+        for index in sorted(indices, reverse=True):
+            del self.messages[index]
+        self.stable_prefix_length = min(self.stable_prefix_length, min(indices))
+        if summary:
+            summary_message = {"role": "user", "content": [{"type": "text", "text": f"Summary of the earlier conversation:\n{summary}"}]}
+            self.messages.insert(min(indices), summary_message)
+        self._prune_images()
+
+    def estimate_size(self) -> int:
+        """
+        Return a rough estimate of the in-memory size of the conversation in bytes.
+        Only the string payloads are counted, which is where base64 images dominate.
+        """
+        total = 0
+        for message in self.messages:
+            content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+            if isinstance(content, str):
+                total += len(content)
+            elif isinstance(content, list):
+                for entry in content:
+                    for value in entry.values():
+                        if isinstance(value, str):
+                            total += len(value)
+                        elif isinstance(value, dict):
+                            total += sum(len(v) for v in value.values() if isinstance(v, str))
+        total += sum(len(image) for image in self.images.values())
+        return total
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return a JSON-serializable snapshot of the conversation."""
+        self._prune_images()
+        return {
+            "messages": [self._to_plain_message(message) for message in self.messages],
+            "images": self.images,
+            "stable_prefix_length": self.stable_prefix_length,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        """Rebuild a conversation from a snapshot produced by `to_dict`."""
+        message = cls()
+        message.messages = list(data.get("messages", []))
+        message.images = dict(data.get("images", {}))
+        message.stable_prefix_length = data.get("stable_prefix_length", 0)
+        return message
+
+    @staticmethod
+    def _to_plain_message(message: Any) -> Dict[str, Any]:
+        """Convert provider message objects (e.g. litellm's Message) into plain dicts."""
+        if isinstance(message, dict):
+            return message
+        if hasattr(message, "model_dump"):
+            return message.model_dump(exclude_none=True)
+        return {"role": getattr(message, "role", "assistant"), "content": getattr(message, "content", "")}
 
 
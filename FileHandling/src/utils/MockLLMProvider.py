@@ -0,0 +1,191 @@
+# utils/MockLLMProvider.py
+import asyncio
+import json
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+import httpx
+import litellm
+from litellm.llms.custom_llm import CustomLLM
+from litellm.types.utils import GenericStreamingChunk, ModelResponse, Usage
+from litellm.utils import custom_llm_setup
+
+from config import settings
+from utils.TokenCounter import count_message_tokens, count_text_tokens
+
+PROVIDER = "mock"
+_KINDS = ("markdown", "json", "html")
+_CHARS_PER_TOKEN = 4 # Used to size the canned responses
+_STREAM_CHUNK_CHARS = 64 # Characters per streamed chunk
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    """Return the text parts of a conversation, first message first."""
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(entry.get("text", "") for entry in content if entry.get("type") == "text")
+    return "\n".join(parts)
+
+
+def response_kind(model: str, messages: List[Dict[str, Any]]) -> str:
+    """
+    Pick the kind of canned response for a call. "mock/<kind>" forces a kind;
+    any other mock model infers it from the instructions the agents send.
+    """
+    kind = model.split("/", 1)[-1].lower()
+    if kind in _KINDS:
+        return kind
+    prompt = _prompt_text(messages)
+    if "```json" in prompt:
+        return "json" # DiagramAgent
+    if "```markdown" in prompt:
+        return "markdown" # TextDocumentAgent
+    if "html" in prompt.lower():
+        return "html" # PrototypeAgent
+    return "markdown"
+
+
+def canned_response(kind: str, output_tokens: int) -> str:
+    """Build a response of about `output_tokens` tokens that the agent of that kind can extract."""
+    repeats = max(1, output_tokens * _CHARS_PER_TOKEN // 400)
+    if kind == "json":
+        classes = [{
+            "name": f"Entity{i}",
+            "type": "class",
+            "attributes": [{"name": "id", "type": "int", "visibility": "- private"},
+                           {"name": "name", "type": "String", "visibility": "- private"}],
+            "methods": [{"name": "save", "parameters": [{"name": "force", "type": "boolean"}],
+                         "returnType": "void", "visibility": "+ public"}],
+        } for i in range(repeats)]
+        relationships = [{"type": "Association", "fromClass": f"Entity{i}", "toClass": f"Entity{i + 1}",
+                          "fromMultiplicity": "1", "toMultiplicity": "*"} for i in range(repeats - 1)]
+        diagram = {"diagramType": "UML Class Diagram", "diagramName": "Mock System",
+                   "classes": classes, "relationships": relationships}
+        return f"Here is the diagram:\n\n```json\n{json.dumps(diagram, indent=2)}\n```"
+    if kind == "html":
+        sections = "\n".join(
+            f'  <section id="screen-{i}">\n    <h2>Screen {i}</h2>\n'
+            f'    <p>Mock screen content used for load testing the prototype pipeline.</p>\n'
+            f'    <button onclick="show({i + 1})">Next</button>\n  </section>'
+            for i in range(repeats))
+        return ("Here is the prototype:\n\n<!DOCTYPE html>\n<html>\n<head>\n<title>Mock Prototype</title>\n"
+                "<style>section { display: none; } section:first-of-type { display: block; }</style>\n"
+                "<script>function show(i) { document.querySelectorAll('section').forEach("
+                "(s, n) => s.style.display = n === i ? 'block' : 'none'); }</script>\n"
+                f"</head>\n<body>\n{sections}\n</body>\n</html>")
+    sections = "\n\n".join(
+        f"## Section {i}\n\nThis section of the mock document describes requirement {i} of the system. "
+        f"It exists so that load tests send and receive documents of a realistic size.\n\n"
+        f"- Item {i}.1\n- Item {i}.2"
+        for i in range(repeats))
+    return f"Here is the document:\n\n```markdown\nMock Software Requirements Specification\n\n{sections}\n```"
+
+
+class MockLLMProvider(CustomLLM):
+    """
+    A litellm custom provider that answers "mock/..." models locally, so the
+    agents and the API can be load-tested without calling a real provider.
+
+    Responses are canned documents the agents can extract. Latency, output
+    token rate and injected failures (429s with Retry-After, 500s) are read
+    from the MOCK_LLM_* settings on every call, so a benchmark can change
+    them at runtime.
+    """
+
+    def _latency(self) -> float:
+        jitter = settings.MOCK_LLM_LATENCY_JITTER
+        return max(0.0, settings.MOCK_LLM_LATENCY_SECONDS * random.uniform(1 - jitter, 1 + jitter))
+
+    def _generation_time(self, text: str) -> float:
+        rate = settings.MOCK_LLM_TOKENS_PER_SECOND
+        return count_text_tokens(text) / rate if rate > 0 else 0.0
+
+    def _check_failure(self, model: str) -> bool:
+        """Raise an injected rate limit. Returns whether the call should fail with a server error."""
+        if random.random() < settings.MOCK_LLM_RATE_LIMIT_RATE:
+            response = httpx.Response(429, headers={"retry-after": str(settings.MOCK_LLM_RETRY_AFTER_SECONDS)},
+                                      request=httpx.Request("POST", f"http://{PROVIDER}.local/chat/completions"))
+            raise litellm.RateLimitError("Mock rate limit", llm_provider=PROVIDER, model=model, response=response)
+        return random.random() < settings.MOCK_LLM_ERROR_RATE
+
+    def _server_error(self, model: str) -> Exception:
+        return litellm.InternalServerError("Mock server error", llm_provider=PROVIDER, model=model)
+
+    def _response(self, model: str, messages: List[Dict[str, Any]], model_response: ModelResponse) -> ModelResponse:
+        text = canned_response(response_kind(model, messages), settings.MOCK_LLM_OUTPUT_TOKENS)
+        model_response.choices[0].message.content = text
+        model_response.model = f"{PROVIDER}/{model}"
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = count_text_tokens(text)
+        setattr(model_response, "usage", Usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                               total_tokens=prompt_tokens + completion_tokens))
+        return model_response
+
+    def _chunks(self, model: str, messages: List[Dict[str, Any]]) -> Iterator[GenericStreamingChunk]:
+        text = canned_response(response_kind(model, messages), settings.MOCK_LLM_OUTPUT_TOKENS)
+        pieces = [text[i:i + _STREAM_CHUNK_CHARS] for i in range(0, len(text), _STREAM_CHUNK_CHARS)]
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = count_text_tokens(text)
+        for index, piece in enumerate(pieces):
+            last = index == len(pieces) - 1
+            # Like the real providers with include_usage, only the last chunk reports usage
+            yield GenericStreamingChunk(
+                text=piece, tool_use=None, is_finished=last, finish_reason="stop" if last else "", index=0,
+                usage={"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                       "total_tokens": prompt_tokens + completion_tokens} if last else None)
+
+    # --- CustomLLM API ---
+
+    def completion(self, model: str, messages: list, api_base: str, custom_prompt_dict: dict,
+                   model_response: ModelResponse, *args: Any, **kwargs: Any) -> ModelResponse:
+        time.sleep(self._latency())
+        if self._check_failure(model):
+            raise self._server_error(model)
+        response = self._response(model, messages, model_response)
+        time.sleep(self._generation_time(response.choices[0].message.content))
+        return response
+
+    async def acompletion(self, model: str, messages: list, api_base: str, custom_prompt_dict: dict,
+                          model_response: ModelResponse, *args: Any, **kwargs: Any) -> ModelResponse:
+        await asyncio.sleep(self._latency())
+        if self._check_failure(model):
+            raise self._server_error(model)
+        response = self._response(model, messages, model_response)
+        await asyncio.sleep(self._generation_time(response.choices[0].message.content))
+        return response
+
+    def streaming(self, model: str, messages: list, *args: Any, **kwargs: Any) -> Iterator[GenericStreamingChunk]:
+        time.sleep(self._latency())
+        fail = self._check_failure(model)
+        chunks = list(self._chunks(model, messages))
+        for index, chunk in enumerate(chunks):
+            if fail and index == len(chunks) // 2:
+                raise self._server_error(model) # Fails after part of the answer was sent
+            time.sleep(self._generation_time(chunk["text"]))
+            yield chunk
+
+    async def astreaming(self, model: str, messages: list, *args: Any, **kwargs: Any) -> AsyncIterator[GenericStreamingChunk]:
+        await asyncio.sleep(self._latency())
+        fail = self._check_failure(model)
+        chunks = list(self._chunks(model, messages))
+        for index, chunk in enumerate(chunks):
+            if fail and index == len(chunks) // 2:
+                raise self._server_error(model)
+            await asyncio.sleep(self._generation_time(chunk["text"]))
+            yield chunk
+
+
+_provider = MockLLMProvider()
+
+
+def register() -> None:
+    """Route "mock/..." model strings to the mock provider."""
+    if not any(entry["provider"] == PROVIDER for entry in litellm.custom_provider_map):
+        litellm.custom_provider_map.append({"provider": PROVIDER, "custom_handler": _provider})
+    custom_llm_setup()
+    print("Mock LLM provider registered for 'mock/...' models")
@@ -0,0 +1,250 @@
+# utils/ModelRouter.py
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from config import settings
+
+T = TypeVar("T")
+
+_MIN_SAMPLES = 10 # Latency samples needed before percentiles are trusted
+
+
+class _ModelHealth:
+    """Rolling latency and failure statistics of one model."""
+
+    def __init__(self, window: int):
+        self.latencies: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.hedges_launched = 0
+        self.hedges_won = 0
+        self.fallbacks = 0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < _MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ModelRouter:
+    """
+    Routing policies for LLM calls.
+
+    A route maps a model string (anything `/agent/add` accepts) to a chain of
+    fallback models. Calls go to the first healthy model of the chain and
+    fall through to the next one when it fails. With the "fastest" strategy
+    the chain is ordered by rolling median latency instead. With hedging, a
+    duplicate request goes to the next model once the call has taken longer
+    than the primary's p95 latency; the first response wins and the other call
+    is cancelled. Models without a route are called directly, but their
+    latency is still tracked.
+    """
+
+    def __init__(self, routes: Dict[str, Dict[str, Any]], window: int, unhealthy_failures: int,
+                 unhealthy_cooldown: float, hedge_default_seconds: float):
+        """
+        Args:
+            routes: Per model string: "fallbacks" (list of models), "strategy" ("ordered" or
+                "fastest"), "hedge" (bool) and "hedge_after_seconds" (fixed hedge delay)
+            window: Number of latency samples kept per model
+            unhealthy_failures: Consecutive failures after which a model is skipped
+            unhealthy_cooldown: Seconds before an unhealthy model is tried again
+            hedge_default_seconds: Hedge delay used until the primary has enough samples for a p95
+        """
+        self.routes = routes
+        self.window = window
+        self.unhealthy_failures = unhealthy_failures
+        self.unhealthy_cooldown = unhealthy_cooldown
+        self.hedge_default_seconds = hedge_default_seconds
+        self._lock = threading.Lock()
+        self._health: Dict[str, _ModelHealth] = {}
+
+    def _model_health(self, model: str) -> _ModelHealth:
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = _ModelHealth(self.window)
+        return health
+
+    def is_healthy(self, model: str) -> bool:
+        """A model is unhealthy after repeated failures, until its cooldown has passed."""
+        with self._lock:
+            health = self._model_health(model)
+            return (health.consecutive_failures < self.unhealthy_failures
+                    or time.monotonic() - health.last_failure > self.unhealthy_cooldown)
+
+    def candidates(self, model: str) -> List[str]:
+        """Return the models to try for a call, in order."""
+        route = self.routes.get(model, {})
+        chain = list(dict.fromkeys([model] + list(route.get("fallbacks", []))))
+        if len(chain) == 1:
+            return chain
+        healthy = {candidate: self.is_healthy(candidate) for candidate in chain}
+        if route.get("strategy") == "fastest":
+            with self._lock:
+                # Models without enough samples sort first so they get measured
+                medians = {candidate: self._model_health(candidate).percentile(0.5) or 0.0 for candidate in chain}
+            chain.sort(key=lambda candidate: medians[candidate])
+        # Unhealthy models stay in the chain as a last resort
+        return sorted(chain, key=lambda candidate: not healthy[candidate])
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Return how long to wait before hedging a call, or None if the route does not hedge."""
+        route = self.routes.get(model, {})
+        if not route.get("hedge") or not route.get("fallbacks"):
+            return None
+        if route.get("hedge_after_seconds"):
+            return route["hedge_after_seconds"]
+        primary = self.candidates(model)[0]
+        with self._lock:
+            p95 = self._model_health(primary).percentile(0.95)
+        return p95 if p95 is not None else self.hedge_default_seconds
+
+    def record(self, model: str, failed: bool = False) -> None:
+        """Record the outcome of a call to a model."""
+        with self._lock:
+            health = self._model_health(model)
+            health.calls += 1
+            if failed:
+                health.failures += 1
+                health.consecutive_failures += 1
+                health.last_failure = time.monotonic()
+            else:
+                health.consecutive_failures = 0
+
+    def record_latency(self, model: str, latency: float) -> None:
+        """
+        Record how long a provider request to a model took. Callers time the
+        request itself, inside its scheduler slot: queue waits, retry backoff and
+        response cache hits say nothing about the model and would skew the hedge
+        delay and the "fastest" route.
+        """
+        with self._lock:
+            self._model_health(model).latencies.append(latency)
+
+    def _count(self, model: str, counter: str) -> None:
+        with self._lock:
+            health = self._model_health(model)
+            setattr(health, counter, getattr(health, counter) + 1)
+
+    async def _recorded(self, model: str, call: Callable[[str], Awaitable[T]]) -> T:
+        try:
+            result = await call(model)
+        except asyncio.CancelledError:
+            raise # A lost hedge or a cancelled request says nothing about the model
+        except Exception:
+            self.record(model, failed=True)
+            raise
+        self.record(model)
+        return result
+
+    async def arun(self, model: str, call: Callable[[str], Awaitable[T]]) -> T:
+        """
+        Run a call under the route of `model`.
+
+        Args:
+            model (str): The model requested by the agent
+            call (Callable[[str], Awaitable[T]]): Makes the call against the given model
+
+        Returns:
+            T: The result of the first call that succeeds
+
+        Raises:
+            Exception: The error of the last model tried if every model failed
+        """
+        candidates = self.candidates(model)
+        hedge_delay = self.hedge_delay(model)
+        next_index = 0
+        pending: Dict[asyncio.Task, str] = {}
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            nonlocal next_index
+            candidate = candidates[next_index]
+            next_index += 1
+            pending[asyncio.ensure_future(self._recorded(candidate, call))] = candidate
+
+        launch()
+        try:
+            while pending:
+                # Only the first call is hedged; later models are tried as fallbacks
+                can_hedge = hedge_delay is not None and not hedged and next_index < len(candidates)
+                done, _ = await asyncio.wait(pending.keys(), timeout=hedge_delay if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    print(f"No response from '{candidates[0]}' after {hedge_delay:.1f}s, hedging to '{candidates[next_index]}'")
+                    self._count(candidates[next_index], "hedges_launched")
+                    launch()
+                    continue
+                for task in done:
+                    candidate = pending.pop(task)
+                    if task.exception() is None:
+                        if hedged and candidate != candidates[0]:
+                            self._count(candidate, "hedges_won")
+                        return task.result()
+                    last_error = task.exception()
+                    print(f"LLM call to '{candidate}' failed: {last_error}")
+                if not pending and next_index < len(candidates):
+                    self._count(candidates[next_index], "fallbacks")
+                    print(f"Falling back to '{candidates[next_index]}'")
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel() # The losing hedge
+        raise last_error
+
+    def run_sync(self, model: str, call: Callable[[str], T]) -> T:
+        """Blocking version of `arun`. Falls back along the route but does not hedge."""
+        last_error: Optional[BaseException] = None
+        for index, candidate in enumerate(self.candidates(model)):
+            if index:
+                self._count(candidate, "fallbacks")
+                print(f"Falling back to '{candidate}'")
+            try:
+                result = call(candidate)
+            except Exception as e:
+                self.record(candidate, failed=True)
+                print(f"LLM call to '{candidate}' failed: {e}")
+                last_error = e
+                continue
+            self.record(candidate)
+            return result
+        raise last_error
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return latency percentiles, health and routing counters per model."""
+        models = list(self._health.keys())
+        healthy = {model: self.is_healthy(model) for model in models}
+        with self._lock:
+            return {
+                model: {
+                    "healthy": healthy[model],
+                    "calls": health.calls,
+                    "failures": health.failures,
+                    "consecutive_failures": health.consecutive_failures,
+                    "p50_seconds": health.percentile(0.5),
+                    "p95_seconds": health.percentile(0.95),
+                    "samples": len(health.latencies),
+                    "hedges_launched": health.hedges_launched,
+                    "hedges_won": health.hedges_won,
+                    "fallbacks": health.fallbacks,
+                }
+                for model, health in self._health.items()
+            }
+
+
+# Shared router used by LLMClient
+model_router = ModelRouter(
+    routes=settings.MODEL_ROUTES,
+    window=settings.ROUTE_LATENCY_WINDOW,
+    unhealthy_failures=settings.ROUTE_UNHEALTHY_FAILURES,
+    unhealthy_cooldown=settings.ROUTE_UNHEALTHY_COOLDOWN_SECONDS,
+    hedge_default_seconds=settings.ROUTE_HEDGE_DEFAULT_SECONDS,
+)
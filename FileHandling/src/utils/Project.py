@@ -42,6 +42,22 @@ class Project:
         
         # Tracking processing history
         self.processing_history = []
+
+        # Prompt context, built on first use
+        self._context = None
+
+    @property
+    def context(self):
+        """
+        The project's prompt context. It is created on first use and refreshed
+        incrementally from the processed files on every access.
+        """
+        if self._context is None:
+            from utils.Context import Context # Context imports Project
+            self._context = Context()
+            self._context.project_name = self.name
+        self._context.update_context(self)
+        return self._context
     
     def _generate_id(self) -> str:
         """Generate a unique ID based on timestamp."""
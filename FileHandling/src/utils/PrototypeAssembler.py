@@ -0,0 +1,224 @@
+# utils/PrototypeAssembler.py
+import html
+import re
+from pathlib import Path
+from typing import List, Tuple
+
+_STYLE = re.compile(r"<style[^>]*>(.*?)</style>", re.DOTALL | re.IGNORECASE)
+_INLINE_SCRIPT = re.compile(r"<script(?![^>]*\bsrc\s*=)[^>]*>(.*?)</script>", re.DOTALL | re.IGNORECASE)
+_ANY_SCRIPT = re.compile(r"<script[^>]*>.*?</script>", re.DOTALL | re.IGNORECASE)
+_BODY = re.compile(r"<body[^>]*>(.*?)</body>", re.DOTALL | re.IGNORECASE)
+_ROOT_SELECTOR = re.compile(r"^(html|body|:root)(?![\w-])\s*", re.IGNORECASE)
+_FUNCTION = re.compile(r"\bfunction\s+([A-Za-z_$][\w$]*)\s*\(")
+_HANDLER = re.compile(r"""(\son[a-z]+\s*=\s*)(["'])(.*?)\2""", re.DOTALL | re.IGNORECASE)
+
+# Layout of the navigation bar and the screen switching, shared by all screens
+BASE_CSS = """
+.prototype-nav { display: flex; flex-wrap: wrap; gap: 8px; padding: 12px 16px; background: #1f2933; position: sticky; top: 0; z-index: 1000; }
+.prototype-nav button { background: transparent; color: #e4e7eb; border: 1px solid #52606d; border-radius: 4px; padding: 6px 12px; cursor: pointer; font: inherit; }
+.prototype-nav button.active { background: #e4e7eb; color: #1f2933; }
+.prototype-screen { display: none; }
+.prototype-screen.active { display: block; }
+""".strip()
+
+NAV_SCRIPT = """
+function showScreen(id) {
+  if (!document.getElementById(id)) return;
+  document.querySelectorAll('.prototype-screen').forEach(function (screen) { screen.classList.toggle('active', screen.id === id); });
+  document.querySelectorAll('.prototype-nav button').forEach(function (button) { button.classList.toggle('active', button.dataset.screen === id); });
+  if (location.hash !== '#' + id) history.replaceState(null, '', '#' + id);
+}
+document.querySelectorAll('.prototype-nav button').forEach(function (button) {
+  button.addEventListener('click', function () { showScreen(button.dataset.screen); });
+});
+window.addEventListener('hashchange', function () { showScreen(location.hash.slice(1)); });
+""".strip()
+
+
+class Screen:
+    """One generated screen of a prototype."""
+
+    def __init__(self, screen_id: str, title: str, page: str):
+        self.screen_id = screen_id # Element id of the screen in the assembled page
+        self.title = title
+        self.page = page # The screen as a standalone HTML page
+
+
+def screen_list(image_paths: List[str]) -> List[Tuple[str, str]]:
+    """Return a unique (element id, title) pair for every UI image, named after the file."""
+    screens: List[Tuple[str, str]] = []
+    used = set()
+    for image_path in image_paths:
+        title = Path(image_path).stem.replace("_", " ").strip() or "Screen"
+        slug = re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-") or "screen"
+        screen_id, number = f"screen-{slug}", 2
+        while screen_id in used:
+            screen_id, number = f"screen-{slug}-{number}", number + 1
+        used.add(screen_id)
+        screens.append((screen_id, title))
+    return screens
+
+
+def split_page(page: str) -> Tuple[str, str, List[str]]:
+    """Split a standalone HTML page into its CSS, its body markup without scripts and its inline scripts."""
+    css = "\n".join(style.strip() for style in _STYLE.findall(page))
+    body_match = _BODY.search(page)
+    body = body_match.group(1) if body_match else _STYLE.sub("", page)
+    scripts = [script.strip() for script in _INLINE_SCRIPT.findall(body_match.group(0) if body_match else page) if script.strip()]
+    if body_match:
+        # Scripts in the head usually wait for the DOM, they run at the end of the body all the same
+        head = page[:body_match.start()]
+        scripts = [script.strip() for script in _INLINE_SCRIPT.findall(head) if script.strip()] + scripts
+    body = _ANY_SCRIPT.sub("", _STYLE.sub("", body)).strip()
+    return css, body, scripts
+
+
+def _split_selectors(prelude: str) -> List[str]:
+    """Split a selector list on the commas outside parentheses, e.g. not inside :is(a, b)."""
+    parts, depth, current = [], 0, []
+    for char in prelude:
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current.append(char)
+    parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _scope_selector(selector: str, scope: str) -> str:
+    rest = selector
+    while _ROOT_SELECTOR.match(rest):
+        rest = _ROOT_SELECTOR.sub("", rest, count=1)
+    if rest != selector:
+        return f"{scope} {rest}".strip() # body, html and :root rules apply to the screen itself
+    return f"{scope} {selector}"
+
+
+def _matching_brace(css: str, start: int) -> int:
+    depth = 0
+    for index in range(start, len(css)):
+        if css[index] == "{":
+            depth += 1
+        elif css[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+    return len(css)
+
+
+def scope_css(css: str, scope: str) -> str:
+    """
+    Prefix every selector of a stylesheet with `scope` (e.g. "#screen-login"),
+    so the styles of one screen do not leak into the others. Rules inside
+    @media and @supports are scoped too; other at-rules are kept as they are.
+    """
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    rules: List[str] = []
+    position = 0
+    while True:
+        brace = css.find("{", position)
+        if brace == -1:
+            break
+        statements = css[position:brace].split(";")
+        # Statements such as @import end with a semicolon before the next rule
+        rules.extend(f"{statement.strip()};" for statement in statements[:-1] if statement.strip())
+        prelude = statements[-1].strip()
+        end = _matching_brace(css, brace)
+        block = css[brace + 1:end]
+        if prelude.lower().startswith(("@media", "@supports")):
+            rules.append(f"{prelude} {{\n{scope_css(block, scope)}\n}}")
+        elif prelude.startswith("@") or not prelude:
+            rules.append(f"{prelude} {{{block}}}")
+        else:
+            selectors = dict.fromkeys(_scope_selector(selector, scope) for selector in _split_selectors(prelude))
+            rules.append(f"{', '.join(selectors)} {{{block.strip()}}}")
+        position = end + 1
+    return "\n".join(rules)
+
+
+def top_level_functions(script: str) -> List[str]:
+    """Names of the function declarations of a script that are not nested in a block."""
+    names, depth, position = [], 0, 0
+    for match in _FUNCTION.finditer(script):
+        depth += script.count("{", position, match.start()) - script.count("}", position, match.start())
+        position = match.start()
+        if depth == 0:
+            names.append(match.group(1))
+    return list(dict.fromkeys(names))
+
+
+def _global_name(screen_id: str, name: str) -> str:
+    return f"{screen_id.replace('-', '_')}__{name}"
+
+
+def export_functions(body: str, scripts: List[str], screen_id: str) -> Tuple[str, str]:
+    """
+    Put the scripts of a screen in one function scope, so their variables do
+    not clash with the other screens. Inline event handlers (onclick="...")
+    run in the global scope, so the top-level functions are exported on
+    window under a name prefixed with the screen id and the handlers of the
+    screen are rewritten to call them. Returns the markup and the script.
+    """
+    names = [name for script in scripts for name in top_level_functions(script)]
+    if names:
+        calls = re.compile(r"(?<![\w$.])(" + "|".join(re.escape(name) for name in names) + r")(?=\s*\()")
+
+        def rewrite(handler: re.Match) -> str:
+            code = calls.sub(lambda call: _global_name(screen_id, call.group(1)), handler.group(3))
+            return f"{handler.group(1)}{handler.group(2)}{code}{handler.group(2)}"
+
+        body = _HANDLER.sub(rewrite, body)
+    exports = "".join(f"\nwindow.{_global_name(screen_id, name)} = {name};" for name in dict.fromkeys(names))
+    script = "\n".join(scripts)
+    return body, f"(function () {{\n{script}{exports}\n}})();"
+
+
+def assemble(title: str, screens: List[Screen]) -> str:
+    """
+    Merge standalone screen pages into a single-file app: the CSS of every
+    screen scoped to its section, one navigation bar and the screen switching
+    script, and the scripts of every screen in their own function scope
+    (see `export_functions`).
+    The output only depends on the input, so the same screens give the same page.
+    """
+    styles = [BASE_CSS]
+    sections = []
+    scripts = [NAV_SCRIPT]
+    buttons = []
+    for screen in screens:
+        css, body, screen_scripts = split_page(screen.page)
+        if screen_scripts:
+            body, script = export_functions(body, screen_scripts, screen.screen_id)
+            scripts.append(script)
+        if css:
+            styles.append(f"/* {screen.title.replace('*/', '')} */\n{scope_css(css, f'#{screen.screen_id}')}")
+        sections.append(f'<section id="{screen.screen_id}" class="prototype-screen" data-title="{html.escape(screen.title)}">\n{body}\n</section>')
+        buttons.append(f'<button type="button" data-screen="{screen.screen_id}">{html.escape(screen.title)}</button>')
+    first_screen = screens[0].screen_id if screens else ""
+    scripts.append(f"showScreen(document.getElementById(location.hash.slice(1)) ? location.hash.slice(1) : '{first_screen}');")
+    newline = "\n"
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{html.escape(title)}</title>
+<style>
+{newline.join(styles)}
+</style>
+</head>
+<body>
+<nav class="prototype-nav">
+{newline.join(buttons)}
+</nav>
+<main>
+{newline.join(sections)}
+</main>
+<script>
+{newline.join(scripts)}
+</script>
+</body>
+</html>"""
@@ -0,0 +1,163 @@
+# utils/ResponseCache.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import settings
+
+MODES = ("off", "readwrite", "replay")
+
+
+class ResponseCacheMiss(LookupError):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+def _plain(value: Any) -> Any:
+    """Convert provider message objects into plain JSON values."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    return str(value)
+
+
+def normalize_messages(messages: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Return the messages in a canonical form for hashing. Prompt caching
+    markers are dropped since they do not change the response.
+    """
+    normalized = []
+    for message in json.loads(json.dumps(messages, default=_plain)):
+        content = message.get("content")
+        if isinstance(content, list):
+            message["content"] = [{k: v for k, v in entry.items() if k != "cache_control"} for entry in content]
+        normalized.append(message)
+    return normalized
+
+
+class ResponseCache:
+    """
+    Deterministic on-disk cache of LLM responses.
+
+    Responses are keyed by a hash of the model, the normalized messages and
+    the request parameters, and stored as one JSON file each. In "readwrite"
+    mode misses go to the provider and are recorded; in "replay" mode only
+    recorded responses are served and a miss raises ResponseCacheMiss, so a
+    test run of the agent pipeline never touches the network. When the cache
+    grows past its size budget the least recently used entries are deleted.
+    """
+
+    def __init__(self, cache_dir: Path, mode: str, max_bytes: int):
+        if mode not in MODES:
+            raise ValueError(f"Unknown response cache mode '{mode}', expected one of {MODES}")
+        self.cache_dir = Path(cache_dir)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None # Computed on first write
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def key(self, model: str, messages: List[Any], params: Dict[str, Any]) -> str:
+        """Return the cache key of a request."""
+        payload = {"model": model, "messages": normalize_messages(messages), "params": params}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def lookup(self, model: str, messages: List[Any], params: Dict[str, Any]) -> Optional[str]:
+        """
+        Return the recorded response text of a request, or None on a miss.
+
+        Raises:
+            ResponseCacheMiss: On a miss in replay mode
+        """
+        if not self.enabled:
+            return None
+        key = self.key(model, messages, params)
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path) # Mark as recently used for eviction
+        except (OSError, ValueError):
+            entry = None
+        with self._lock:
+            self.stats["hits" if entry is not None else "misses"] += 1
+        if entry is not None:
+            return entry["text"]
+        if self.mode == "replay":
+            raise ResponseCacheMiss(f"No recorded response for model '{model}' (key {key[:12]})")
+        return None
+
+    def store(self, model: str, messages: List[Any], params: Dict[str, Any], text: str) -> None:
+        """Record the response text of a request and enforce the size budget."""
+        if self.mode != "readwrite":
+            return
+        key = self.key(model, messages, params)
+        path = self._path(key)
+        data = json.dumps({"model": model, "created": time.time(), "text": text}).encode('utf-8')
+        tmp_path = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # A unique temporary file per writer, so concurrent stores of the same key never share one
+            with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                f.write(data)
+            with self._lock:
+                # An entry written again replaces the old file, only the difference counts towards the budget
+                old_size = path.stat().st_size if path.exists() else 0
+                os.replace(tmp_path, path)
+                tmp_path = None
+                self.stats["stores"] += 1
+                if self._total_bytes is None:
+                    self._total_bytes = sum(entry.stat().st_size for entry in self.cache_dir.glob("*/*.json"))
+                else:
+                    self._total_bytes += len(data) - old_size
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        except OSError as e:
+            print(f"Error writing response cache entry: {e}")
+        finally:
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until the cache is within 90% of its budget."""
+        entries = []
+        for entry in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            except OSError:
+                continue
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            self._total_bytes -= size
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the mode, hit counters and size of the cache."""
+        with self._lock:
+            return {"mode": self.mode, **self.stats, "size_bytes": self._total_bytes}
+
+
+# Shared cache used by LLMClient
+response_cache = ResponseCache(
+    cache_dir=settings.LLM_CACHE_DIR,
+    mode=settings.LLM_CACHE_MODE,
+    max_bytes=settings.LLM_CACHE_MAX_MB * 1024 * 1024,
+)
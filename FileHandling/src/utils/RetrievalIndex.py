@@ -0,0 +1,219 @@
+# utils/RetrievalIndex.py
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]{3,}")
+_MAX_QUERY_TERMS = 64
+
+
+def project_sources(context: Any, include_diagrams: bool = True) -> Dict[str, Tuple[str, str]]:
+    """
+    Return the retrievable artifacts of a project context.
+
+    Returns:
+        Dict[str, Tuple[str, str]]: Source name ("doc:", "diagram:" or "csv:" prefixed)
+        mapped to its kind and text
+    """
+    sources: Dict[str, Tuple[str, str]] = {}
+    for doc_name, doc_text in context.generated_text_doc.items():
+        sources[f"doc:{doc_name}"] = ("doc", doc_text or "")
+    if include_diagrams:
+        for diagram_name, diagram in context.generated_diagram.items():
+            diagram_text = diagram if isinstance(diagram, str) else json.dumps(diagram, indent=1)
+            sources[f"diagram:{diagram_name}"] = ("diagram", diagram_text)
+    for index, csv_content in enumerate(context.csv_description):
+        sources[f"csv:{index + 1}"] = ("csv", csv_content or "")
+    return sources
+
+
+def chunk_text(text: str, kind: str, max_chars: int) -> List[str]:
+    """
+    Split an artifact into chunks of at most about `max_chars` characters.
+
+    Documents are split on paragraphs and start a new chunk at every heading,
+    diagrams and CSV tables on lines. CSV chunks repeat the header row so each
+    chunk can be read on its own.
+    """
+    header = ""
+    if kind == "doc":
+        units = [block.strip() for block in re.split(r"\n\s*\n", text) if block.strip()]
+    else:
+        units = [line for line in text.splitlines() if line.strip()]
+        if kind == "csv" and units:
+            header, units = units[0], units[1:]
+            if not units:
+                return [header]
+
+    separator = "\n\n" if kind == "doc" else "\n"
+    chunks: List[str] = []
+    current: List[str] = []
+    current_len = 0
+    for unit in units:
+        # Hard split anything that is larger than a chunk by itself
+        pieces = [unit[i:i + max_chars] for i in range(0, len(unit), max_chars)] or [unit]
+        for piece in pieces:
+            starts_section = kind == "doc" and piece.startswith("#")
+            if current and (current_len + len(piece) > max_chars or starts_section):
+                chunks.append(separator.join(current))
+                current, current_len = [], 0
+            if header and not current:
+                current.append(header)
+                current_len += len(header)
+            current.append(piece)
+            current_len += len(piece) + len(separator)
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+class RetrievalIndex:
+    """
+    BM25 retrieval over the artifacts of a project, backed by SQLite FTS5.
+
+    Generated documents, diagram JSON and CSV tables are chunked and indexed
+    under their source name. Sources are re-indexed only when their content
+    hash changes, so syncing a context whose artifacts did not change costs a
+    hash per artifact. Agents query the index for the chunks most relevant to
+    what they are writing instead of pasting every artifact into the prompt.
+    """
+
+    _instances: Dict[str, "RetrievalIndex"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_path: str, chunk_chars: int):
+        """
+        Args:
+            db_path: Path of the SQLite database (created if missing)
+            chunk_chars: Approximate maximum size of a chunk in characters
+        """
+        self.db_path = db_path
+        self.chunk_chars = chunk_chars
+        self._lock = threading.Lock()
+        # Calls come from the event loop and worker threads, access is serialized by the lock
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, kind TEXT, hash TEXT, chunks INTEGER)")
+            self._connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+                "source UNINDEXED, kind UNINDEXED, chunk_no UNINDEXED, text, tokenize='porter unicode61')")
+
+    @classmethod
+    def for_project(cls, project: Any) -> Optional["RetrievalIndex"]:
+        """
+        Return the shared index of a project, or None if retrieval is disabled
+        or the index cannot be opened (e.g. SQLite built without FTS5).
+        """
+        if not settings.RETRIEVAL_ENABLED or project is None:
+            return None
+        db_path = os.path.join(project.project_dir, settings.RETRIEVAL_INDEX_FILE_NAME)
+        with cls._instances_lock:
+            index = cls._instances.get(db_path)
+            if index is None:
+                try:
+                    os.makedirs(project.project_dir, exist_ok=True)
+                    index = cls(db_path, settings.RETRIEVAL_CHUNK_CHARS)
+                except Exception as e:
+                    print(f"Retrieval index unavailable for project '{project.name}': {e}")
+                    return None
+                cls._instances[db_path] = index
+            return index
+
+    # --- Maintenance ---
+
+    def upsert(self, source: str, kind: str, text: str) -> bool:
+        """Index an artifact. Returns False if it was already indexed with the same content."""
+        content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            row = self._connection.execute("SELECT hash FROM sources WHERE source = ?", (source,)).fetchone()
+            if row is not None and row[0] == content_hash:
+                return False
+            chunks = chunk_text(text, kind, self.chunk_chars)
+            with self._connection:
+                self._connection.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self._connection.executemany(
+                    "INSERT INTO chunks (source, kind, chunk_no, text) VALUES (?, ?, ?, ?)",
+                    [(source, kind, chunk_no, chunk) for chunk_no, chunk in enumerate(chunks)])
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO sources (source, kind, hash, chunks) VALUES (?, ?, ?, ?)",
+                    (source, kind, content_hash, len(chunks)))
+        return True
+
+    def remove(self, source: str) -> None:
+        """Remove an artifact from the index."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._connection.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+    def sync(self, sources: Dict[str, Tuple[str, str]]) -> Dict[str, int]:
+        """
+        Bring the index in line with the given artifacts: changed ones are
+        re-indexed and those no longer present are removed.
+
+        Args:
+            sources (Dict[str, Tuple[str, str]]): Source name mapped to its kind and text
+
+        Returns:
+            Dict[str, int]: Number of sources updated and removed
+        """
+        updated = sum(1 for source, (kind, text) in sources.items() if self.upsert(source, kind, text))
+        with self._lock:
+            indexed = [row[0] for row in self._connection.execute("SELECT source FROM sources")]
+        stale = [source for source in indexed if source not in sources]
+        for source in stale:
+            self.remove(source)
+        if updated or stale:
+            print(f"Retrieval index {self.db_path}: {updated} source(s) updated, {len(stale)} removed")
+        return {"updated": updated, "removed": len(stale)}
+
+    def sync_context(self, context: Any) -> Dict[str, int]:
+        """Index every artifact of a project context."""
+        return self.sync(project_sources(context))
+
+    # --- Retrieval ---
+
+    def search(self, query: str, top_k: int, kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Return the chunks that best match a query, ranked by BM25.
+
+        Args:
+            query (str): Free text describing what is being written
+            top_k (int): Maximum number of chunks to return
+            kinds (Iterable[str], optional): Restrict results to these artifact kinds
+
+        Returns:
+            List[Dict[str, Any]]: Chunks with their source, kind, chunk number, text and score
+        """
+        terms = list(dict.fromkeys(_WORD_PATTERN.findall(query.lower())))[:_MAX_QUERY_TERMS]
+        if not terms or top_k <= 0:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        sql = "SELECT source, kind, chunk_no, text, bm25(chunks) FROM chunks WHERE chunks MATCH ?"
+        params: List[Any] = [match]
+        if kinds is not None:
+            kinds = list(kinds)
+            sql += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+        sql += " ORDER BY bm25(chunks) LIMIT ?"
+        params.append(top_k)
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [{"source": source, "kind": kind, "chunk_no": int(chunk_no), "text": text, "score": -score}
+                for source, kind, chunk_no, text, score in rows]
+
+    def retrieve(self, query: str, top_k: int, kinds: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Return the best matching chunks grouped by source, each source's chunks
+        joined in document order.
+        """
+        grouped: Dict[str, List[Tuple[int, str]]] = {}
+        for hit in self.search(query, top_k, kinds):
+            grouped.setdefault(hit["source"], []).append((hit["chunk_no"], hit["text"]))
+        return {source: "\n[...]\n".join(text for _, text in sorted(chunks)) for source, chunks in grouped.items()}
@@ -0,0 +1,246 @@
+# utils/StreamExtractor.py
+import re
+from bisect import bisect_right
+from typing import List, Optional, Sequence
+
+_OPENING_FENCE = re.compile(r"```\s*([\w+-]*)\s*$") # "```markdown", possibly after some text on the same line
+_CLOSING_FENCE = re.compile(r"^\s*```\s*$")
+_JSON_STOP = re.compile(r'[{}"]')
+_STRING_STOP = re.compile(r'["\\]')
+_HTML_DOCTYPE = re.compile(r"<!doctype\s+html", re.IGNORECASE)
+_HTML_TAG = re.compile(r"<html[\s>]", re.IGNORECASE)
+_HTML_END = re.compile(r"</html\s*>", re.IGNORECASE)
+_HTML_LOOKBEHIND = 16 # Longest marker, so a marker split across chunks is still found
+# Fences whose content is markdown, in which code blocks with a language are nested fences
+_MARKDOWN_LANGUAGES = {"markdown", "md"}
+
+
+class Artifact:
+    """A complete block found in a response."""
+
+    def __init__(self, kind: str, text: str, start: int, end: int, language: str = ""):
+        self.kind = kind # "fence", "json" or "html"
+        self.language = language # Language of a fence, lower case ("" if it has none)
+        self.text = text # Content of a fence without the fence lines, or the JSON object or HTML document itself
+        self.start = start # Offsets in the response
+        self.end = end
+
+
+class StreamExtractor:
+    """
+    Finds fenced blocks, balanced JSON objects and HTML documents in a response
+    while it streams. Each chunk is scanned on its own with a small carry-over
+    (the current line, the JSON state, the last characters for HTML markers),
+    and the response is kept as a list of chunks that is only joined to cut
+    out an artifact. Every character is looked at a constant number of times,
+    so the cost is linear in the response length however many candidates it
+    holds, and each artifact is reported by `feed` as soon as it is complete.
+    """
+
+    def __init__(self, languages: Optional[Sequence[str]] = None, json_objects: bool = False, html: bool = False):
+        """
+        Args:
+            languages (Optional[Sequence[str]]): Fence languages to report ("" for fences without
+                one); None reports every fence, an empty sequence none
+            json_objects (bool): Report balanced top-level JSON objects, inside fences or not
+            html (bool): Report HTML documents (<!DOCTYPE html>, else the first <html>, up to </html>)
+        """
+        self.languages = None if languages is None else {language.lower() for language in languages}
+        self.json_objects = json_objects
+        self.html = html
+        self.artifacts: List[Artifact] = []
+        # Response: the chunks, the offset of each and the total length
+        self._chunks: List[str] = []
+        self._offsets: List[int] = []
+        self._length = 0
+        # Fences: the pieces of the current line, its start and the open fences as (language, content start)
+        self._line: List[str] = []
+        self._line_start = 0
+        self._fences: List[tuple[str, int]] = []
+        # JSON: object start, nesting depth and string state
+        self._json_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False # A backslash ended the previous chunk
+        # HTML: the last characters seen, the document start and the end of the last closing tag
+        self._html_tail = ""
+        self._html_start: Optional[int] = None
+        self._html_doctype = False # The document starts at a doctype, not at an <html> tag
+        self._html_end = 0
+        self._closed = False
+
+    @property
+    def text(self) -> str:
+        """The response received so far."""
+        if len(self._chunks) > 1:
+            self._chunks, self._offsets = ["".join(self._chunks)], [0]
+        return self._chunks[0] if self._chunks else ""
+
+    def _slice(self, start: int, end: int) -> str:
+        """The response between two offsets, joining only the chunks they span."""
+        first = bisect_right(self._offsets, start) - 1
+        last = bisect_right(self._offsets, end - 1) - 1 if end > start else first
+        if first == last:
+            offset = self._offsets[first]
+            return self._chunks[first][start - offset:end - offset]
+        pieces = [self._chunks[first][start - self._offsets[first]:]]
+        pieces.extend(self._chunks[first + 1:last])
+        pieces.append(self._chunks[last][:end - self._offsets[last]])
+        return "".join(pieces)
+
+    @classmethod
+    def scan(cls, text: str, **kwargs) -> "StreamExtractor":
+        """Extract the artifacts of a complete response."""
+        extractor = cls(**kwargs)
+        extractor.feed(text)
+        extractor.close()
+        return extractor
+
+    def feed(self, chunk: str) -> List[Artifact]:
+        """Add the next chunk of the response. Returns the artifacts it completed."""
+        found: List[Artifact] = []
+        if not chunk:
+            return found
+        base = self._length
+        self._chunks.append(chunk)
+        self._offsets.append(base)
+        self._length += len(chunk)
+        self._scan_lines(chunk, base, found)
+        if self.json_objects:
+            self._scan_json(chunk, base, found)
+        if self.html:
+            self._scan_html(chunk, base, found)
+        self.artifacts.extend(found)
+        return found
+
+    def close(self) -> List[Artifact]:
+        """Mark the response as complete, so a closing fence on the last line without a newline counts."""
+        found: List[Artifact] = []
+        if not self._closed:
+            self._closed = True
+            if self._line:
+                self._fence_line("".join(self._line), self._line_start, self._length, found)
+                self._line = []
+                self._line_start = self._length
+            self.artifacts.extend(found)
+        return found
+
+    # --- Fenced blocks ---
+
+    def _scan_lines(self, chunk: str, base: int, found: List[Artifact]) -> None:
+        position = 0
+        while True:
+            newline = chunk.find("\n", position)
+            if newline == -1:
+                if position < len(chunk):
+                    self._line.append(chunk[position:]) # Joined once the line is complete
+                return
+            self._line.append(chunk[position:newline])
+            self._fence_line("".join(self._line), self._line_start, base + newline + 1, found)
+            self._line = []
+            self._line_start = base + newline + 1
+            position = newline + 1
+
+    def _fence_line(self, line: str, start: int, end: int, found: List[Artifact]) -> None:
+        if "```" not in line:
+            return
+        if self._fences and _CLOSING_FENCE.match(line):
+            language, content_start = self._fences.pop()
+            if not self._fences and self._wanted(language):
+                content = self._slice(content_start, start).strip()
+                found.append(Artifact("fence", content, content_start, end, language))
+            return
+        opening = _OPENING_FENCE.search(line)
+        if opening is None:
+            return
+        if not self._fences:
+            self._fences.append((opening.group(1).lower(), end))
+        elif self._fences[0][0] in _MARKDOWN_LANGUAGES and opening.group(1):
+            self._fences.append((opening.group(1).lower(), end)) # A code block inside a markdown document
+
+    def _wanted(self, language: str) -> bool:
+        return self.languages is None or language in self.languages
+
+    # --- JSON objects ---
+
+    def _scan_json(self, chunk: str, base: int, found: List[Artifact]) -> None:
+        position = 0
+        if self._escaped:
+            self._escaped, position = False, 1 # Skip the escaped character
+        while position < len(chunk):
+            if self._depth == 0:
+                brace = chunk.find("{", position)
+                if brace == -1:
+                    return
+                self._json_start, self._depth, position = base + brace, 1, brace + 1
+            elif self._in_string:
+                match = _STRING_STOP.search(chunk, position)
+                if match is None:
+                    return
+                if match.group() == "\\":
+                    if match.end() >= len(chunk):
+                        self._escaped = True # The escaped character is in the next chunk
+                        return
+                    position = match.end() + 1
+                else:
+                    self._in_string = False
+                    position = match.end()
+            else:
+                match = _JSON_STOP.search(chunk, position)
+                if match is None:
+                    return
+                position = match.end()
+                if match.group() == '"':
+                    self._in_string = True
+                elif match.group() == "{":
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        end = base + position
+                        found.append(Artifact("json", self._slice(self._json_start, end), self._json_start, end))
+
+    # --- HTML documents ---
+
+    def _scan_html(self, chunk: str, base: int, found: List[Artifact]) -> None:
+        # The tail of the previous chunks is searched again, so a marker split across chunks is still found
+        window = self._html_tail + chunk
+        window_start = base - len(self._html_tail)
+        self._html_tail = window[-_HTML_LOOKBEHIND:]
+        search_from = 0
+        if not self._html_doctype:
+            # A doctype marks the document even after an <html> tag, which may be one mentioned in prose
+            doctype = _HTML_DOCTYPE.search(window)
+            if doctype is not None:
+                self._html_start, self._html_doctype = window_start + doctype.start(), True
+                search_from = doctype.end()
+            elif self._html_start is None:
+                tag = _HTML_TAG.search(window)
+                if tag is None:
+                    return
+                self._html_start = window_start + tag.start()
+                search_from = tag.end()
+        # Every closing tag completes a candidate, the last one wins
+        for match in _HTML_END.finditer(window, max(search_from, self._html_start - window_start)):
+            end = window_start + match.end()
+            if end <= self._html_end:
+                continue # Found in the previous chunk
+            self._html_end = end
+            found.append(Artifact("html", self._slice(self._html_start, end), self._html_start, end))
+
+    # --- Results ---
+
+    def fence(self, language: str) -> Optional[str]:
+        """Content of the first complete fence with this language, or None."""
+        language = language.lower()
+        return next((artifact.text for artifact in self.artifacts if artifact.kind == "fence" and artifact.language == language), None)
+
+    def json_candidates(self) -> List[str]:
+        """Fenced blocks and balanced JSON objects, in order of position, each text once."""
+        candidates = sorted((artifact for artifact in self.artifacts if artifact.kind in ("fence", "json")), key=lambda artifact: artifact.start)
+        return list(dict.fromkeys(artifact.text.strip() for artifact in candidates if artifact.text.strip()))
+
+    def html_document(self) -> Optional[str]:
+        """The HTML document from its start to the last closing </html> tag, or None."""
+        documents = [artifact for artifact in self.artifacts if artifact.kind == "html"]
+        return documents[-1].text if documents else None
@@ -0,0 +1,257 @@
+# utils/Telemetry.py
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import litellm
+
+_LATENCY_SAMPLES = 200 # Latencies kept per aggregate for percentiles
+_RECENT_CALLS = 200 # Finished call records kept for inspection
+
+
+class CallRecord:
+    """Telemetry of one agent call, which may make several LLM requests."""
+
+    def __init__(self, project_id: Optional[str], agent_name: str, agent_type: str, model: str, operation: str):
+        self.project_id = project_id
+        self.agent_name = agent_name
+        self.agent_type = agent_type
+        self.requested_model = model # The model the agent asked for
+        self.model = model # The model that answered (the last request's, after routing), under which the call is aggregated
+        self.models_used: List[str] = [] # The models that answered each request
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.latency = 0.0
+        self.queue_wait = 0.0
+        self.time_to_first_token: Optional[float] = None
+        self.llm_requests = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.payload_bytes = 0
+        self.image_bytes = 0
+        self.extraction_ok: Optional[bool] = None
+        self.error: Optional[str] = None
+
+    def add_request(self, model: str, messages: List[Any], usage: Any = None, cache_hit: bool = False) -> None:
+        """Record one LLM request made during the call."""
+        self.llm_requests += 1
+        self.models_used.append(model)
+        self.model = model # A fallback or a winning hedge answers for another model than the requested one
+        payload_bytes, image_bytes = _payload_size(messages)
+        self.payload_bytes += payload_bytes
+        self.image_bytes += image_bytes
+        if cache_hit:
+            self.cache_hits += 1
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0
+        try:
+            prompt_cost, completion_cost = litellm.cost_per_token(
+                model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            self.cost += prompt_cost + completion_cost
+        except Exception:
+            pass # No price known for this model
+
+    def mark_first_token(self) -> None:
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in self.__dict__.items() if key != "started"}
+
+
+def _payload_size(messages: List[Any]) -> tuple:
+    """Return the approximate request payload size and the part of it taken by images, in bytes."""
+    payload_bytes = 0
+    image_bytes = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        if isinstance(content, str):
+            payload_bytes += len(content)
+        elif isinstance(content, list):
+            for entry in content:
+                if entry.get("type") == "image_url":
+                    image_url = entry["image_url"]
+                    size = len(image_url if isinstance(image_url, str) else image_url.get("url", ""))
+                    image_bytes += size
+                    payload_bytes += size
+                else:
+                    payload_bytes += len(entry.get("text", ""))
+    return payload_bytes, image_bytes
+
+
+class _Aggregate:
+    """Summed telemetry of many calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.extraction_failures = 0
+        self.llm_requests = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.payload_bytes = 0
+        self.image_bytes = 0
+        self.total_latency = 0.0
+        self.total_queue_wait = 0.0
+        self.total_time_to_first_token = 0.0
+        self.streamed_calls = 0
+        self.latencies: deque = deque(maxlen=_LATENCY_SAMPLES)
+
+    def add(self, record: CallRecord) -> None:
+        self.calls += 1
+        self.errors += 1 if record.error else 0
+        self.extraction_failures += 1 if record.extraction_ok is False else 0
+        self.llm_requests += record.llm_requests
+        self.cache_hits += record.cache_hits
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cached_tokens += record.cached_tokens
+        self.cost += record.cost
+        self.payload_bytes += record.payload_bytes
+        self.image_bytes += record.image_bytes
+        self.total_latency += record.latency
+        self.total_queue_wait += record.queue_wait
+        if record.time_to_first_token is not None:
+            self.streamed_calls += 1
+            self.total_time_to_first_token += record.time_to_first_token
+        self.latencies.append(record.latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        percentile = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "extraction_failures": self.extraction_failures,
+            "llm_requests": self.llm_requests,
+            "response_cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost_usd": round(self.cost, 6),
+            "payload_bytes": self.payload_bytes,
+            "image_bytes": self.image_bytes,
+            "avg_latency_seconds": self.total_latency / self.calls if self.calls else 0.0,
+            "p50_latency_seconds": percentile(0.5),
+            "p95_latency_seconds": percentile(0.95),
+            "avg_queue_wait_seconds": self.total_queue_wait / self.calls if self.calls else 0.0,
+            "avg_time_to_first_token_seconds": self.total_time_to_first_token / self.streamed_calls if self.streamed_calls else None,
+        }
+
+
+class Telemetry:
+    """
+    Collects per-call telemetry of agent calls and aggregates it per project,
+    agent and model. Calls are booked to the model that answered them, so
+    tokens and cost of a fallback or a hedge land on the model that served
+    them; the requested model is kept on every call record.
+
+    An agent call opens a CallRecord with `agent_call`; the LLM layer adds
+    queue wait, tokens, cost, payload sizes and time to first token to the
+    record of the current call through a context variable, so nothing has to
+    be threaded through the agents.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: contextvars.ContextVar[Optional[CallRecord]] = contextvars.ContextVar("telemetry_call", default=None)
+        self._aggregates: Dict[tuple, _Aggregate] = {} # (project id, agent name, agent type, answering model) -> aggregate
+        self._recent: deque = deque(maxlen=_RECENT_CALLS)
+
+    def current(self) -> Optional[CallRecord]:
+        """Return the record of the agent call in progress, if any."""
+        return self._current.get()
+
+    @contextmanager
+    def agent_call(self, project_id: Optional[str], agent_name: str, agent: Any, operation: str) -> Iterator[CallRecord]:
+        """
+        Record an agent call. Tasks started inside the block (e.g. hedged
+        requests) add to the same record.
+        """
+        record = CallRecord(project_id, agent_name, agent.__class__.__name__, getattr(agent, "model", ""), operation)
+        token = self._current.set(record)
+        try:
+            yield record
+        except BaseException as e:
+            record.error = type(e).__name__
+            raise
+        finally:
+            try:
+                self._current.reset(token)
+            except ValueError:
+                pass # A closed stream may be finalized from another context
+            record.latency = time.perf_counter() - record.started
+            self._finish(record)
+
+    def _finish(self, record: CallRecord) -> None:
+        with self._lock:
+            key = (record.project_id, record.agent_name, record.agent_type, record.model)
+            self._aggregates.setdefault(key, _Aggregate()).add(record)
+            self._recent.append(record.to_dict())
+        ttft = f", first token {record.time_to_first_token:.2f}s" if record.time_to_first_token is not None else ""
+        print(f"Agent '{record.agent_name}' {record.operation}: {record.latency:.2f}s (queue {record.queue_wait:.2f}s{ttft}), "
+              f"{record.prompt_tokens}+{record.completion_tokens} tokens ({record.cached_tokens} cached), "
+              f"{record.image_bytes} image bytes, ${record.cost:.4f}"
+              + (f", failed: {record.error}" if record.error else "")
+              + (", extraction failed" if record.extraction_ok is False else ""))
+
+    def _group(self, key_index: Optional[int], project_id: Optional[str] = None, filter_project: bool = False) -> Dict[str, Any]:
+        grouped: Dict[str, _Aggregate] = {}
+        with self._lock:
+            for key, aggregate in self._aggregates.items():
+                if filter_project and key[0] != project_id:
+                    continue
+                group = grouped.setdefault("total" if key_index is None else str(key[key_index]), _Aggregate())
+                _merge(group, aggregate)
+        return {name: aggregate.to_dict() for name, aggregate in grouped.items()}
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return telemetry aggregated overall and per project, agent type and model."""
+        return {
+            "total": self._group(None).get("total", _Aggregate().to_dict()),
+            "by_project": self._group(0),
+            "by_agent_type": self._group(2),
+            "by_model": self._group(3),
+        }
+
+    def project_stats(self, project_id: str) -> Dict[str, Any]:
+        """Return the telemetry of a project, in total and per agent and model."""
+        return {
+            "total": self._group(None, project_id, True).get("total", _Aggregate().to_dict()),
+            "by_agent": self._group(1, project_id, True),
+            "by_model": self._group(3, project_id, True),
+            "recent_calls": [record for record in self.recent_calls() if record["project_id"] == project_id],
+        }
+
+    def recent_calls(self) -> List[Dict[str, Any]]:
+        """Return the most recent call records, oldest first."""
+        with self._lock:
+            return list(self._recent)
+
+
+def _merge(target: _Aggregate, source: _Aggregate) -> None:
+    """Add the counters of one aggregate to another."""
+    for name, value in source.__dict__.items():
+        if name == "latencies":
+            target.latencies.extend(value)
+        else:
+            setattr(target, name, getattr(target, name) + value)
+
+
+# Shared telemetry collector
+telemetry = Telemetry()
@@ -0,0 +1,48 @@
+# utils/TokenCounter.py
+from typing import Any, Dict, List
+
+import tiktoken
+
+# Rough cost of one image in prompt tokens; providers differ, this errs on the high side
+IMAGE_TOKEN_ESTIMATE = 800
+
+_encoding = None
+
+
+def _get_encoding():
+    """Load the tokenizer once. Returns None if it cannot be loaded (e.g. offline)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Could not load tiktoken encoding, falling back to estimates: {e}")
+            _encoding = False
+    return _encoding or None
+
+
+def count_text_tokens(text: str) -> int:
+    """Count the tokens of a text. Falls back to ~4 characters per token without tiktoken."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Count the prompt tokens of a conversation, estimating a fixed cost per image."""
+    total = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        total += 4 # Per-message overhead (role, separators)
+        if isinstance(content, str):
+            total += count_text_tokens(content)
+        elif isinstance(content, list):
+            for entry in content:
+                if entry.get("type") == "text":
+                    total += count_text_tokens(entry.get("text", ""))
+                elif entry.get("type") in ("image_url", "image_ref"):
+                    total += IMAGE_TOKEN_ESTIMATE
+    return total
@@ -0,0 +1,8 @@
+# Test configuration: the application modules are imported from src, as when the server runs from there
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+# config refuses to load without a key; no test calls the provider
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from agents.PrototypeAgent import PrototypeAgent
+from utils.AgentRegistry import AgentRegistry
+from utils.AgentStore import AgentStore
+from utils.Project import Project
+
+
+def make_registry() -> AgentRegistry:
+    return AgentRegistry(AgentStore({"PrototypeAgent": PrototypeAgent}, "agent_sessions", 8, 10**8))
+
+
+@pytest.fixture
+def projects(tmp_path):
+    project_a, project_b = Project("a", str(tmp_path)), Project("b", str(tmp_path))
+    project_b.id = project_a.id + "-b" # Ids are time based, two projects made in the same instant may share one
+    project_b.project_dir = str(tmp_path / "b")
+    return project_a, project_b
+
+
+def test_same_agent_name_in_two_projects(projects):
+    project_a, project_b = projects
+    registry = make_registry()
+    agent_a, agent_b = PrototypeAgent("writer", "model-a"), PrototypeAgent("writer", "model-b")
+    registry.add("writer", agent_a, project_a)
+    assert not registry.exists("writer", project_b)
+    registry.add("writer", agent_b, project_b)
+
+    assert registry.get("writer", project_a) is agent_a
+    assert registry.get("writer", project_b) is agent_b
+    assert registry.names_with_type("PrototypeAgent", project_b) == ["writer"]
+
+    async def use(project):
+        async with registry.session("writer", project) as agent:
+            return agent
+    assert asyncio.run(use(project_b)) is agent_b
+
+    # Each session is persisted in its own project and rehydrated from there after a restart
+    restarted = make_registry()
+    assert restarted.get("writer", project_a).model == "model-a"
+    assert restarted.get("writer", project_b).model == "model-b"
+
+    restarted.remove("writer", project_b)
+    assert not make_registry().exists("writer", project_b)
+    assert make_registry().exists("writer", project_a)
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+from utils.ContextAssembler import assemble_project_context
+
+
+class RecordingIndex:
+    """Retrieval index returning a fixed chunk and recording the query."""
+
+    def __init__(self, retrieved):
+        self.retrieved = retrieved
+        self.queries = []
+
+    def sync_context(self, context):
+        pass
+
+    def retrieve(self, query, top_k, kinds):
+        self.queries.append(query)
+        return self.retrieved
+
+
+def make_context(index):
+    return SimpleNamespace(
+        project_name="Shop",
+        requirements=SimpleNamespace(input_description="orders", output_description="invoices",
+                                     features={}, further_requirements=""),
+        generated_text_doc={"SRS": "requirements " * 3000, "Glossary": "terms " * 3000},
+        generated_diagram={},
+        csv_description=[],
+        retrieval_index=index,
+    )
+
+
+def test_retrieval_uses_the_target_and_reports_unretrieved_sources():
+    index = RecordingIndex({"doc:SRS": "requirements chunk"})
+    kept, report = assemble_project_context(make_context(index), "gpt-4o", 59_000, target="API Specification")
+
+    assert index.queries == ["API Specification"]
+    assert kept == {"doc:SRS": "requirements chunk"}
+    dropped = [entry for entry in report if entry["section"] == "doc:Glossary"]
+    assert dropped and dropped[0]["action"] == "dropped" and dropped[0]["original_tokens"] > 0
+
+
+def test_retrieval_starts_from_the_model_budget():
+    index = RecordingIndex({"doc:SRS": "requirements chunk"})
+    # Both documents fit the budget left by the prompt, so nothing is retrieved
+    kept, report = assemble_project_context(make_context(index), "gpt-4o", 0, target="API Specification")
+    assert index.queries == []
+    assert set(kept) == {"doc:SRS", "doc:Glossary"}
@@ -0,0 +1,52 @@
+import json
+
+from agents.DiagramAgent import ClassDiagramAgent, DIAGRAM_TYPE
+from agents.schema.DiagramSchemaRegistry import schema_for
+from utils.Context import Context
+
+DIAGRAM = {
+    "diagramType": DIAGRAM_TYPE.CLASS_DIAGRAM,
+    "diagramName": "Shop",
+    "classes": [{"name": "Order"}, {"name": "Customer"}],
+}
+
+
+def make_agent():
+    agent = ClassDiagramAgent("Shop", "gpt-4o")
+    agent.diagram_type_str = DIAGRAM_TYPE.CLASS_DIAGRAM
+    return agent
+
+
+def test_partial_edit_does_not_replace_the_stored_diagram():
+    agent = make_agent()
+    context = Context()
+    agent.publish_document(context, json.dumps(DIAGRAM))
+
+    # The edit holds only the changed relationship, without the classes
+    partial = {"diagramType": DIAGRAM_TYPE.CLASS_DIAGRAM, "relationships": [
+        {"type": "association", "fromClass": "Order", "toClass": "Customer"}]}
+    edited = agent._finish_edit(f"```json\n{json.dumps(partial)}\n```")
+
+    assert edited == partial
+    assert agent.publish_document(context, edited) is None
+    assert context.generated_diagram == {"Shop": DIAGRAM}
+
+
+def test_complete_edit_replaces_the_stored_diagram():
+    agent = make_agent()
+    context = Context()
+    agent.publish_document(context, json.dumps(DIAGRAM))
+
+    complete = dict(DIAGRAM, classes=[{"name": "Order"}])
+    edited = agent._finish_edit(f"```json\n{json.dumps(complete)}\n```")
+
+    assert agent.publish_document(context, edited) == ("diagram", "Shop")
+    assert context.generated_diagram == {"Shop": complete}
+
+
+def test_every_diagram_type_has_a_schema():
+    diagram_types = [value for name, value in vars(DIAGRAM_TYPE).items() if name.isupper()]
+    assert len(diagram_types) == 6
+    for diagram_type in diagram_types:
+        schema = schema_for(diagram_type)
+        assert schema is not None and schema.prompt_schema, diagram_type
@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from utils.LLMScheduler import LLMScheduler
+
+
+def make_scheduler() -> LLMScheduler:
+    return LLMScheduler({}, {"rpm": 0, "tpm": 0, "concurrency": 0}, max_retries=3, backoff_base=0.5, backoff_max=30.0)
+
+
+def rate_limit(retry_after):
+    return SimpleNamespace(status_code=429, response=SimpleNamespace(headers={"retry-after": retry_after}))
+
+
+def test_retry_after_is_capped_at_the_backoff_maximum():
+    scheduler = make_scheduler()
+    assert scheduler._retry_after(rate_limit("2")) == 2.0
+    assert scheduler._retry_after(rate_limit("86400")) == 30.0
+    assert scheduler._retry_after(rate_limit("Wed, 21 Oct 2099 07:28:00 GMT")) == 30.0
+
+
+def test_malformed_retry_after_is_ignored():
+    scheduler = make_scheduler()
+    assert scheduler._retry_after(rate_limit("soon")) is None
+    delay = scheduler.retry_delay("model", rate_limit("soon"), 0)
+    assert delay is not None and delay <= 30.0
@@ -0,0 +1,14 @@
+from utils.MarkdownPatch import apply_patch
+
+DOCUMENT = "# Spec\n\n## Scope\n\nOld scope.\n\n## Glossary\n\nTerms."
+
+
+def test_replacement_starting_with_a_deeper_heading_keeps_the_section_heading():
+    patched = apply_patch(DOCUMENT, [("replace", "Scope", "### In scope\n\nOrders.")])
+    assert patched.split("\n")[:5] == ["# Spec", "", "## Scope", "", "### In scope"]
+    assert "Old scope." not in patched and "## Glossary" in patched
+
+
+def test_replacement_starting_with_a_heading_of_the_same_level_renames_the_section():
+    patched = apply_patch(DOCUMENT, [("replace", "Scope", "## Boundaries\n\nOrders.")])
+    assert "## Boundaries" in patched and "## Scope" not in patched
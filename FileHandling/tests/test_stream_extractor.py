@@ -0,0 +1,28 @@
+import random
+
+from utils.StreamExtractor import StreamExtractor
+
+DOCUMENT = "<!DOCTYPE html>\n<html lang=\"en\">\n<body><p>Shop</p></body>\n</html>"
+RESPONSE = f"Use the <html> tag as the root of the page.\n\n```html\n{DOCUMENT}\n```\nDone."
+
+
+def feed_in_chunks(text, seed):
+    rng = random.Random(seed)
+    extractor = StreamExtractor(languages=(), html=True)
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 7)
+        extractor.feed(text[position:position + size])
+        position += size
+    extractor.close()
+    return extractor
+
+
+def test_doctype_wins_over_an_earlier_html_tag_in_prose():
+    for seed in range(50):
+        assert feed_in_chunks(RESPONSE, seed).html_document() == DOCUMENT
+
+
+def test_html_tag_starts_the_document_without_a_doctype():
+    document = DOCUMENT.split("\n", 1)[1]
+    assert StreamExtractor.scan(f"Here it is:\n{document}\n", languages=(), html=True).html_document() == document
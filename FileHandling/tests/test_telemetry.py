@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+
+from utils.Telemetry import Telemetry
+
+
+def test_calls_are_booked_to_the_model_that_answered():
+    telemetry = Telemetry()
+    agent = SimpleNamespace(model="primary-model")
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20)
+    with telemetry.agent_call("project", "writer", agent, "generate") as record:
+        # The route fell back: the request was answered by another model
+        record.add_request("fallback-model", [{"role": "user", "content": "hi"}], usage)
+
+    assert record.requested_model == "primary-model"
+    assert record.model == "fallback-model"
+    by_model = telemetry.metrics()["by_model"]
+    assert set(by_model) == {"fallback-model"}
+    assert by_model["fallback-model"]["prompt_tokens"] == 100
+    assert telemetry.recent_calls()[-1]["requested_model"] == "primary-model"